@@ -1,18 +1,40 @@
 import os
+import sys
+import hashlib
+import gzip
+import queue
+import shutil
+import signal
 import asyncio
 import datetime
 import time
 import json
-import requests
+import html
+import uuid
+import heapq
+import itertools
+import functools
+from dataclasses import dataclass
+from types import MappingProxyType
+import threading
+import sqlite3
+import aiohttp
+from aiohttp import web
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import FSInputFile
+from aiogram.types import FSInputFile, BufferedInputFile
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 import supabase
-from supabase import create_client
+from supabase import create_client, PostgrestAPIError
 from dotenv import load_dotenv
 
 # Проверка на Railway - всегда загружаем .env для локальной разработки
@@ -49,16 +71,453 @@ SBER_ACCOUNT = "2200701684127670"
 
 # Путь к картинке мероприятия - УБЕДИТЕСЬ ЧТО ФАЙЛ СУЩЕСТВУЕТ!
 EVENT_IMAGE_PATH = "event_image.jpg"
+MEDIA_CHECK_INTERVAL = float(os.getenv("MEDIA_CHECK_INTERVAL", "30"))  # Как часто проверять, не изменилась ли картинка, сек
+MEDIA_WARMUP_CHAT_ID = os.getenv("MEDIA_WARMUP_CHAT_ID")  # Чат для загрузки картинки при старте (сообщение сразу удаляется)
+
+# Каталог мероприятий и тарифов (таблицы events и tariffs в Supabase)
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "60"))  # Как часто перечитывать каталог, сек
+
+# Учет мест (лимиты тарифов и мероприятий)
+HOLD_TTL = int(os.getenv("HOLD_TTL", "1800"))  # Сколько держим место за пользователем на шаге оплаты, сек
+INVENTORY_RECONCILE_INTERVAL = float(os.getenv("INVENTORY_RECONCILE_INTERVAL", "60"))  # Сверка счетчиков с заказами, сек
+
+# Сроки брошенных оформлений и заказов
+HOLD_EXPIRY_NOTIFY = os.getenv("HOLD_EXPIRY_NOTIFY", "1") == "1"  # Напоминать пользователю, что бронь истекла
+CHECKOUT_TTL = int(os.getenv("CHECKOUT_TTL", str(2 * 3600)))  # Через сколько очищать брошенную корзину на шаге оплаты, сек (меньше FSM_TTL)
+PENDING_ORDER_TTL = int(os.getenv("PENDING_ORDER_TTL", "0"))  # Через сколько неподтвержденный заказ истекает, сек (0 - никогда)
+ORDER_TIMERS_RETRY_DELAY = 60  # Повтор восстановления сроков заказов после перезапуска, если Supabase не ответил, сек
+RELEASED_STATUSES = ("canceled", "expired")  # Заказы с этими статусами не занимают места
 
 # Настройки файлов
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB максимальный размер файла
 SUPPORTED_DOCUMENT_TYPES = ['.pdf', '.jpg', '.jpeg', '.png']
+STREAM_CHUNK_SIZE = 64 * 1024  # Размер чанка при потоковой перекачке чеков
+RECEIPT_LIST_PAGE_SIZE = 100  # Размер страницы при поиске чеков в Storage
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "4"))  # Одновременных загрузок чеков в Storage
+RECEIPT_QUEUE_SIZE = int(os.getenv("RECEIPT_QUEUE_SIZE", "1000"))  # Максимум чеков в очереди на загрузку
+RECEIPT_MAX_ATTEMPTS = int(os.getenv("RECEIPT_MAX_ATTEMPTS", "5"))  # Попыток загрузки одного чека
+RECEIPT_RETRY_DELAY = float(os.getenv("RECEIPT_RETRY_DELAY", "5"))  # Пауза перед повтором, сек (удваивается)
+
+# Настройки HTTP-клиента
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "120"))
+
+# Настройки пула запросов к Supabase
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))  # Одновременных запросов к Supabase
+DB_CALL_TIMEOUT = float(os.getenv("DB_CALL_TIMEOUT", "15"))  # Таймаут одного запроса, сек
+STATS_TTL = float(os.getenv("STATS_TTL", "60"))  # Время жизни кэша статистики, сек
+ORDERS_PAGE_SIZE = 10  # Заказов на странице /orders и /paid
+BULK_MAX_ORDERS = 200  # Максимум заказов в одной команде /bulk
+# Колонки для списков заказов: без JSON участников (их число - в participants_count)
+ORDER_LIST_COLUMNS = "id, user_id, username, tariff, total_price, status, created_at, participants_count"
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "5"))  # Ошибок подряд, после которых запросы к Supabase отклоняются сразу
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", "30"))  # Через сколько секунд пробуем Supabase снова
+JOURNAL_RETRY_DELAY = float(os.getenv("JOURNAL_RETRY_DELAY", "5"))  # Пауза перед повторной отправкой заказа из журнала, сек (удваивается)
+JOURNAL_MAX_DELAY = float(os.getenv("JOURNAL_MAX_DELAY", "300"))  # Максимальная пауза между повторами, сек
+JOURNAL_KEEP_DAYS = 7  # Сколько дней хранить отправленные записи журнала
+JOURNAL_MAX_ERRORS = int(os.getenv("JOURNAL_MAX_ERRORS", "5"))  # После скольких отказов Supabase заказ из журнала откладывается для админа
+STARTUP_CHECK_TIMEOUT = float(os.getenv("STARTUP_CHECK_TIMEOUT", "10"))  # Сколько ждать каждую проверку при запуске, сек
+
+# Настройки рассылки
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # Сообщений в секунду (лимит Telegram ~30)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))  # Одновременных отправок
+BROADCAST_MAX_RETRIES = 3  # Повторов при flood-wait
+BROADCAST_PROGRESS_INTERVAL = 5  # Как часто обновлять сообщение о прогрессе, сек
+BROADCAST_PERSIST_INTERVAL = 1  # Как часто сохранять курсор рассылки, сек
+BROADCAST_JOB_PATH = os.getenv("BROADCAST_JOB_PATH", "broadcast_job.json")
+
+# Локальное хранилище состояния бота (SQLite)
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "bot_state.db")
+USERS_FLUSH_INTERVAL = float(os.getenv("USERS_FLUSH_INTERVAL", "2"))  # Как часто сбрасывать пользователей на диск, сек
+LEGACY_USERS_PATH = "users.json"  # Старый список пользователей, импортируется при первом запуске
+
+# Настройки логирования
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text - как раньше, json - JSON-lines
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "1") == "1"  # Дублировать логи действий в консоль
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Максимум записей в очереди
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")  # drop - терять записи, block - ждать записи на диск
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))  # Как часто писать пачку на диск, сек
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # Ротация по размеру
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", "86400"))  # Ротация по времени
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))  # Сколько сжатых архивов хранить (0 - не хранить, старая часть удаляется)
+
+# Запись входящих апдейтов для воспроизведения в бенчмарке (python -m bench.replay)
+UPDATE_CAPTURE_PATH = os.getenv("UPDATE_CAPTURE_PATH")  # Например updates.jsonl; пусто - не записывать
+UPDATE_CAPTURE_SALT = os.getenv("UPDATE_CAPTURE_SALT") or uuid.uuid4().hex  # Соль псевдонимов id (постоянная - id совпадают между перезапусками)
+
+# Хранилище состояний FSM (корзины пользователей)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")  # memory | sqlite | redis
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))  # Брошенная сессия удаляется через, сек
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))  # Как часто сбрасывать изменения, сек
+REDIS_URL = os.getenv("REDIS_URL")  # Для FSM_STORAGE=redis (несколько реплик бота)
+
+# Режим получения обновлений
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling - для локальной разработки, webhook - для web-процесса
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")  # Например https://gedan-bot.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "25"))  # Ожидание текущих обработчиков при остановке
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Свой сервер Bot API (локальный telegram-bot-api или стенд bench/); пусто - api.telegram.org
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# Метрики Prometheus и проверки живости (/metrics, /livez, /readyz)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Порт для них в режиме polling (0 - не поднимать); в webhook они на PORT
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "15"))  # Как часто проверять доступность Supabase для /readyz, сек
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # Как часто замерять задержку event loop, сек
+
+if CHECKOUT_TTL >= FSM_TTL:
+    raise ValueError(f"""
+❌ CHECKOUT_TTL ({CHECKOUT_TTL}с) должен быть меньше FSM_TTL ({FSM_TTL}с)!
+Иначе хранилище удалит сессию раньше, чем бот очистит корзину и вернет бронь
+""")
+
+if BOT_MODE == "webhook" and (not WEBHOOK_BASE_URL or not WEBHOOK_SECRET):
+    raise ValueError("""
+❌ Для BOT_MODE=webhook нужны WEBHOOK_BASE_URL и WEBHOOK_SECRET!
+Один и тот же WEBHOOK_SECRET должен быть у всех реплик бота
+""")
+
+def open_local_db(path=LOCAL_DB_PATH):
+    """Открывает локальную SQLite базу в WAL-режиме (общая для подсистем бота)"""
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=FULL")
+    return connection
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище, переживающее перезапуск бота
+    
+    Состояния и данные живут в памяти, а изменения сбрасываются в SQLite пачкой
+    раз в FSM_FLUSH_INTERVAL секунд, поэтому update_data не стоит записи на диск.
+    Сессии без активности дольше FSM_TTL считаются пустыми и удаляются."""
+    def __init__(self, path=LOCAL_DB_PATH, ttl=FSM_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self.cache = {}
+        self.dirty = set()
+        # lock - кэш и чтение из SQLite (цикл событий), flush_lock - запись (поток сброса)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._connection = None
+        self._writer = None
+    
+    def _open(self):
+        connection = open_local_db(self.path)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        return connection
+    
+    @property
+    def connection(self):
+        """Соединение для чтения сессий; используется только под self.lock"""
+        if self._connection is None:
+            self._connection = self._open()
+        return self._connection
+    
+    @property
+    def writer(self):
+        """Отдельное соединение для сброса: транзакция в потоке не пересекается с чтением в цикле событий"""
+        if self._writer is None:
+            self._writer = self._open()
+        return self._writer
+    
+    def _entry(self, key, action, modify=False):
+        """Выполняет action(entry) над записью сессии и возвращает его результат
+        
+        Поиск (с подгрузкой из SQLite) и изменение идут под одной блокировкой, иначе
+        flush из другого потока может выкинуть запись из кэша между ними и изменение
+        потеряется. Просроченная сессия считается пустой."""
+        storage_key = self.key_builder.build(key)
+        with self.lock:
+            now = time.time()
+            entry = self.cache.get(storage_key)
+            if entry is None:
+                row = self.connection.execute(
+                    "SELECT state, data, updated_at FROM fsm WHERE key = ?", (storage_key,)
+                ).fetchone()
+                entry = {'state': None, 'data': {}, 'updated_at': now}
+                if row and now - row[2] < self.ttl:
+                    entry = {'state': row[0], 'data': json.loads(row[1]), 'updated_at': row[2]}
+                self.cache[storage_key] = entry
+            elif now - entry['updated_at'] >= self.ttl:
+                entry.update(state=None, data={})
+                self.dirty.add(storage_key)
+            result = action(entry)
+            if modify:
+                entry['updated_at'] = now
+                self.dirty.add(storage_key)
+            return result
+    
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        self._entry(key, lambda entry: entry.update(state=state), modify=True)
+    
+    async def get_state(self, key):
+        return self._entry(key, lambda entry: entry['state'])
+    
+    async def set_data(self, key, data):
+        data = data.copy()
+        self._entry(key, lambda entry: entry.update(data=data), modify=True)
+    
+    async def get_data(self, key):
+        return self._entry(key, lambda entry: entry['data'].copy())
+    
+    def sessions_in_states(self, states):
+        """(ключ, updated_at) непросроченных сессий в состояниях states из SQLite"""
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT key, updated_at FROM fsm WHERE state IN ({', '.join('?' * len(states))}) AND updated_at > ?",
+                (*states, time.time() - self.ttl)
+            ).fetchall()
+    
+    def flush(self):
+        """Сбрасывает измененные сессии одной транзакцией и чистит просроченные
+        
+        Пустые сессии остаются в кэше до истечения FSM_TTL: пока DELETE не записан,
+        подгрузка из SQLite вернула бы старое состояние."""
+        with self.flush_lock:
+            now = time.time()
+            with self.lock:
+                upserts, deletes = [], []
+                for storage_key in self.dirty:
+                    entry = self.cache.get(storage_key)
+                    if entry is None or (entry['state'] is None and not entry['data']):
+                        deletes.append((storage_key,))
+                    else:
+                        upserts.append((storage_key, entry['state'], json.dumps(entry['data'], ensure_ascii=False), entry['updated_at']))
+                self.dirty = set()
+                # Неактивные сессии не держим в памяти (в SQLite они тоже просрочены)
+                for storage_key in [k for k, entry in self.cache.items() if now - entry['updated_at'] >= self.ttl]:
+                    del self.cache[storage_key]
+            try:
+                with self.writer:
+                    self.writer.execute("BEGIN")
+                    if upserts:
+                        self.writer.executemany("""
+                            INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                updated_at = excluded.updated_at
+                        """, upserts)
+                    if deletes:
+                        self.writer.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+                    self.writer.execute("DELETE FROM fsm WHERE updated_at < ?", (now - self.ttl,))
+            except Exception as e:
+                print(f"⚠️ Не удалось сохранить состояния FSM: {e}")
+                with self.lock:
+                    self.dirty.update(row[0] for row in upserts + deletes)
+    
+    async def run_flusher(self, interval=FSM_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+    
+    def count_states(self):
+        """Число непросроченных сессий по состояниям (только загруженные в память)"""
+        now = time.time()
+        counts = {}
+        with self.lock:
+            for entry in self.cache.values():
+                if entry['state'] is not None and now - entry['updated_at'] < self.ttl:
+                    counts[entry['state']] = counts.get(entry['state'], 0) + 1
+        return counts
+    
+    async def close(self):
+        await asyncio.to_thread(self.flush)
+        for name in ("_connection", "_writer"):
+            connection = getattr(self, name)
+            if connection is not None:
+                connection.close()
+                setattr(self, name, None)
+
+def create_fsm_storage():
+    """Создает FSM-хранилище согласно FSM_STORAGE"""
+    if FSM_STORAGE == "redis":
+        # Общие состояния для нескольких реплик; TTL выставляет сам Redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
 
 # Инициализация бота
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+storage = create_fsm_storage()
 dp = Dispatcher(storage=storage)
 
+# Фоновые задачи бота (храним ссылки, чтобы задачи не собрал сборщик мусора)
+background_tasks = set()
+
+def spawn(coro):
+    """Запускает корутину в фоне"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# МЕТРИКИ (текстовый формат Prometheus без внешних библиотек)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+    """Счетчик, gauge или гистограмма с метками; обновляется из event loop и пула Supabase"""
+    def __init__(self, name, help_text, kind, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # значения меток -> число или [счетчики корзин, сумма, количество]
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def replace(self, values):
+        """Целиком заменяет значения gauge (для метрик, которые считаются при запросе)"""
+        with self.lock:
+            self.values = {self._key(labels): value for labels, value in values}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @staticmethod
+    def _format_labels(pairs):
+        if not pairs:
+            return ""
+        escaped = []
+        for name, value in pairs:
+            value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{name}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(key, [list(value[0]), value[1], value[2]] if self.kind == "histogram" else value)
+                     for key, value in sorted(self.values.items())]
+        for key, value in items:
+            pairs = list(zip(self.labels, key))
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{self._format_labels(pairs)} {value}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self._format_labels(pairs + [('le', str(bound))])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(pairs)} {count}")
+        return "\n".join(lines)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # функции, обновляющие gauge перед выдачей /metrics
+
+    def add(self, name, help_text, kind, labels=()):
+        metric = Metric(name, help_text, kind, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"⚠️ Ошибка сбора метрик {collect.__name__}: {e}")
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+metrics = MetricsRegistry()
+handler_seconds = metrics.add("gedan_handler_duration_seconds", "Время обработчика апдейта", "histogram", ("handler",))
+handler_errors = metrics.add("gedan_handler_errors_total", "Необработанные исключения обработчиков", "counter", ("handler",))
+updates_in_flight = metrics.add("gedan_updates_in_flight", "Апдейтов в обработке сейчас", "gauge")
+db_seconds = metrics.add("gedan_db_duration_seconds", "Время вызова Database (с ожиданием в пуле)", "histogram", ("method", "outcome"))
+storage_seconds = metrics.add("gedan_storage_duration_seconds", "Время операции Supabase Storage", "histogram", ("operation", "outcome"))
+telegram_seconds = metrics.add("gedan_telegram_duration_seconds", "Время вызова Bot API", "histogram", ("method", "outcome"))
+orders_total = metrics.add("gedan_orders_total", "Заказов, перешедших в статус, с запуска процесса", "counter", ("status",))
+orders_gauge = metrics.add("gedan_orders", "Заказов по статусам (кэш статистики, без запроса к Supabase)", "gauge", ("status",))
+broadcast_messages = metrics.add("gedan_broadcast_messages_total", "Сообщений рассылки по результату", "counter", ("result",))
+broadcast_running_gauge = metrics.add("gedan_broadcast_running", "Идет ли рассылка", "gauge")
+fsm_sessions = metrics.add("gedan_fsm_sessions", "Активных сессий FSM по состояниям", "gauge", ("state",))
+loop_lag_seconds = metrics.add("gedan_event_loop_lag_seconds", "Задержка пробуждения event loop", "histogram")
+supabase_up = metrics.add("gedan_supabase_up", "Доступен ли Supabase (последняя фоновая проверка)", "gauge")
+
+# Время каждого обработчика (внутренний middleware знает, какой обработчик выбран)
+async def observe_handler(handler, event, data):
+    name = data["handler"].callback.__name__
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        handler_errors.inc(handler=name)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, handler=name)
+
+async def count_in_flight(handler, event, data):
+    updates_in_flight.inc()
+    try:
+        return await handler(event, data)
+    finally:
+        updates_in_flight.inc(-1)
+
+dp.update.outer_middleware(count_in_flight)
+dp.message.middleware(observe_handler)
+dp.callback_query.middleware(observe_handler)
+
+# Время каждого вызова Bot API
+async def observe_bot_request(make_request, bot, method):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await make_request(bot, method)
+        outcome = "ok"
+        return result
+    finally:
+        telegram_seconds.observe(time.perf_counter() - started, method=method.__api_method__, outcome=outcome)
+
+bot.session.middleware(observe_bot_request)
+
+async def run_loop_lag_monitor(interval=LOOP_LAG_INTERVAL):
+    """Насколько позже запланированного просыпается event loop (занятость обработчиками)"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, time.perf_counter() - started - interval))
+
 # Инициализация Supabase
 try:
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -67,74 +526,134 @@ except Exception as e:
     print(f"❌ Ошибка подключения к Supabase: {e}")
     supabase_client = None
 
+# ОБЩАЯ HTTP-СЕССИЯ (пул соединений для Telegram file API и Supabase Storage)
+http_session = None
+
+async def get_http_session():
+    """Возвращает общую aiohttp-сессию с пулом соединений (создается при первом обращении)"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+        )
+    return http_session
+
+async def close_http_session():
+    """Закрывает общую HTTP-сессию при остановке бота"""
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+def storage_headers(mime_type=None):
+    """Заголовки авторизации для REST API Supabase Storage"""
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "apikey": SUPABASE_KEY,
+    }
+    if mime_type:
+        headers["Content-Type"] = mime_type
+    return headers
+
+async def _stream_with_limit(response, limit, counter):
+    """Отдает тело ответа чанками и обрывает поток при превышении лимита размера"""
+    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+        counter["bytes"] += len(chunk)
+        if counter["bytes"] > limit:
+            raise ValueError(f"файл больше {limit // (1024*1024)}MB")
+        yield chunk
+
 # ФУНКЦИИ ДЛЯ РАБОТЫ С SUPABASE STORAGE
 async def upload_receipt_to_supabase(bot: Bot, file_id: str, file_type: str, order_id: int, user_data: dict):
-    """Загружает чек в Supabase Storage и возвращает URL"""
+    """Потоково перекачивает чек из Telegram в Supabase Storage и возвращает URL и тайминги этапов"""
+    timings = {}
+    started = time.perf_counter()
     try:
         print(f"📤 Начинаем загрузку чека в Supabase Storage для заказа #{order_id}...")
         
         # Получаем файл от Telegram
         file = await bot.get_file(file_id)
-        file_path = file.file_path
-        
-        # Скачиваем файл
-        file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-        response = requests.get(file_url)
-        
-        if response.status_code == 200:
-            # Определяем расширение и MIME тип
-            if file_type == 'document':
-                file_extension = ".pdf"
-                mime_type = "application/pdf"
-            else:  # photo
-                file_extension = ".jpg" 
-                mime_type = "image/jpeg"
-            
-            # Создаем уникальное имя файла
-            file_name = f"receipt_order_{order_id}_{user_data['user_id']}{file_extension}"
-            
-            print(f"📁 Загружаем файл: {file_name}")
-            print(f"📏 Размер файла: {len(response.content)} байт")
+        timings["get_file"] = time.perf_counter() - started
+        
+        if file.file_size and file.file_size > MAX_FILE_SIZE:
+            print(f"❌ Файл чека для заказа #{order_id} слишком большой: {file.file_size} байт")
+            return None
+        
+        # Определяем расширение и MIME тип
+        if file_type == 'document':
+            file_extension = ".pdf"
+            mime_type = "application/pdf"
+        else:  # photo
+            file_extension = ".jpg" 
+            mime_type = "image/jpeg"
+        
+        # Создаем уникальное имя файла
+        file_name = f"receipt_order_{order_id}_{user_data['user_id']}{file_extension}"
+        file_url = bot.session.api.file_url(bot.token, file.file_path)
+        upload_url = f"{SUPABASE_URL}/storage/v1/object/receipts/{file_name}"
+        
+        print(f"📁 Загружаем файл: {file_name}")
+        
+        # Скачиваем из Telegram и сразу отдаем в Storage, не держа файл целиком в памяти
+        session = await get_http_session()
+        counter = {"bytes": 0}
+        stage_started = time.perf_counter()
+        async with session.get(file_url) as response:
+            if response.status != 200:
+                print(f"❌ Ошибка скачивания файла из Telegram: {response.status}")
+                return None
+            if response.content_length and response.content_length > MAX_FILE_SIZE:
+                print(f"❌ Файл чека для заказа #{order_id} слишком большой: {response.content_length} байт")
+                return None
             
-            try:
-                # Загружаем в Supabase Storage
-                result = supabase_client.storage.from_("receipts").upload(
-                    file_name,
-                    response.content,
-                    {"content-type": mime_type}
-                )
-                
-                if result:
-                    print(f"✅ Файл успешно загружен в Supabase Storage: {file_name}")
-                    
-                    # Получаем публичный URL
-                    public_url = supabase_client.storage.from_("receipts").get_public_url(file_name)
-                    
-                    # ОБНОВЛЯЕМ ЗАПИСЬ В SUPABASE С ССЫЛКОЙ НА ФАЙЛ
-                    supabase_client.table("orders")\
-                        .update({
-                            "receipt_file_name": file_name,
-                            "receipt_file_url": public_url
-                        })\
-                        .eq("id", order_id)\
-                        .execute()
-                    
-                    return {
-                        "file_name": file_name,
-                        "public_url": public_url,
-                        "file_size": len(response.content)
-                    }
-                else:
-                    print("❌ Ошибка загрузки в Supabase Storage - результат пустой")
+            headers = storage_headers(mime_type)
+            headers["x-upsert"] = "true"
+            async with session.post(
+                upload_url,
+                data=_stream_with_limit(response, MAX_FILE_SIZE, counter),
+                headers=headers
+            ) as upload_response:
+                if upload_response.status not in (200, 201):
+                    storage_seconds.observe(time.perf_counter() - stage_started, operation="upload", outcome="error")
+                    error_text = await upload_response.text()
+                    print(f"❌ Ошибка загрузки в Supabase Storage: {upload_response.status} {error_text[:200]}")
                     return None
-                    
-            except Exception as upload_error:
-                print(f"❌ Ошибка при загрузке в Supabase Storage: {upload_error}")
-                return None
-                
-        else:
-            print(f"❌ Ошибка скачивания файла из Telegram: {response.status_code}")
+        timings["stream"] = time.perf_counter() - stage_started
+        storage_seconds.observe(timings["stream"], operation="upload", outcome="ok")
+        
+        print(f"✅ Файл успешно загружен в Supabase Storage: {file_name}")
+        print(f"📏 Размер файла: {counter['bytes']} байт")
+        remember_receipt_file(order_id, file_name, counter["bytes"], mime_type)
+        
+        # Получаем публичный URL
+        public_url = supabase_client.storage.from_("receipts").get_public_url(file_name)
+        
+        # ОБНОВЛЯЕМ ЗАПИСЬ В SUPABASE С ССЫЛКОЙ НА ФАЙЛ
+        stage_started = time.perf_counter()
+        updated = await adb.update_order_fields(order_id, {
+            "receipt_file_name": file_name,
+            "receipt_file_url": public_url,
+            "receipt_file_id": file_id,
+            "receipt_file_type": file_type,
+            "processing_status": "archived"
+        })
+        timings["db_update"] = time.perf_counter() - stage_started
+        if not updated:
+            # Файл в Storage есть, но ссылка не сохранена - попытка не удалась (повтор перезапишет файл)
+            print(f"❌ Ссылка на чек не сохранена в заказе #{order_id}")
             return None
+        timings["total"] = time.perf_counter() - started
+        
+        print(f"⏱ Тайминги загрузки чека #{order_id}: " +
+              ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items()))
+        
+        return {
+            "file_name": file_name,
+            "public_url": public_url,
+            "file_size": counter["bytes"],
+            "timings": timings
+        }
             
     except Exception as e:
         print(f"❌ Критическая ошибка загрузки в Supabase: {e}")
@@ -161,98 +680,343 @@ def create_receipts_bucket():
         print(f"❌ Ошибка создания bucket: {e}")
         return False
 
-async def get_supabase_file_info(order_id: int):
-    """Получает информацию о файле в Supabase Storage по ID заказа"""
+# Индекс имен чеков в Storage: order_id -> метаданные файла
+receipt_name_index = {}
+
+# Telegram file_id чеков: order_id -> (file_id, 'document' | 'photo')
+receipt_file_id_cache = {}
+
+def remember_receipt_file_id(order_id, file_id, file_type):
+    """Запоминает file_id чека, чтобы пересылать его админам без скачивания и загрузки"""
+    receipt_file_id_cache[int(order_id)] = (file_id, file_type)
+
+def get_receipt_file_id(order):
+    """file_id чека из кэша или из колонки receipt_file_id заказа"""
+    cached = receipt_file_id_cache.get(int(order['id']))
+    if cached:
+        return cached
+    if order.get('receipt_file_id'):
+        remember_receipt_file_id(order['id'], order['receipt_file_id'], order.get('receipt_file_type') or 'document')
+        return receipt_file_id_cache[int(order['id'])]
+    return None
+
+def receipt_mime_type(file_name):
+    """MIME тип чека по расширению имени файла"""
+    return "application/pdf" if file_name.endswith(".pdf") else "image/jpeg"
+
+def remember_receipt_file(order_id, file_name, size=0, mime_type=None):
+    """Запоминает имя файла чека в индексе, чтобы не искать его в Storage повторно"""
+    receipt_name_index[int(order_id)] = {
+        'file_name': file_name,
+        'size': size or 0,
+        'mime_type': mime_type or receipt_mime_type(file_name)
+    }
+
+def list_receipts_by_prefix(prefix):
+    """Постраничный поиск файлов в bucket по префиксу имени (выполняется в пуле Supabase)"""
+    bucket = supabase_client.storage.from_("receipts")
+    found_files = []
+    offset = 0
+    while True:
+        page = bucket.list(None, {"search": prefix, "limit": RECEIPT_LIST_PAGE_SIZE, "offset": offset})
+        found_files.extend(file for file in page if file['name'].startswith(prefix))
+        if len(page) < RECEIPT_LIST_PAGE_SIZE:
+            return found_files
+        offset += RECEIPT_LIST_PAGE_SIZE
+
+async def get_supabase_file_info(order_id: int, order: dict = None):
+    """Получает информацию о файле в Supabase Storage по ID заказа
+    
+    Имя файла берется из колонки receipt_file_name заказа или из индекса; листинг
+    bucket по префиксу нужен только для старых заказов, загруженных без этой колонки."""
     try:
-        # Получаем информацию о заказе из Supabase
-        order = db.get_order_by_id(order_id)
-        if not order:
-            print(f"❌ Заказ #{order_id} не найден в Supabase")
-            return None
-            
-        print(f"🔍 Поиск файлов для заказа #{order_id}...")
-        
-        # Ищем файлы в Storage по паттерну имени
-        files = supabase_client.storage.from_("receipts").list()
-        
-        target_pattern = f"receipt_order_{order_id}_"
-        found_files = []
+        order_id = int(order_id)
+        entry = receipt_name_index.get(order_id)
         
-        for file in files:
-            print(f"📁 Проверка файлa: {file['name']}")
-            if target_pattern in file['name']:
-                found_files.append(file)
-        
-        if found_files:
-            # Берем первый найденный файл
-            file = found_files[0]
-            public_url = supabase_client.storage.from_("receipts").get_public_url(file['name'])
-            
-            print(f"✅ Найден файл: {file['name']}")
-            print(f"🔗 Публичный URL: {public_url}")
+        if entry is None:
+            # Получаем информацию о заказе из Supabase (если вызывающий ее не передал)
+            if order is None:
+                order = await adb.get_order_by_id(order_id)
+            if not order:
+                print(f"❌ Заказ #{order_id} не найден в Supabase")
+                return None
             
-            return {
-                'file_name': file['name'],
-                'public_url': public_url,
-                'size': file.get('metadata', {}).get('size', 0),
-                'mime_type': file.get('metadata', {}).get('mimetype', 'unknown')
-            }
-        else:
-            print(f"❌ Файлы для заказа #{order_id} не найдены")
-            return None
+            if order.get('receipt_file_name'):
+                remember_receipt_file(order_id, order['receipt_file_name'])
+            else:
+                print(f"🔍 Поиск файлов для заказа #{order_id}...")
+                found_files = await adb.run(list_receipts_by_prefix, f"receipt_order_{order_id}_")
+                if not found_files:
+                    print(f"❌ Файлы для заказа #{order_id} не найдены")
+                    return None
+                # Берем первый найденный файл
+                file = found_files[0]
+                metadata = file.get('metadata') or {}
+                remember_receipt_file(order_id, file['name'], metadata.get('size', 0), metadata.get('mimetype'))
+            entry = receipt_name_index[order_id]
+        
+        public_url = supabase_client.storage.from_("receipts").get_public_url(entry['file_name'])
+        return {
+            'file_name': entry['file_name'],
+            'public_url': public_url,
+            'size': entry['size'],
+            'mime_type': entry['mime_type']
+        }
             
     except Exception as e:
         print(f"❌ Ошибка поиска файла в Supabase: {e}")
         return None
 
-# Функции для логирования (только в файл, без SQLite)
-def log_event(user_id, username, action, details=""):
-    """АВТОМАТИЧЕСКОЕ ЛОГИРОВАНИЕ ВСЕХ ДЕЙСТВИЙ (файл + консоль)"""
-    moscow_time = datetime.datetime.now()
-    timestamp = moscow_time.strftime("%d.%m.%Y %H:%M:%S MSK")
-    log_message = f"[{timestamp}] 👤 User {user_id} ({username}) - {action}"
-    if details:
-        log_message += f" - {details}"
+# ФОНОВАЯ АРХИВАЦИЯ ЧЕКОВ
+# Статус обработки чека в колонке orders.processing_status (видят админы в /pending)
+RECEIPT_PROCESSING_LABELS = {
+    "queued": "⏳ в очереди на загрузку в хранилище",
+    "retrying": "🔁 повторная загрузка в хранилище",
+    "archived": "☁️ в облачном хранилище",
+    "failed": "⚠️ не загружен в хранилище (доступен в Telegram)"
+}
+
+class ReceiptArchiver:
+    """Очередь загрузки чеков в Supabase Storage с ограниченным пулом воркеров
     
-    # Всегда выводим в консоль (для Render)
-    print("🔹 " + log_message)
+    Заказ сохраняется сразу с file_id чека, пользователь получает ответ, а копия
+    файла в Storage делается в фоне. Неудачная загрузка повторяется с растущей
+    паузой (через планировщик сроков), после RECEIPT_MAX_ATTEMPTS заказ получает
+    статус failed. Незавершенные загрузки подхватываются из orders при старте."""
+    def __init__(self, workers=RECEIPT_WORKERS, queue_size=RECEIPT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pending = set()  # order_id в очереди или в работе
     
-    # Сохраняем в файл (для локальной разработки)
-    try:
-        with open("bot_log.txt", "a", encoding="utf-8") as f:
-            f.write(log_message + "\n")
-    except Exception as e:
-        print(f"⚠️ Не удалось записать в файл лога: {e}")
+    def enqueue(self, order_id, user_id, file_id, file_type, attempt=1):
+        if order_id in self.pending:
+            return
+        job = {'order_id': order_id, 'user_id': user_id, 'file_id': file_id, 'file_type': file_type, 'attempt': attempt}
+        try:
+            self.queue.put_nowait(job)
+            self.pending.add(order_id)
+        except asyncio.QueueFull:
+            # Очередь переполнена - пробуем позже, заказ и file_id уже в базе
+            print(f"⚠️ Очередь загрузки чеков заполнена, чек заказа #{order_id} отложен")
+            scheduler.schedule(("receipt", order_id), time.time() + RECEIPT_RETRY_DELAY, self.retry, job)
+    
+    async def retry(self, job):
+        self.enqueue(job['order_id'], job['user_id'], job['file_id'], job['file_type'], job['attempt'])
+    
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.process(job)
+            except Exception as e:
+                print(f"❌ Ошибка архивации чека заказа #{job['order_id']}: {e}")
+            finally:
+                self.pending.discard(job['order_id'])
+                self.queue.task_done()
+    
+    async def process(self, job):
+        order_id, attempt = job['order_id'], job['attempt']
+        result = await upload_receipt_to_supabase(bot, job['file_id'], job['file_type'], order_id, {'user_id': job['user_id']})
+        if result:
+            log_event(job['user_id'], None, "☁️ ЧЕК ЗАГРУЖЕН В SUPABASE",
+                      f"Заказ #{order_id}, файл: {result['file_name']}",
+                      order_id=order_id, attempt=attempt, latency_ms=round(result['timings']['total'] * 1000))
+            return
+        
+        if attempt >= RECEIPT_MAX_ATTEMPTS:
+            print(f"❌ Чек заказа #{order_id} не загружен после {attempt} попыток")
+            await adb.update_order_fields(order_id, {"processing_status": "failed", "processing_attempts": attempt})
+            return
+        
+        delay = RECEIPT_RETRY_DELAY * 2 ** (attempt - 1)
+        print(f"🔁 Повторная загрузка чека заказа #{order_id} через {delay:.0f}с (попытка {attempt + 1})")
+        await adb.update_order_fields(order_id, {"processing_status": "retrying", "processing_attempts": attempt})
+        scheduler.schedule(("receipt", order_id), time.time() + delay, self.retry, {**job, 'attempt': attempt + 1})
+    
+    def start(self):
+        for _ in range(self.workers):
+            spawn(self.worker())
+    
+    async def resume(self):
+        """Ставит в очередь чеки, которые не успели загрузиться до перезапуска"""
+        orders = await adb.get_unarchived_receipts()
+        for order in orders:
+            self.enqueue(order['id'], order['user_id'], order['receipt_file_id'], order['receipt_file_type'] or 'document',
+                         (order.get('processing_attempts') or 0) + 1)
+        if orders:
+            print(f"☁️ Незагруженных чеков поставлено в очередь: {len(orders)}")
+
+receipt_archiver = ReceiptArchiver()
+
+# КОНВЕЙЕР ЛОГИРОВАНИЯ
+class LogPipeline:
+    """Логи действий копятся в очереди и пишутся на диск пачками из фоновой задачи
+    
+    Вызов log_event стоит одной постановки в очередь. При переполнении очереди
+    записи теряются (drop) или вызывающий ждет, пока пачка будет записана (block).
+    В event loop ждать нельзя: там при block строки уходят в запасную очередь без
+    ограничения, а запись на диск сразу запускается в потоке.
+    Файлы ротируются по размеру и времени, старые части сжимаются gzip."""
+    def __init__(self, max_size=LOG_QUEUE_SIZE, policy=LOG_QUEUE_POLICY):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.overflow = queue.SimpleQueue()
+        self.policy = policy
+        self.dropped = 0
+        self.write_lock = threading.Lock()
+        self.opened_at = {}
+        self.loop_thread_id = None
+        self.wakeup = None
+    
+    def emit(self, file_name, line):
+        try:
+            self.queue.put_nowait((file_name, line))
+        except queue.Full:
+            if self.policy != "block":
+                self.dropped += 1
+            elif self.loop_thread_id is None:
+                # Фоновой записи нет (до запуска или после остановки) - пишем накопленное сами
+                self.flush()
+                self.emit(file_name, line)
+            elif threading.get_ident() == self.loop_thread_id:
+                self.overflow.put((file_name, line))
+                self.wakeup.set()
+            else:
+                self.queue.put((file_name, line))
+    
+    def drain(self):
+        batch = []
+        for source in (self.queue, self.overflow):
+            while True:
+                try:
+                    batch.append(source.get_nowait())
+                except queue.Empty:
+                    break
+        return batch
+    
+    def flush(self):
+        """Записывает все накопленные строки (по одному открытию на файл)"""
+        batch = self.drain()
+        if not batch and not self.dropped:
+            return 0
+        with self.write_lock:
+            if self.dropped:
+                batch.append((None, f"⚠️ Очередь логов переполнена, потеряно записей: {self.dropped}"))
+                self.dropped = 0
+            by_file = {}
+            for file_name, line in batch:
+                by_file.setdefault(file_name, []).append(line)
+            for file_name, lines in by_file.items():
+                if file_name is None:
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
+                    continue
+                try:
+                    self.rotate_if_needed(file_name)
+                    with open(file_name, "a", encoding="utf-8") as f:
+                        f.write("\n".join(lines) + "\n")
+                except Exception as e:
+                    print(f"⚠️ Не удалось записать в файл лога {file_name}: {e}")
+        return len(batch)
+    
+    def rotate_if_needed(self, file_name):
+        if not os.path.exists(file_name):
+            self.opened_at[file_name] = time.time()
+            return
+        opened_at = self.opened_at.setdefault(file_name, os.path.getmtime(file_name))
+        if os.path.getsize(file_name) < LOG_MAX_BYTES and time.time() - opened_at < LOG_ROTATE_SECONDS:
+            return
+        if LOG_BACKUP_COUNT <= 0:
+            # Архивы не храним - старая часть просто удаляется
+            os.remove(file_name)
+            self.opened_at[file_name] = time.time()
+            return
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        rotated_name = f"{file_name}.{stamp}.gz"
+        # Вторая ротация в ту же секунду не должна перезаписать архив
+        for counter in itertools.count(1):
+            if not os.path.exists(rotated_name):
+                break
+            rotated_name = f"{file_name}.{stamp}-{counter}.gz"
+        with open(file_name, "rb") as source, gzip.open(rotated_name, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(file_name)
+        self.opened_at[file_name] = time.time()
+        
+        prefix = os.path.basename(file_name) + "."
+        directory = os.path.dirname(file_name) or "."
+        archives = sorted(
+            (os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(".gz")),
+            key=lambda path: (os.path.getmtime(path), path)
+        )
+        for path in archives[:len(archives) - LOG_BACKUP_COUNT]:
+            os.remove(path)
+    
+    async def run_writer(self, interval=LOG_FLUSH_INTERVAL):
+        self.wakeup = asyncio.Event()
+        self.loop_thread_id = threading.get_ident()
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await asyncio.to_thread(self.flush)
+    
+    def close(self):
+        self.loop_thread_id = None
+        self.flush()
+
+log_pipeline = LogPipeline()
+
+def log_file_name(base_name):
+    return f"{base_name}.jsonl" if LOG_FORMAT == "json" else f"{base_name}.txt"
+
+def write_log(kind, prefix, file_base, user_id, username, action, details, fields):
+    now = datetime.datetime.now()
+    if LOG_FORMAT == "json":
+        record = {
+            "ts": now.isoformat(timespec="milliseconds"),
+            "kind": kind,
+            "user_id": user_id,
+            "username": username,
+            "action": action,
+            "details": details or None,
+            **fields
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+    else:
+        line = f"[{now.strftime('%d.%m.%Y %H:%M:%S MSK')}] {prefix} {user_id} ({username}) - {action}"
+        if details:
+            line += f" - {details}"
+    
+    if LOG_CONSOLE:
+        log_pipeline.emit(None, ("🔹 " if kind == "user" else "🔸 ") + line)
+    log_pipeline.emit(log_file_name(file_base), line)
+
+def log_event(user_id, username, action, details="", **fields):
+    """АВТОМАТИЧЕСКОЕ ЛОГИРОВАНИЕ ВСЕХ ДЕЙСТВИЙ (файл + консоль, пачками в фоне)
+    
+    В fields можно передать структурированные поля для JSON-логов (tariff, latency_ms)."""
+    write_log("user", "👤 User", "bot_log", user_id, username, action, details, fields)
 
-def log_tariff_selection(user_id, username, tariff_name, tariff_data):
+def log_tariff_selection(user_id, username, tariff):
     """АВТОМАТИЧЕСКОЕ ЛОГИРОВАНИЕ ВЫБОРА ТАРИФА"""
-    price_info = f"{tariff_data['price']}₽" 
-    if 'total' in tariff_data:
-        price_info += f" (всего {tariff_data['total']}₽)"
+    price_info = f"{tariff.per_person}₽" 
+    if tariff.min_people > 1:
+        price_info += f" (всего {tariff.total}₽)"
     
     log_event(user_id, username, "🎫 ВЫБРАЛ(-а) ТАРИФ", 
-              f"'{tariff_name}' - {price_info} - {tariff_data['min_people']} чел.")
+              f"'{tariff.name}' - {price_info} - {tariff.min_people} чел.", tariff=tariff.name, event_id=tariff.event_id)
 
 def log_payment_start(user_id, username, tariff_name, participants, total_price):
     """АВТОМАТИЧЕСКОЕ ЛОГИРОВАНИЕ НАЧАЛА ОПЛАТЫ"""
     log_event(user_id, username, "💳 НАЧАЛ(-а) ОПЛАТУ",
-              f"Тариф: {tariff_name}, Участники: {len(participants)}, Сумма: {total_price}₽")
-
-def log_admin_action(user_id, username, action, details=""):
-    """ЛОГИРОВАНИЕ ДЕЙСТВИЙ АДМИНА (файл + консоль)"""
-    moscow_time = datetime.datetime.now()
-    timestamp = moscow_time.strftime("%d.%m.%Y %H:%M:%S MSK")
-    log_message = f"[{timestamp}] 👨‍💼 ADMIN {user_id} ({username}) - {action}"
-    if details:
-        log_message += f" - {details}"
-    print("🔸 " + log_message)
-    
-    # Сохраняем в файл (для локальной разработки)
-    try:
-        with open("admin_log.txt", "a", encoding="utf-8") as f:
-            f.write(log_message + "\n")
-    except Exception as e:
-        print(f"⚠️ Не удалось записать в файл лога админа: {e}")
+              f"Тариф: {tariff_name}, Участники: {len(participants)}, Сумма: {total_price}₽",
+              tariff=tariff_name, total_price=total_price)
+
+def log_admin_action(user_id, username, action, details="", **fields):
+    """ЛОГИРОВАНИЕ ДЕЙСТВИЙ АДМИНА (файл + консоль, пачками в фоне)"""
+    write_log("admin", "👨‍💼 ADMIN", "admin_log", user_id, username, action, details, fields)
 
 # Состояния для FSM
 class OrderStates(StatesGroup):
@@ -268,35 +1032,138 @@ class BroadcastState(StatesGroup):
     waiting_for_broadcast_content = State()
     confirmation = State()
 
+# РЕЕСТР ПОЛЬЗОВАТЕЛЕЙ ДЛЯ РАССЫЛКИ
+class UserRegistry:
+    """Пользователи бота в памяти (user_id -> first_seen, last_seen, blocked)
+    
+    Загружается один раз при старте; изменения копятся в памяти и сбрасываются
+    в SQLite одной транзакцией раз в USERS_FLUSH_INTERVAL секунд."""
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self.users = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.connection = None
+    
+    def load(self):
+        self.connection = open_local_db(self.path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                blocked INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        rows = self.connection.execute("SELECT user_id, first_seen, last_seen, blocked FROM users").fetchall()
+        with self.lock:
+            for user_id, first_seen, last_seen, blocked in rows:
+                self.users[user_id] = {'first_seen': first_seen, 'last_seen': last_seen, 'blocked': bool(blocked)}
+        
+        if not rows:
+            self.import_legacy_users()
+        print(f"✅ Реестр пользователей загружен: {len(self.users)}")
+    
+    def import_legacy_users(self, path=LEGACY_USERS_PATH):
+        """Переносит пользователей из старого users.json"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            legacy_ids = json.loads(content) if content else []
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            for user_id in legacy_ids:
+                self.users[int(user_id)] = {'first_seen': now, 'last_seen': now, 'blocked': False}
+                self.dirty.add(int(user_id))
+        self.flush()
+        print(f"✅ Импортировано пользователей из {path}: {len(legacy_ids)}")
+    
+    def touch(self, user_id):
+        """Отмечает активность пользователя; возвращает True для нового пользователя"""
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            user = self.users.get(user_id)
+            is_new = user is None
+            if is_new:
+                self.users[user_id] = {'first_seen': now, 'last_seen': now, 'blocked': False}
+            else:
+                user['last_seen'] = now
+                user['blocked'] = False
+            self.dirty.add(user_id)
+        return is_new
+    
+    def set_blocked(self, user_id, blocked=True):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is not None and user['blocked'] != blocked:
+                user['blocked'] = blocked
+                self.dirty.add(user_id)
+    
+    def active_ids(self):
+        """ID пользователей, которым можно делать рассылку"""
+        with self.lock:
+            return {user_id for user_id, user in self.users.items() if not user['blocked']}
+    
+    def counts(self):
+        with self.lock:
+            blocked = sum(1 for user in self.users.values() if user['blocked'])
+            return len(self.users), blocked
+    
+    def flush(self):
+        """Сбрасывает накопленные изменения одной транзакцией"""
+        with self.lock:
+            if not self.dirty or self.connection is None:
+                return 0
+            rows = [(user_id, self.users[user_id]['first_seen'], self.users[user_id]['last_seen'],
+                     int(self.users[user_id]['blocked'])) for user_id in self.dirty]
+            self.dirty = set()
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany("""
+                    INSERT INTO users (user_id, first_seen, last_seen, blocked) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET last_seen = excluded.last_seen, blocked = excluded.blocked
+                """, rows)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить пользователей: {e}")
+            with self.lock:
+                self.dirty.update(row[0] for row in rows)
+            return 0
+        return len(rows)
+    
+    async def run_flusher(self, interval=USERS_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+    
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+user_registry = UserRegistry()
+
 # Функции для работы с пользователями
 def load_users():
-    """Загружает список пользователей из файла"""
-    try:
-        with open("users.json", 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            if not content:
-                return set()
-            return set(json.loads(content))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return set()
+    """Возвращает пользователей для рассылки (из памяти)"""
+    return user_registry.active_ids()
 
 def save_user(user_id):
-    """Сохраняет пользователя в файл (автоматически при любом взаимодействии)"""
+    """Отмечает пользователя в реестре (автоматически при любом взаимодействии)"""
     try:
-        users = load_users()
-        if user_id not in users:
-            users.add(user_id)
-            with open("users.json", 'w', encoding='utf-8') as f:
-                json.dump(list(users), f, ensure_ascii=False, indent=2)
+        if user_registry.touch(user_id):
             print(f"✅ Новый пользователь сохранен для рассылки: {user_id}")
             
             # Логируем в файл
-            with open("users_log.txt", "a", encoding="utf-8") as f:
-                timestamp = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-                f.write(f"[{timestamp}] 👤 Новый пользователь для рассылки: {user_id}\n")
-        # Если пользователь уже есть, ничего не делаем (тихо пропускаем)
+            timestamp = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+            log_pipeline.emit("users_log.txt", f"[{timestamp}] 👤 Новый пользователь для рассылки: {user_id}")
+        # Если пользователь уже есть, только обновляем last_seen в памяти
     except Exception as e:
         print(f"⚠️ Не удалось сохранить пользователя: {e}")
+
 # Тарифы
 TARIFFS = {
     "Сам себе Санта": {
@@ -375,7 +1242,8 @@ TARIFFS = {
         "min_people": 2,
         "total": 6500,
         "emoji": "❤️",
-        "includes": "Все включено + именная комната + новогодние сюрпризы"
+        "includes": "Все включено + именная комната + новогодние сюрпризы",
+        "note": "именная комната + подарки"
     },
     "SQUAD SUPER VIP": {
         "price": 12000,
@@ -385,207 +1253,1675 @@ TARIFFS = {
         "min_people": 4,
         "total": 12000,
         "emoji": "🎄",
-        "includes": "Все включено + эксклюзивная комната + секретные подарки"
+        "includes": "Все включено + эксклюзивная комната + секретные подарки",
+        "note": "эксклюзивная комната + подарки",
+        "capacity": 1  # Эксклюзивная комната одна
+    }
+}
+
+# Группы тарифов (порядок = порядок в меню)
+TARIFF_GROUPS = {
+    "male": {
+        "menu_button": "🎅 ДЛЯ ПАРНЕЙ",
+        "title": "🎅 <b>ТАРИФЫ ДЛЯ ПАРНЕЙ</b>",
+        "section": "🎅 <b>ДЛЯ ПАРНЕЙ:</b>",
+        "choose_button": "🎅 ВЫБРАТЬ ДЛЯ ПАРНЕЙ"
+    },
+    "female": {
+        "menu_button": "👸 ДЛЯ ДЕВУШЕК",
+        "title": "👸 <b>ТАРИФЫ ДЛЯ ДЕВУШЕК</b>",
+        "section": "👸 <b>ДЛЯ ДЕВУШЕК:</b>",
+        "choose_button": "👸 ВЫБРАТЬ ДЛЯ ДЕВУШЕК"
+    },
+    "couple": {
+        "menu_button": "❤️ ДЛЯ ПАР",
+        "title": "❤️ <b>ТАРИФЫ ДЛЯ ПАР</b>",
+        "section": "❤️ <b>ДЛЯ ПАР:</b>",
+        "choose_button": "❤️ ВЫБРАТЬ ДЛЯ ПАР"
+    },
+    "vip": {
+        "menu_button": "⭐ VIP ТАРИФЫ",
+        "title": "⭐ <b>VIP ТАРИФЫ</b>",
+        "section": "⭐ <b>VIP ТАРИФЫ:</b>",
+        "choose_button": "⭐ ВЫБРАТЬ VIP"
     }
 }
 
+# Правила площадки (по умолчанию; у мероприятия в Supabase могут быть свои)
+RULES_TEXT = """
+<b>ВАЖНО!</b>
+
+Правила площадки:
+- Посещение территории дома возможно только при наличии оригиналов соответствующих документов.
+- Каждый участник несет личную ответственность за свои действия, состояние и сохранность своих вещей.
+- Пронос алкогольной продукции и еды на территорию дома запрещен.
+- Наркотические вещества строго запрещены. За нарушение — штраф 10 000 ₽ и удаление с мероприятия без возврата денег.
+- Курение разрешено только в специально отведённой зоне на улице.
+- Запрещено проносить оружие, колюще-режущие предметы и опасные вещества.
+- Участники с заболеваниями обязаны иметь при себе необходимые лекарства и следить за своим здоровьем самостоятельно.
+- Нарушение законов РФ влечет ответственность по законодательству.
+- Требования организаторов обязаны для исполнения.
+- Без оплаты билета вход невозможен.
+- При нарушении правил организаторы вправе удалить участника без возврата денежных средств.
+
+Нажмите кнопку ниже, чтобы продолжить
+    """
+
+# Мероприятие по умолчанию: продается, пока в Supabase нет таблиц events/tariffs (sql/events_catalog.sql)
+DEFAULT_EVENT = {
+    "id": "new-year-gedan-party",
+    "title": "NEW YEAR GEDAN PARTY",
+    "emoji": "🎄✨",
+    "date_text": "27.12.2025",
+    "time_text": "20:00",
+    "place": "Просторный дом с русской баней",
+    "description": """🗓 <b>Когда:</b> 27 декабря
+🌙 <b>Время:</b> 20:00  
+📍 <b>Место:</b> Уютный дом с русской баней
+📌 <b>Адрес:</b> 55.923317, 38.423271
+
+✨ <b>Что ждёт внутри:</b>
+• 🎁 Игры и подарки: Новогодние розыгрыши и сюрпризы для всех гостей
+• 🍹 Коктейльная карта: От классики до авторских рецептов
+• 🎅 Главный звук: Мощный DJ-сет, где хиты этого года встретятся с новогодней классикой
+• 🍪 Уютные зоны: Приватные комнаты для тёплых бесед и особых моментов
+• 🏠 Русская баня, бильярд и другие приятные мелочи
+
+🎯 <b>Бонусы:</b>
+• 🖼️ Лакей: встречает вас на станции Захарово с 17:30 (Горьковское направление)  и заказывает такси (до нашего дома и обратно до станции до 5 утра!)
+• 💤 Часы сна: с 5 до 11 утра - соблюдаем тишину
+• 🔄 Возможность передать комнату другому участнику
+
+⚡ <i>Дамы и господа! Стартуем в Новый год вместе с Gedan! Ждём абсолютно каждого на нашей праздничной вечеринке!</i>
+
+Готовы стать частью самого эпицентра праздника? Выбирай тариф ниже!""",
+    "rules": RULES_TEXT,
+    # Дополнительные пункты «Включено» в описании каждого тарифа
+    "perks": """• Полный доступ на New Year Gedan Party
+• Участие в новогодних розыгрышах
+• Доступ к бане, бильярду и уютным зонам
+• Услуги лакея (такси туда и обратно до 5 утра)""",
+    # Бонусы в подтверждении заказа
+    "bonuses": """• Лакей: такси туда и обратно до 5 утра
+• Уютные комнаты и русская баня
+• Новогодние розыгрыши и подарки
+• Часы сна: с 5 до 11 утра - соблюдаем тишину""",
+    "image_path": EVENT_IMAGE_PATH,
+    "capacity": None,  # Максимум гостей на мероприятии (None - без ограничения)
+    "tariffs": TARIFFS
+}
+
+PEOPLE_WORDS = {2: "двоих", 3: "троих", 4: "четверых"}
+
+NO_EVENTS_TEXT = "😔 Сейчас нет мероприятий в продаже. Следите за новостями — скоро анонсируем новые!"
+
+# КАТАЛОГ МЕРОПРИЯТИЙ И ТАРИФОВ
+# Клавиатуры и тексты строятся один раз при загрузке каталога. Снимок каталога
+# неизменяемый и подменяется целиком, поэтому обработчики читают его без блокировок.
+@dataclass(frozen=True)
+class TariffView:
+    """Тариф с заранее подготовленными текстами и клавиатурой"""
+    key: str
+    event_id: str
+    name: str
+    emoji: str
+    group: str
+    total: int
+    per_person: int
+    min_people: int
+    max_people: int
+    capacity: object  # Сколько заказов можно продать (None - без ограничения)
+    button_text: str
+    listing_line: str
+    selection_text: str
+    selection_markup: types.InlineKeyboardMarkup
+
+@dataclass(frozen=True)
+class TariffCatalog:
+    """Тарифы одного мероприятия"""
+    tariffs: MappingProxyType
+    group_titles: MappingProxyType
+    group_markups: MappingProxyType
+    intro_text: str
+    menu_markup: types.InlineKeyboardMarkup
+    all_tariffs_text: str
+    all_tariffs_markup: types.InlineKeyboardMarkup
+
+@dataclass(frozen=True)
+class EventView:
+    """Мероприятие с готовыми текстами и тарифами"""
+    id: str
+    title: str
+    emoji: str
+    date_text: str
+    time_text: str
+    place: str
+    info_text: str
+    info_markup: types.InlineKeyboardMarkup
+    rules_text: str
+    bonuses: str
+    image_path: str
+    capacity: object  # Максимум гостей (None - без ограничения)
+    catalog: TariffCatalog
+    
+    @property
+    def short_line(self):
+        return " | ".join(part for part in (self.date_text, self.time_text, self.place) if part)
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Версия каталога: все мероприятия, их тарифы и клавиатура выбора мероприятия"""
+    version: str
+    source: str
+    events: MappingProxyType
+    tariffs: MappingProxyType
+    events_markup: types.InlineKeyboardMarkup
+    loaded_at: float
+    
+    def event(self, event_id=None):
+        """Мероприятие по id; если мероприятие одно - оно же по умолчанию"""
+        event = self.events.get(event_id)
+        if event is None and len(self.events) == 1:
+            event = next(iter(self.events.values()))
+        return event
+
+def build_tariff_view(key, name, tariff, event):
+    total = tariff.get('total') or tariff['price']
+    per_person = total // tariff['min_people']
+    is_vip = tariff['gender'] == "vip"
+    
+    listing_line = f"• {tariff['emoji']} {name} - {total}₽"
+    if tariff.get('note'):
+        listing_line += f" ({tariff['note']})"
+    elif tariff['min_people'] > 1:
+        listing_line += f" ({per_person}₽/чел)"
+    
+    description = f"{tariff['emoji']} <b>«{name}»</b>\n"
+    if is_vip:
+        description += f"💵 <b>{total}₽ за {PEOPLE_WORDS.get(tariff['min_people'], tariff['min_people'])}</b>\n"
+        description += f"💳 <b>Всего: {total}₽</b>\n"
+    elif tariff.get('total'):
+        description += f"💵 <b>{tariff['price']}₽ с человека</b>\n"
+        description += f"💳 <b>Всего: {total}₽</b>\n"
+    else:
+        description += f"💵 <b>Стоимость: {tariff['price']}₽</b>\n"
+    
+    if tariff.get('description'):
+        description += f"\n📖 {tariff['description']}\n"
+    description += f"\n✅ <b>Включено:</b>\n"
+    if tariff.get('includes'):
+        description += f"• {tariff['includes']}\n"
+    if event.get('perks'):
+        description += f"{event['perks']}\n"
+    
+    if tariff['min_people'] == 1:
+        selection_text = f"{description}\n\n📝 <b>Теперь введите свои данные в формате:</b>\n<code>ФИО, телеграмм, номер телефона</code>\n\n<b>Пример:</b>\n<code>Иванов Иван Иванович, @ivanov, 79991234567</code>"
+    else:
+        selection_text = f"{description}\n\n📝 <b>Теперь введите данные всех {tariff['min_people']} участников в формате:</b>\nКаждый участник с новой строки:\n<code>ФИО, телеграмм, номер телефона</code>\n\n<b>Пример для {tariff['min_people']} человек:</b>\n<code>Иванов Иван Иванович, @ivanov, 79991234567</code>\n<code>Петрова Анна Сергеевна, @petrova, 79997654321</code>"
+    
+    return TariffView(
+        key=key,
+        event_id=event['id'],
+        name=name,
+        emoji=tariff['emoji'],
+        group=tariff['gender'],
+        total=total,
+        per_person=per_person,
+        min_people=tariff['min_people'],
+        max_people=tariff['max_people'],
+        capacity=tariff.get('capacity'),
+        button_text=f"{tariff['emoji']} {name} - {total}₽",
+        listing_line=listing_line,
+        selection_text=selection_text,
+        selection_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="⬅️ ВЫБРАТЬ ДРУГОЙ ТАРИФ", callback_data="back_to_tariffs")]
+        ])
+    )
+
+def build_catalog(event, groups=TARIFF_GROUPS):
+    """Строит все тексты и клавиатуры тарифов мероприятия
+    
+    Ключ тарифа попадает в callback_data: у тарифов из Supabase это id строки,
+    у мероприятия по умолчанию - название (как было раньше)."""
+    views = {}
+    for name, tariff in event['tariffs'].items():
+        key = str(tariff.get('key', name))
+        views[key] = build_tariff_view(key, name, tariff, event)
+    return catalog_from_views(event['title'], views, groups)
+
+def catalog_from_views(title, views, groups=TARIFF_GROUPS):
+    """Собирает меню и списки из готовых тарифов (так же строится каталог без распроданных)"""
+    back_button = [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
+    
+    # В меню попадают только группы, в которых есть тарифы
+    groups = {group: info for group, info in groups.items() if any(view.group == group for view in views.values())}
+    
+    group_markups = {}
+    all_tariffs_text = f"\n<b>🎫 ВСЕ ТАРИФЫ НА {title}</b>\n"
+    for group, group_info in groups.items():
+        group_views = [view for view in views.values() if view.group == group]
+        group_markups[group] = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text=view.button_text, callback_data=f"tariff_{view.key}")]
+            for view in group_views
+        ] + [back_button])
+        all_tariffs_text += f"\n{group_info['section']}\n" + "".join(f"{view.listing_line}\n" for view in group_views)
+    
+    # Меню групп: по две кнопки в ряд
+    menu_buttons = [types.InlineKeyboardButton(text=info['menu_button'], callback_data=f"tariff_type_{group}")
+                    for group, info in groups.items()]
+    menu_markup = types.InlineKeyboardMarkup(inline_keyboard=[menu_buttons[i:i + 2] for i in range(0, len(menu_buttons), 2)])
+    
+    all_tariffs_markup = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=info['choose_button'], callback_data=f"tariff_type_{group}")]
+        for group, info in groups.items()
+    ] + [back_button])
+    
+    return TariffCatalog(
+        tariffs=MappingProxyType(views),
+        group_titles=MappingProxyType({group: info['title'] for group, info in groups.items()}),
+        group_markups=MappingProxyType(group_markups),
+        intro_text=f"\n<b>🎫 ВЫБЕРИ СВОЙ ПУТЬ НА {title}</b>\n\nКаждый тариф — это не просто билет, это твой уникальный опыт и комьюнити!\n",
+        menu_markup=menu_markup,
+        all_tariffs_text=all_tariffs_text,
+        all_tariffs_markup=all_tariffs_markup
+    )
+
+def build_event_view(event):
+    return EventView(
+        id=event['id'],
+        title=event['title'],
+        emoji=event.get('emoji') or "",
+        date_text=event.get('date_text') or "",
+        time_text=event.get('time_text') or "",
+        place=event.get('place') or "",
+        info_text=f"\n<b>{event['title']} {event.get('emoji') or ''}</b>\n\n{event.get('description') or ''}\n    ",
+        info_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🎫 ВЫБРАТЬ ТАРИФ", callback_data=f"show_tariffs_{event['id']}")],
+            [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_main")]
+        ]),
+        rules_text=event.get('rules') or RULES_TEXT,
+        bonuses=event.get('bonuses') or "",
+        image_path=event.get('image_path'),
+        capacity=event.get('capacity'),
+        catalog=build_catalog(event)
+    )
+
+def build_snapshot(events, version, source):
+    """Собирает снимок каталога из списка мероприятий (словари в формате DEFAULT_EVENT)"""
+    event_views = {}
+    tariffs = {}
+    for event in events:
+        view = build_event_view(event)
+        event_views[view.id] = view
+        tariffs.update(view.catalog.tariffs)
+    
+    events_markup = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=f"{view.emoji} {view.title} | {view.date_text}".strip(), callback_data=f"event_{view.id}")]
+        for view in event_views.values()
+    ] + [[types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_main")]])
+    
+    return CatalogSnapshot(
+        version=version,
+        source=source,
+        events=MappingProxyType(event_views),
+        tariffs=MappingProxyType(tariffs),
+        events_markup=events_markup,
+        loaded_at=time.time()
+    )
+
+def events_from_rows(event_rows, tariff_rows):
+    """Переводит строки таблиц events и tariffs в формат DEFAULT_EVENT"""
+    tariffs_by_event = {}
+    for row in tariff_rows:
+        tariffs_by_event.setdefault(row['event_id'], {})[row['name']] = {
+            "key": str(row['id']),
+            "price": row['price'],
+            "gender": row['tariff_group'],
+            "description": row.get('description') or "",
+            "min_people": row['min_people'],
+            "max_people": row['max_people'],
+            "total": row.get('total'),
+            "emoji": row.get('emoji') or "🎫",
+            "includes": row.get('includes') or "",
+            "note": row.get('note'),
+            "capacity": row.get('capacity')
+        }
+    
+    events = []
+    for row in event_rows:
+        events.append({
+            "id": row['id'],
+            "title": row['title'],
+            "emoji": row.get('emoji'),
+            "date_text": row.get('date_text'),
+            "time_text": row.get('time_text'),
+            "place": row.get('place'),
+            "description": row.get('description'),
+            "rules": row.get('rules'),
+            "perks": row.get('perks'),
+            "bonuses": row.get('bonuses'),
+            "image_path": row.get('image_path'),
+            "capacity": row.get('capacity'),
+            "tariffs": tariffs_by_event.get(row['id'], {})
+        })
+    return events
+
+def catalog_version(event_rows, tariff_rows):
+    """Версия каталога - хэш содержимого таблиц: снимок пересобирается только при изменениях"""
+    payload = json.dumps([event_rows, tariff_rows], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:10]
+
+# Текущий снимок каталога. До первой загрузки из Supabase продается мероприятие по умолчанию.
+catalog_snapshot = build_snapshot([DEFAULT_EVENT], "default", "default")
+
+def today_bounds():
+    """Границы текущих суток в формате, который использует фильтр created_at"""
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    return today, f"{today.isoformat()}T00:00:00", f"{tomorrow.isoformat()}T00:00:00"
+
+class OrderStatistics:
+    """КЭШ СТАТИСТИКИ ЗАКАЗОВ
+    
+    Счетчики загружаются одним агрегирующим запросом (RPC order_statistics),
+    живут в памяти STATS_TTL секунд и инкрементально обновляются при создании
+    заказа и смене его статуса. Методы вызываются из пула потоков Supabase."""
+    def __init__(self, ttl=STATS_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = None
+        self.loaded_at = 0.0
+        self.day = None
+        self.dirty = False
+        self.seen_user_ids = set()
+    
+    def snapshot(self):
+        """Возвращает (копия счетчиков или None, свежие ли они)"""
+        with self.lock:
+            if self.data is None:
+                return None, False
+            fresh = (not self.dirty
+                     and self.day == datetime.date.today()
+                     and time.monotonic() - self.loaded_at < self.ttl)
+            return dict(self.data), fresh
+    
+    def load(self, data, day):
+        with self.lock:
+            self.data = {key: data.get(key) or 0 for key in (
+                'total_orders', 'paid_orders', 'pending_orders', 'total_revenue',
+                'unique_users', 'today_orders', 'today_revenue'
+            )}
+            self.day = day
+            self.loaded_at = time.monotonic()
+            self.dirty = False
+    
+    def invalidate(self):
+        with self.lock:
+            self.dirty = True
+    
+    def _is_today(self, order):
+        created_at = order.get('created_at') or ""
+        return created_at[:10] == (self.day.isoformat() if self.day else "")
+    
+    def _apply_status(self, order, status, sign):
+        if status == 'paid':
+            self.data['paid_orders'] += sign
+            self.data['total_revenue'] += sign * order['total_price']
+            if self._is_today(order):
+                self.data['today_revenue'] += sign * order['total_price']
+        elif status == 'pending':
+            self.data['pending_orders'] += sign
+    
+    def on_order_added(self, order):
+        orders_total.inc(status=order['status'])
+        with self.lock:
+            if self.data is None:
+                return
+            self.data['total_orders'] += 1
+            if self._is_today(order):
+                self.data['today_orders'] += 1
+            self._apply_status(order, order['status'], +1)
+            # Был ли у пользователя заказ раньше - уточнит следующая загрузка
+            if order['user_id'] not in self.seen_user_ids:
+                self.seen_user_ids.add(order['user_id'])
+                self.dirty = True
+    
+    def on_status_changed(self, order, previous_status):
+        if previous_status != order['status']:
+            orders_total.inc(status=order['status'])
+        with self.lock:
+            if self.data is None or previous_status == order['status']:
+                return
+            if previous_status is None:
+                self.dirty = True
+                return
+            self._apply_status(order, previous_status, -1)
+            self._apply_status(order, order['status'], +1)
+
+# Ошибки схемы: нет таблицы, колонки, функции или уникального индекса. Supabase при этом
+# ответил - значит доступен, просто миграция из sql/ не применена
+SCHEMA_ERROR_CODES = {"42P01", "42703", "42883", "42P10", "PGRST202", "PGRST204", "PGRST205"}
+
+def is_schema_error(error):
+    return getattr(error, "code", None) in SCHEMA_ERROR_CODES
+
+# Коды Postgres/PostgREST временных сбоев: соединение (08, PGRST0xx), конфликт транзакций (40),
+# нехватка ресурсов (53), отмена по таймауту (57), системные (58, XX)
+TRANSIENT_ERROR_PREFIXES = ("08", "40", "53", "57", "58", "XX", "PGRST0")
+
+def is_transient_error(error):
+    """Supabase не ответил по существу (таймаут, сеть, предохранитель, 5xx) - тот же запрос можно повторить
+    
+    Остальные ошибки - ответ на сам запрос (ограничения, данные, схема): повтор не поможет."""
+    if isinstance(error, PostgrestAPIError):
+        code = error.code
+        # Ответ не JSON (прокси, шлюз) - в code HTTP-статус
+        if isinstance(code, int):
+            return code >= 500 or code == 429
+        return not code or code.startswith(TRANSIENT_ERROR_PREFIXES)
+    return not isinstance(error, (TypeError, ValueError, KeyError, RuntimeError))
+
+# Колонки заказа из миграций, без которых заказ все равно можно сохранить: {колонка: миграция}
+OPTIONAL_ORDER_COLUMNS = {
+    "receipt_file_id": "sql/orders_receipt_columns.sql",
+    "receipt_file_type": "sql/orders_receipt_columns.sql",
+    "receipt_file_unique_id": "sql/orders_receipt_processing.sql",
+    "processing_status": "sql/orders_receipt_processing.sql",
+    "processing_attempts": "sql/orders_receipt_processing.sql",
+    "client_ref": "sql/orders_client_ref.sql",
+    "participants_count": "sql/orders_pagination.sql"
+}
+
 class Database:
+    """Синхронные запросы к Supabase (выполняются в пуле AsyncDatabase)
+    
+    Ошибки Supabase пробрасываются, чтобы их видел предохранитель; методы сами
+    перехватывают только ошибки схемы, для которых есть запасной вариант."""
     def __init__(self):
         self.supabase = supabase_client
-        self.auto_create_table()
+        self.stats = OrderStatistics()
+        self.missing_order_columns = set()  # колонки, которых нет в orders (миграция не применена)
+        self.client_ref_indexed = True  # есть уникальный индекс orders_client_ref_key для upsert
+        self.order_counts_rpc = True  # есть функция active_order_counts (sql/inventory.sql)
     
-    def auto_create_table(self):
-        """АВТОМАТИЧЕСКОЕ СОЗДАНИЕ ТАБЛИЦЫ ПРИ ПЕРВОМ ЗАПУСКЕ"""
+    def check_orders_table(self):
+        """ПРОВЕРКА ТАБЛИЦЫ ORDERS ПРИ ЗАПУСКЕ (только чтение, в таблицу ничего не пишется)"""
         try:
-            result = self.supabase.table("orders").select("id").limit(1).execute()
-            print("✅ Таблица orders существует")
-            return True
+            self.supabase.table("orders").select("id").limit(1).execute()
         except Exception as e:
-            print("🔄 Таблица orders не найдена, создаем автоматически...")
-            return self.create_orders_table()
-    
-    def create_orders_table(self):
-        """АВТОМАТИЧЕСКОЕ СОЗДАНИЕ ТАБЛИЦЫ ЧЕРЕЗ SQL"""
-        try:
-            # Создаем простую таблицу через вставку тестовых данных
-            test_data = {
-                "user_id": 1,
-                "username": "test",
-                "tariff": "test",
-                "participants": [{"full_name": "test", "telegram": "@test", "phone": "79990000000"}],
-                "total_price": 1000,
-                "status": "test"
-            }
-            
-            result = self.supabase.table("orders").insert(test_data).execute()
-            print("✅ Таблица orders создана автоматически")
-            
-            # Удаляем тестовые данные
-            if result.data:
-                self.supabase.table("orders").delete().eq("id", result.data[0]['id']).execute()
-            
-            return True
-        except Exception as e:
-            print(f"❌ Не удалось создать таблицу автоматически: {e}")
+            if not is_schema_error(e):
+                raise
+            print(f"❌ Таблица orders не найдена: {e}")
             print("💡 Создайте таблицу вручную в Supabase Dashboard")
             return False
+        print("✅ Таблица orders существует")
+        return True
     
-    def add_order(self, user_id, username, tariff, participants, total_price):
-        """СОХРАНЕНИЕ ЗАКАЗА В SUPABASE"""
-        try:
-            data = {
-                "user_id": user_id,
-                "username": username or "unknown",
-                "tariff": tariff,
-                "participants": participants,
-                "total_price": total_price,
-                "status": "pending",
-                "receipt_verified": False
-            }
-            
-            print(f"💾 СОХРАНЕНИЕ заказа в Supabase...")
-            
-            result = self.supabase.table("orders").insert(data).execute()
-            
-            if result.data:
-                order_id = result.data[0]['id']
-                print(f"✅ Заказ #{order_id} сохранен в Supabase")
-                log_event(user_id, username, "💾 СОХРАНЕНИЕ В БД", f"ID: {order_id}")
-                return result.data[0]
-            else:
-                print("❌ Ошибка: данные не вернулись от Supabase")
+    def ping(self):
+        """Самый легкий запрос к Supabase (для /readyz); исключение - Supabase недоступен"""
+        self.supabase.table("orders").select("id").limit(1).execute()
+        return True
+    
+    def insert_order(self, user_id, username, tariff, participants, total_price, event_id=None, receipt=None, client_ref=None):
+        """СОХРАНЕНИЕ ЗАКАЗА В SUPABASE (вместе с file_id чека - одним запросом); ошибки пробрасываются
+        
+        client_ref - id заказа из локального журнала: повторная отправка того же
+        заказа не создает дубль, а возвращает уже сохраненную строку."""
+        data = {
+            "user_id": user_id,
+            "username": username or "unknown",
+            "tariff": tariff,
+            "participants": participants,
+            "total_price": total_price,
+            "status": "pending",
+            "receipt_verified": False
+        }
+        if receipt:
+            data.update({
+                "receipt_file_id": receipt['file_id'],
+                "receipt_file_unique_id": receipt['file_unique_id'],
+                "receipt_file_type": receipt['file_type'],
+                "processing_status": "queued"
+            })
+        # Колонка event_id появляется вместе с таблицей events (sql/events_catalog.sql)
+        if event_id and event_id != DEFAULT_EVENT['id']:
+            data["event_id"] = event_id
+        if client_ref:
+            data["client_ref"] = client_ref
+        
+        print(f"💾 СОХРАНЕНИЕ заказа в Supabase...")
+        
+        result = self.write_without_missing_columns(data, self.write_order)
+        
+        if result is None:
+            # Заказ уже сохранен прошлой попыткой - берем существующую строку
+            existing = self.supabase.table("orders").select("*").eq("client_ref", client_ref).execute()
+            if existing.data:
+                print(f"♻️ Заказ {client_ref} уже был сохранен как #{existing.data[0]['id']}")
+                return existing.data[0]
+            raise RuntimeError("данные не вернулись от Supabase")
+        if not result.data:
+            raise RuntimeError("данные не вернулись от Supabase")
+        
+        order_id = result.data[0]['id']
+        self.stats.on_order_added(result.data[0])
+        print(f"✅ Заказ #{order_id} сохранен в Supabase")
+        log_event(user_id, username, "💾 СОХРАНЕНИЕ В БД", f"ID: {order_id}")
+        return result.data[0]
+    
+    def write_order(self, data):
+        """Сохранение заказа; None - заказ с этим client_ref уже есть"""
+        if "client_ref" in data:
+            if self.client_ref_indexed:
+                try:
+                    result = self.supabase.table("orders").upsert(data, on_conflict="client_ref", ignore_duplicates=True).execute()
+                    return result if result.data else None
+                except Exception as e:
+                    # 42P10: для on_conflict нет уникального индекса
+                    if getattr(e, "code", None) != "42P10":
+                        raise
+                    self.client_ref_indexed = False
+                    print("⚠️ Нет уникального индекса orders.client_ref, повтор заказа проверяется отдельным запросом")
+                    print("💡 Примените sql/orders_client_ref.sql в Supabase Dashboard")
+            # Без индекса: сначала ищем строку, сохраненную прошлой попыткой
+            existing = self.supabase.table("orders").select("id").eq("client_ref", data["client_ref"]).limit(1).execute()
+            if existing.data:
                 return None
-                
+        return self.supabase.table("orders").insert(data).execute()
+    
+    def write_without_missing_columns(self, data, write):
+        """write(data) без колонок, которых нет в orders; колонку, отвергнутую PostgREST,
+        запоминает и повторяет запрос без нее (миграция не применена - пишем как до нее)"""
+        for column in self.missing_order_columns:
+            data.pop(column, None)
+        while True:
+            try:
+                return write(data)
+            except Exception as e:
+                column = self.missing_order_column(e, data)
+                if column is None:
+                    raise
+                self.mark_column_missing(column, "заказы сохраняются без нее")
+                data.pop(column)
+    
+    def mark_column_missing(self, column, fallback):
+        self.missing_order_columns.add(column)
+        print(f"⚠️ В таблице orders нет колонки {column}, {fallback}")
+        print(f"💡 Примените {OPTIONAL_ORDER_COLUMNS[column]} в Supabase Dashboard")
+    
+    def missing_order_column(self, error, columns):
+        """Необязательная колонка из columns, которую отверг PostgREST (нет в таблице), иначе None"""
+        if getattr(error, "code", None) not in ("42703", "PGRST204"):
+            return None
+        message = getattr(error, "message", None) or str(error)
+        return next((column for column in OPTIONAL_ORDER_COLUMNS if column in columns and column in message), None)
+    
+    def add_order(self, user_id, username, tariff, participants, total_price, event_id=None, receipt=None, client_ref=None):
+        """СОХРАНЕНИЕ ЗАКАЗА В SUPABASE (None при ошибке)"""
+        try:
+            return self.insert_order(user_id, username, tariff, participants, total_price, event_id, receipt, client_ref)
         except Exception as e:
             print(f"❌ Критическая ошибка сохранения заказа: {e}")
             log_event(user_id, username, "❌ ОШИБКА СОХРАНЕНИЯ", str(e))
             return None
     
-    def update_order_status(self, order_id, status, receipt_verified=False):
-        """ОБНОВЛЕНИЕ СТАТУСА ЗАКАЗА В SUPABASE"""
-        try:
+    def update_order_status(self, order_id, status, receipt_verified=False, previous_status=None):
+        """ОБНОВЛЕНИЕ СТАТУСА ЗАКАЗА В SUPABASE (previous_status нужен для инкрементальной статистики)"""
+        update_data = {"status": status}
+        if receipt_verified:
+            update_data["receipt_verified"] = True
+            
+        result = self.supabase.table("orders")\
+            .update(update_data)\
+            .eq("id", order_id)\
+            .execute()
+        
+        if result.data:
+            self.stats.on_status_changed(result.data[0], previous_status)
+            print(f"✅ Статус заказа {order_id} обновлен на '{status}'")
+            return result.data[0]
+        return None
+    
+    def update_orders_status(self, order_ids, status, receipt_verified=False):
+        """МАССОВОЕ ОБНОВЛЕНИЕ СТАТУСА: одно чтение статусов и один update с in_()
+        
+        Возвращает (обновленные строки, {id: статус до обновления}).
+        Заказы, которых нет или которые уже в этом статусе, не обновляются."""
+        before = self.supabase.table("orders")\
+            .select("id, status")\
+            .in_("id", order_ids)\
+            .execute()
+        previous = {row['id']: row['status'] for row in before.data or []}
+        
+        targets = [order_id for order_id, current in previous.items() if current != status]
+        updated = []
+        if targets:
             update_data = {"status": status}
             if receipt_verified:
                 update_data["receipt_verified"] = True
-                
             result = self.supabase.table("orders")\
                 .update(update_data)\
+                .in_("id", targets)\
+                .neq("status", status)\
+                .execute()
+            updated = result.data or []
+        
+        for order in updated:
+            self.stats.on_status_changed(order, previous.get(order['id']))
+        print(f"✅ Статус '{status}' установлен {len(updated)} заказам из {len(order_ids)}")
+        return updated, previous
+    
+    def update_order_fields(self, order_id, fields):
+        """ОБНОВЛЕНИЕ ПРОИЗВОЛЬНЫХ ПОЛЕЙ ЗАКАЗА В SUPABASE (None - заказ не найден)
+        
+        Необязательные колонки без миграции пропускаются; если других полей нет, обновлять нечего."""
+        def write(data):
+            if not data:
+                return {"id": order_id}
+            result = self.supabase.table("orders")\
+                .update(data)\
                 .eq("id", order_id)\
                 .execute()
-            
-            if result.data:
-                print(f"✅ Статус заказа {order_id} обновлен на '{status}'")
-                return result.data[0]
-            return None
-        except Exception as e:
-            print(f"❌ Ошибка обновления статуса: {e}")
-            return None
+            return result.data[0] if result.data else None
+        
+        return self.write_without_missing_columns(dict(fields), write)
     
     def get_order_by_id(self, order_id):
-        """ПОЛУЧЕНИЕ ЗАКАЗА ИЗ SUPABASE"""
+        """ПОЛУЧЕНИЕ ЗАКАЗА ИЗ SUPABASE (None - заказа нет)"""
+        result = self.supabase.table("orders")\
+            .select("*")\
+            .eq("id", order_id)\
+            .execute()
+        
+        if result.data:
+            return result.data[0]
+        return None
+    
+    def get_orders_page(self, status=None, cursor=None, backwards=False, limit=ORDERS_PAGE_SIZE):
+        """СТРАНИЦА ЗАКАЗОВ (новые сверху) - keyset-пагинация по (created_at, id)
+        
+        cursor - (created_at, id) крайнего заказа текущей страницы: следующая страница
+        берется после него, предыдущая (backwards) - перед ним. Запрос читает только
+        limit + 1 строк по индексу, поэтому стоит одинаково при любом числе заказов.
+        Возвращает (заказы, есть_еще)."""
+        def fetch(columns):
+            query = self.supabase.table("orders").select(columns)
+            if status:
+                query = query.eq("status", status)
+            if cursor:
+                created_at, order_id = cursor
+                op = "gt" if backwards else "lt"
+                query = query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{int(order_id)})')
+            return query\
+                .order("created_at", desc=not backwards)\
+                .order("id", desc=not backwards)\
+                .limit(limit + 1)\
+                .execute()
+        
+        if "participants_count" not in self.missing_order_columns:
+            try:
+                rows = fetch(ORDER_LIST_COLUMNS).data or []
+            except Exception as e:
+                if self.missing_order_column(e, ("participants_count",)) is None:
+                    raise
+                self.mark_column_missing("participants_count", "списки читают participants")
+        if "participants_count" in self.missing_order_columns:
+            # Без миграции число участников считается по JSON
+            rows = fetch(ORDER_LIST_COLUMNS.replace("participants_count", "participants")).data or []
+            for row in rows:
+                row['participants_count'] = len(row.pop('participants') or [])
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        return rows, has_more
+    
+    def get_pending_orders(self):
+        """ПОЛУЧЕНИЕ ОЖИДАЮЩИХ ЗАКАЗОВ ИЗ SUPABASE"""
+        result = self.supabase.table("orders")\
+            .select("*")\
+            .eq("status", "pending")\
+            .order("created_at", desc=True)\
+            .execute()
+        
+        return result.data or []
+    
+    def get_unarchived_receipts(self):
+        """ЗАКАЗЫ, ЧЕКИ КОТОРЫХ ЕЩЕ НЕ ЗАГРУЖЕНЫ В STORAGE"""
+        result = self.supabase.table("orders")\
+            .select("id, user_id, receipt_file_id, receipt_file_type, processing_attempts")\
+            .in_("processing_status", ["queued", "retrying"])\
+            .not_.is_("receipt_file_id", "null")\
+            .order("id")\
+            .execute()
+        return result.data or []
+    
+    def get_statistics(self):
+        """СТАТИСТИКА ИЗ КЭША (загружается из Supabase, если кэш пуст или устарел)"""
+        data, fresh = self.stats.snapshot()
+        if fresh:
+            return data
+        return self.refresh_statistics() or data or {}
+    
+    def refresh_statistics(self):
+        """ЗАГРУЗКА ВСЕЙ СТАТИСТИКИ ОДНИМ ЗАПРОСОМ К SUPABASE"""
+        day, day_start, day_end = today_bounds()
+        try:
+            result = self.supabase.rpc("order_statistics", {
+                "day_start": day_start,
+                "day_end": day_end
+            }).execute()
+            data = result.data
+        except Exception as e:
+            if not is_schema_error(e):
+                raise
+            print(f"⚠️ RPC order_statistics недоступна ({e}), считаем статистику по старой схеме")
+            print("💡 Создайте функцию из sql/order_statistics.sql в Supabase Dashboard")
+            data = self.compute_statistics_legacy(day_start, day_end)
+        
+        if not data:
+            return {}
+        self.stats.load(data, day)
+        return self.stats.snapshot()[0]
+    
+    def get_catalog_rows(self):
+        """АКТИВНЫЕ МЕРОПРИЯТИЯ И ТАРИФЫ ИЗ SUPABASE (None - таблиц нет или ошибка)"""
         try:
+            events = self.supabase.table("events").select("*").eq("is_active", True).order("sort_order").order("starts_at").execute()
+            tariffs = self.supabase.table("tariffs").select("*").eq("is_active", True).order("sort_order").order("id").execute()
+            self.catalog_error_reported = False
+            return events.data or [], tariffs.data or []
+        except Exception as e:
+            if not is_schema_error(e):
+                raise
+            # Сообщаем один раз, а не при каждом обновлении каталога
+            if not getattr(self, "catalog_error_reported", False):
+                print(f"⚠️ Каталог мероприятий из Supabase недоступен ({e}), используем текущий")
+                print("💡 Создайте таблицы из sql/events_catalog.sql в Supabase Dashboard")
+                self.catalog_error_reported = True
+            return None
+    
+    def count_active_orders(self):
+        """КОЛИЧЕСТВО НЕОТМЕНЕННЫХ ЗАКАЗОВ ПО ТАРИФАМ АКТИВНЫХ МЕРОПРИЯТИЙ: {(event_id, тариф): заказов}
+        
+        Считает база (RPC active_order_counts): ответ - строка на тариф, а не все заказы."""
+        if self.order_counts_rpc:
+            try:
+                result = self.supabase.rpc("active_order_counts", {}).execute()
+                return {(row.get('event_id') or DEFAULT_EVENT['id'], row['tariff']): row['orders'] for row in result.data or []}
+            except Exception as e:
+                if not is_schema_error(e):
+                    raise
+                self.order_counts_rpc = False
+                print(f"⚠️ RPC active_order_counts недоступна ({e}), места считаются по всем заказам")
+                print("💡 Создайте функцию из sql/inventory.sql в Supabase Dashboard")
+        return self.count_active_orders_legacy()
+    
+    def count_active_orders_legacy(self, page_size=1000):
+        """ПОДСЧЕТ ЗАНЯТЫХ МЕСТ ПОСТРАНИЧНЫМ ЧТЕНИЕМ ЗАКАЗОВ (если RPC еще не создана)"""
+        counts = {}
+        offset = 0
+        while True:
             result = self.supabase.table("orders")\
-                .select("*")\
-                .eq("id", order_id)\
+                .select("event_id, tariff")\
+                .not_.in_("status", list(RELEASED_STATUSES))\
+                .order("id")\
+                .range(offset, offset + page_size - 1)\
                 .execute()
-            
-            if result.data:
-                return result.data[0]
+            for row in result.data:
+                key = (row.get('event_id') or DEFAULT_EVENT['id'], row['tariff'])
+                counts[key] = counts.get(key, 0) + 1
+            if len(result.data) < page_size:
+                return counts
+            offset += page_size
+    
+    def get_active_holds(self):
+        """АКТИВНЫЕ БРОНИ МЕСТ ВСЕХ РЕПЛИК БОТА (таблица seat_holds)"""
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        result = self.supabase.table("seat_holds").select("id, event_id, tariff_id, people").gt("expires_at", now).execute()
+        return result.data or []
+    
+    def reserve_seat(self, hold_id, tariff_id, user_id, people, hold_seconds):
+        """АТОМАРНАЯ БРОНЬ МЕСТА В SUPABASE: True - забронировано, False - мест нет, None - RPC недоступна"""
+        try:
+            result = self.supabase.rpc("reserve_seat", {
+                "p_hold_id": hold_id,
+                "p_tariff_id": tariff_id,
+                "p_user_id": user_id,
+                "p_people": people,
+                "p_hold_seconds": hold_seconds
+            }).execute()
+            return bool(result.data)
+        except Exception as e:
+            if not is_schema_error(e):
+                raise
+            print(f"⚠️ RPC reserve_seat недоступна ({e}), место проверено только локально")
+            print("💡 Создайте функцию из sql/inventory.sql в Supabase Dashboard")
             return None
+    
+    def delete_hold(self, hold_id):
+        """СНЯТИЕ БРОНИ (место освобождено или превратилось в заказ)"""
+        self.supabase.table("seat_holds").delete().eq("id", hold_id).execute()
+        return True
+    
+    def compute_statistics_legacy(self, day_start, day_end):
+        """ПОДСЧЕТ СТАТИСТИКИ НЕСКОЛЬКИМИ ЗАПРОСАМИ (если RPC еще не создана)"""
+        # Общее количество заказов
+        result_total = self.supabase.table("orders").select("id", count="exact").execute()
+        total_orders = result_total.count or 0
+        
+        # Оплаченные заказы
+        result_paid = self.supabase.table("orders").select("id", count="exact").eq("status", "paid").execute()
+        paid_orders = result_paid.count or 0
+        
+        # Ожидающие заказы
+        result_pending = self.supabase.table("orders").select("id", count="exact").eq("status", "pending").execute()
+        pending_orders = result_pending.count or 0
+        
+        # Общая выручка
+        result_revenue = self.supabase.table("orders").select("total_price").eq("status", "paid").execute()
+        total_revenue = sum(order['total_price'] for order in result_revenue.data) if result_revenue.data else 0
+        
+        # Уникальные пользователи
+        result_users = self.supabase.table("orders").select("user_id").execute()
+        unique_users = len(set(order['user_id'] for order in result_users.data)) if result_users.data else 0
+        
+        # Заказы за сегодня
+        result_today = self.supabase.table("orders").select("id", count="exact").gte("created_at", day_start).lt("created_at", day_end).execute()
+        today_orders = result_today.count or 0
+        
+        # Выручка за сегодня
+        result_today_revenue = self.supabase.table("orders").select("total_price").eq("status", "paid").gte("created_at", day_start).lt("created_at", day_end).execute()
+        today_revenue = sum(order['total_price'] for order in result_today_revenue.data) if result_today_revenue.data else 0
+        
+        return {
+            'total_orders': total_orders,
+            'paid_orders': paid_orders,
+            'pending_orders': pending_orders,
+            'total_revenue': total_revenue,
+            'unique_users': unique_users,
+            'today_orders': today_orders,
+            'today_revenue': today_revenue
+        }
+
+class CircuitOpenError(Exception):
+    """Supabase недоступен: запрос отклонен без ожидания таймаута"""
+
+class CircuitBreaker:
+    """После threshold ошибок подряд запросы отклоняются сразу; через reset_timeout
+    пропускается один пробный запрос, и если он успешен - цепь снова замкнута"""
+    def __init__(self, threshold=DB_BREAKER_THRESHOLD, reset_timeout=DB_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+    
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.probing = True
+            return True
+        return False
+    
+    def record_success(self):
+        if self.opened_at is not None:
+            print("🟢 Supabase снова отвечает, запросы возобновлены")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                print(f"🔴 Supabase не отвечает ({self.failures} ошибок подряд), запросы отклоняются {self.reset_timeout:.0f}с")
+            self.opened_at = time.monotonic()
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database: запросы идут в ограниченном пуле потоков с таймаутом,
+    поэтому обработчики не блокируют event loop и выполняются параллельно"""
+    def __init__(self, database, max_concurrency=DB_MAX_CONCURRENCY, timeout=DB_CALL_TIMEOUT):
+        self.db = database
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="supabase")
+        self.breaker = CircuitBreaker()
+        self.stats_refresh_task = None
+    
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Выполняет синхронный вызов supabase-py в пуле; TimeoutError пробрасывается вызывающему
+        
+        Таймауты и исключения считаются предохранителем: когда Supabase лежит,
+        вызов сразу падает с CircuitOpenError, а не ждет таймаут в очереди пула."""
+        # Методы Database - в гистограмму базы, остальное (bucket, list, download) - в Storage
+        if getattr(func, "__self__", None) is self.db:
+            histogram, labels = db_seconds, {"method": func.__name__}
+        else:
+            histogram, labels = storage_seconds, {"operation": func.__name__}
+        if not self.breaker.allow():
+            histogram.observe(0.0, outcome="rejected", **labels)
+            raise CircuitOpenError(f"Supabase недоступен, {func.__name__} отклонен")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        try:
+            result = await asyncio.wait_for(future, timeout or self.timeout)
+        except Exception as e:
+            # Отказ по существу (схема, ограничения, данные) - ответ Supabase, а не сбой: предохранитель его не считает
+            if isinstance(e, PostgrestAPIError) and not is_transient_error(e):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            histogram.observe(time.perf_counter() - started, outcome=outcome, **labels)
+            raise
+        self.breaker.record_success()
+        histogram.observe(time.perf_counter() - started, outcome="ok", **labels)
+        return result
+    
+    async def _call(self, method, *args, default=None, **kwargs):
+        """Вызов метода Database; при любой ошибке (она уже учтена предохранителем) возвращает default"""
+        try:
+            return await self.run(method, *args, **kwargs)
+        except asyncio.TimeoutError:
+            print(f"⏱ Таймаут запроса к Supabase: {method.__name__} (>{self.timeout}с)")
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"❌ Ошибка Supabase в {method.__name__}: {e}")
+        return default
+    
+    async def add_order(self, user_id, username, tariff, participants, total_price, event_id=None, receipt=None, client_ref=None):
+        """Сохраняет заказ; ошибка Supabase видна предохранителю, вызывающий получает None"""
+        try:
+            return await self.run(self.db.insert_order, user_id, username, tariff, participants, total_price,
+                                  event_id, receipt, client_ref)
+        except asyncio.TimeoutError:
+            print(f"⏱ Таймаут сохранения заказа в Supabase (>{self.timeout}с)")
+        except CircuitOpenError as e:
+            print(f"⚡ {e}")
+        except Exception as e:
+            print(f"❌ Критическая ошибка сохранения заказа: {e}")
+            log_event(user_id, username, "❌ ОШИБКА СОХРАНЕНИЯ", str(e))
+        return None
+    
+    async def update_order_status(self, order_id, status, receipt_verified=False, previous_status=None):
+        return await self._call(self.db.update_order_status, order_id, status, receipt_verified, previous_status)
+    
+    async def update_orders_status(self, order_ids, status, receipt_verified=False):
+        return await self._call(self.db.update_orders_status, order_ids, status, receipt_verified)
+    
+    async def update_order_fields(self, order_id, fields):
+        return await self._call(self.db.update_order_fields, order_id, fields)
+    
+    async def get_order_by_id(self, order_id):
+        return await self._call(self.db.get_order_by_id, order_id)
+    
+    async def get_orders_page(self, status=None, cursor=None, backwards=False):
+        return await self._call(self.db.get_orders_page, status, cursor, backwards)
+    
+    async def get_pending_orders(self):
+        return await self._call(self.db.get_pending_orders, default=[])
+    
+    async def get_unarchived_receipts(self):
+        return await self._call(self.db.get_unarchived_receipts, default=[])
+    
+    async def get_catalog_rows(self):
+        return await self._call(self.db.get_catalog_rows)
+    
+    async def count_active_orders(self):
+        return await self._call(self.db.count_active_orders)
+    
+    async def get_active_holds(self):
+        return await self._call(self.db.get_active_holds)
+    
+    async def reserve_seat(self, hold_id, tariff_id, user_id, people, hold_seconds):
+        return await self._call(self.db.reserve_seat, hold_id, tariff_id, user_id, people, hold_seconds)
+    
+    async def delete_hold(self, hold_id):
+        return await self._call(self.db.delete_hold, hold_id, default=False)
+    
+    async def get_statistics(self):
+        """Статистика без ожидания Supabase: устаревший кэш отдается сразу и обновляется в фоне"""
+        data, fresh = self.db.stats.snapshot()
+        if data is None:
+            return await self._refresh_statistics()
+        if not fresh and (self.stats_refresh_task is None or self.stats_refresh_task.done()):
+            self.stats_refresh_task = asyncio.create_task(self._refresh_statistics())
+        return data
+    
+    async def _refresh_statistics(self):
+        return await self._call(self.db.refresh_statistics, default={})
+    
+    def shutdown(self):
+        """Останавливает пул потоков, не дожидаясь зависших запросов"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# СОЗДАЕМ ЭКЗЕМПЛЯР БАЗЫ ДАННЫХ
+db = Database()
+adb = AsyncDatabase(db)
+
+# ОБНОВЛЕНИЕ КАТАЛОГА МЕРОПРИЯТИЙ
+async def refresh_catalog(reconcile=True):
+    """Перечитывает мероприятия и тарифы; при изменениях атомарно подменяет снимок каталога
+    
+    Если таблиц нет или Supabase недоступен, продолжаем продавать текущий каталог.
+    reconcile=False - занятые места пересчитает вызывающий (загрузка при старте)."""
+    global catalog_snapshot
+    rows = await adb.get_catalog_rows()
+    if rows is None:
+        return catalog_snapshot
+    
+    event_rows, tariff_rows = rows
+    version = catalog_version(event_rows, tariff_rows)
+    if version == catalog_snapshot.version:
+        return catalog_snapshot
+    
+    snapshot = build_snapshot(events_from_rows(event_rows, tariff_rows), version, "supabase")
+    catalog_snapshot = snapshot
+    print(f"🔄 Каталог обновлен (версия {version}): мероприятий {len(snapshot.events)}, тарифов {len(snapshot.tariffs)}")
+    # Ключи тарифов могли поменяться - пересчитываем занятые места под новый каталог
+    if reconcile:
+        spawn(inventory.reconcile())
+    return snapshot
+
+async def run_catalog_refresher():
+    """Фоновое обновление каталога без перезапуска бота"""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+        try:
+            await refresh_catalog()
+        except Exception as e:
+            print(f"❌ Ошибка обновления каталога: {e}")
+
+# ПЛАНИРОВЩИК СРОКОВ
+class DeadlineScheduler:
+    """Таймеры на куче: добавление и отмена за O(log n), одна фоновая задача спит до ближайшего срока
+    
+    Ключ таймера уникален: повторный schedule с тем же ключом переносит срок.
+    Отмененные таймеры удаляются из кучи лениво, когда доходит их очередь."""
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # ключ -> запись в куче
+        self.counter = itertools.count()
+        self.wakeup = None
+    
+    def schedule(self, key, deadline, callback, *args):
+        """Вызовет callback(*args) в момент deadline (time.time())"""
+        self.cancel(key)
+        entry = [deadline, next(self.counter), key, callback, args, True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        # Новый срок раньше всех - будим задачу, чтобы она пересчитала сон
+        if self.heap[0] is entry and self.wakeup is not None:
+            self.wakeup.set()
+    
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = False
+            # Отмененных записей слишком много - перестраиваем кучу
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [item for item in self.heap if item[-1]]
+                heapq.heapify(self.heap)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            while self.heap and not self.heap[0][-1]:
+                heapq.heappop(self.heap)
+            timeout = None
+            if self.heap:
+                timeout = self.heap[0][0] - time.time()
+                if timeout <= 0:
+                    deadline, _, key, callback, args, _ = heapq.heappop(self.heap)
+                    self.entries.pop(key, None)
+                    spawn(self._fire(key, callback, args))
+                    continue
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _fire(self, key, callback, args):
+        try:
+            await callback(*args)
         except Exception as e:
-            print(f"❌ Ошибка получения заказа: {e}")
+            print(f"❌ Ошибка обработки срока {key}: {e}")
+
+scheduler = DeadlineScheduler()
+
+# УЧЕТ МЕСТ
+class Inventory:
+    """Счетчики занятых мест по тарифам и мероприятиям
+    
+    Занятым считается место неотмененного заказа или активной брони (hold), которую
+    пользователь получает при переходе к оплате. Счетчики живут в памяти, поэтому
+    проверка «есть ли места» и клавиатуры без распроданных тарифов не делают запросов;
+    раз в INVENTORY_RECONCILE_INTERVAL секунд они сверяются с таблицей orders.
+    
+    Для мероприятий из Supabase бронь атомарно проверяется в базе (RPC reserve_seat),
+    это защищает от овербукинга при нескольких репликах бота. Для мероприятия по
+    умолчанию бронь проверяется только в памяти процесса."""
+    def __init__(self):
+        self.taken = {}  # ключ тарифа -> занято заказов/броней
+        self.people = {}  # id мероприятия -> занято мест (человек)
+        self.holds = {}  # id брони -> данные брони этого процесса
+        self.catalogs = {}  # (каталог, распроданные тарифы) -> каталог без распроданных
+    
+    def is_remote(self, tariff):
+        return catalog_snapshot.source == "supabase" and tariff.key.isdigit()
+    
+    def has_room(self, tariff, snapshot=None):
+        """Можно ли продать еще один заказ тарифа (без запросов к базе)"""
+        if tariff.capacity is not None and self.taken.get(tariff.key, 0) >= tariff.capacity:
+            return False
+        event = (snapshot or catalog_snapshot).events.get(tariff.event_id)
+        if event and event.capacity is not None and self.people.get(event.id, 0) + tariff.min_people > event.capacity:
+            return False
+        return True
+    
+    def catalog(self, event):
+        """Каталог мероприятия, из которого убраны распроданные тарифы"""
+        sold_out = frozenset(key for key, tariff in event.catalog.tariffs.items() if not self.has_room(tariff))
+        if not sold_out:
+            return event.catalog
+        cache_key = (id(event.catalog), sold_out)
+        cached = self.catalogs.get(cache_key)
+        if cached is None or cached[0] is not event.catalog:
+            views = {key: tariff for key, tariff in event.catalog.tariffs.items() if key not in sold_out}
+            cached = (event.catalog, catalog_from_views(event.title, views))
+            self.catalogs[cache_key] = cached
+        return cached[1]
+    
+    def _add(self, tariff, sign=1):
+        self.taken[tariff.key] = max(0, self.taken.get(tariff.key, 0) + sign)
+        self.people[tariff.event_id] = max(0, self.people.get(tariff.event_id, 0) + sign * tariff.min_people)
+    
+    def is_held(self, hold_id):
+        hold = self.holds.get(hold_id)
+        return bool(hold) and hold['expires_at'] > time.time()
+    
+    async def reserve(self, user_id, tariff):
+        """Бронирует место на HOLD_TTL секунд; возвращает id брони или None, если мест нет"""
+        if not self.has_room(tariff):
+            return None
+        
+        hold_id = uuid.uuid4().hex
+        if self.is_remote(tariff):
+            reserved = await adb.reserve_seat(hold_id, int(tariff.key), user_id, tariff.min_people, HOLD_TTL)
+            if reserved is False:
+                # Места выкупили через другую реплику - прячем тариф до следующей сверки
+                if tariff.capacity is not None:
+                    self.taken[tariff.key] = max(self.taken.get(tariff.key, 0), tariff.capacity)
+                return None
+            # Пока ждали базу, последнее место мог занять другой обработчик этого процесса
+            if reserved is None and not self.has_room(tariff):
+                return None
+        
+        self._add(tariff)
+        expires_at = time.time() + HOLD_TTL
+        self.holds[hold_id] = {
+            'tariff_key': tariff.key,
+            'event_id': tariff.event_id,
+            'user_id': user_id,
+            'expires_at': expires_at,
+            'remote': self.is_remote(tariff)
+        }
+        scheduler.schedule(("hold", hold_id), expires_at, expire_hold, hold_id)
+        return hold_id
+    
+    async def release(self, hold_id):
+        """Освобождает бронь (пользователь передумал или бронь истекла)"""
+        hold = self.holds.pop(hold_id, None)
+        if hold is None:
+            return
+        scheduler.cancel(("hold", hold_id))
+        tariff = catalog_snapshot.tariffs.get(hold['tariff_key'])
+        if tariff:
+            self._add(tariff, -1)
+        if hold['remote']:
+            await adb.delete_hold(hold_id)
+    
+    async def confirm(self, hold_id, tariff_name, event_id, stored=True):
+        """Бронь превратилась в заказ; возвращает False, если заказ превысил лимит мест
+        
+        Если бронь уже истекла, место занимается заново (деньги переведены, заказ
+        сохраняем в любом случае, а превышение лимита показываем админам).
+        stored=False - заказ пока только в журнале: бронь держится без срока, пока
+        журнал не сохранит заказ (order_stored), иначе место не считалось бы ни бронью, ни заказом."""
+        hold = self.holds.get(hold_id) if hold_id else None
+        if hold is not None:
+            scheduler.cancel(("hold", hold_id))
+            if stored:
+                await self.order_stored(hold_id)
+            else:
+                hold['expires_at'] = float("inf")
+            return True
+        
+        tariff = self.find_tariff(event_id, tariff_name)
+        if tariff is None:
+            return True
+        fits = self.has_room(tariff)
+        self._add(tariff)
+        return fits
+    
+    async def order_stored(self, hold_id):
+        """Заказ сохранен в Supabase - его бронь больше не нужна"""
+        hold = self.holds.pop(hold_id, None)
+        scheduler.cancel(("hold", hold_id))
+        # После перезапуска локальной записи нет, но бронь в seat_holds могла остаться
+        if hold['remote'] if hold else catalog_snapshot.source == "supabase":
+            await adb.delete_hold(hold_id)
+    
+    def find_tariff(self, event_id, tariff_name):
+        event = catalog_snapshot.event(event_id or DEFAULT_EVENT['id'])
+        if event is None:
             return None
+        return next((tariff for tariff in event.catalog.tariffs.values() if tariff.name == tariff_name), None)
+    
+    def on_order_cancelled(self, order):
+        """Отмененный заказ освобождает место"""
+        tariff = self.find_tariff(order.get('event_id'), order['tariff'])
+        if tariff:
+            self._add(tariff, -1)
+    
+    async def reconcile(self):
+        """Пересчитывает счетчики по таблице orders и активным броням"""
+        snapshot = catalog_snapshot
+        orders = await adb.count_active_orders()
+        if orders is None:
+            return
+        remote_holds = await adb.get_active_holds() if snapshot.source == "supabase" else []
+        
+        taken = {}
+        people = {}
+        for event in snapshot.events.values():
+            for key, tariff in event.catalog.tariffs.items():
+                count = orders.get((event.id, tariff.name), 0)
+                if count:
+                    taken[key] = count
+                    people[event.id] = people.get(event.id, 0) + count * tariff.min_people
+        
+        # Брони в Supabase видны всем репликам; локальные учитываем, только если их там нет
+        holds = [{'tariff_key': str(row['tariff_id']), 'event_id': row['event_id']} for row in remote_holds or []]
+        remote_ids = {row['id'] for row in remote_holds or []}
+        holds += [hold for hold_id, hold in self.holds.items() if hold_id not in remote_ids and self.is_held(hold_id)]
+        for hold in holds:
+            tariff = snapshot.tariffs.get(hold['tariff_key'])
+            if tariff:
+                taken[tariff.key] = taken.get(tariff.key, 0) + 1
+                people[tariff.event_id] = people.get(tariff.event_id, 0) + tariff.min_people
+        
+        self.taken = taken
+        self.people = people
+        self.catalogs.clear()
+    
+    async def run_reconciler(self):
+        while True:
+            await asyncio.sleep(INVENTORY_RECONCILE_INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"❌ Ошибка сверки мест: {e}")
+
+inventory = Inventory()
+
+# ИСТЕЧЕНИЕ СРОКОВ
+def format_duration(seconds):
+    """Срок для сообщений: «30 мин», «2 ч», «1 ч 30 мин»"""
+    hours, minutes = divmod(max(1, round(seconds / 60)), 60)
+    if not hours:
+        return f"{minutes} мин"
+    return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+
+async def expire_hold(hold_id):
+    """Бронь не превратилась в заказ вовремя - место возвращается в продажу"""
+    hold = inventory.holds.get(hold_id)
+    if hold is None:
+        return
+    await inventory.release(hold_id)
+    log_event(hold['user_id'], None, "⏳ БРОНЬ ИСТЕКЛА", f"Тариф: {hold['tariff_key']}", hold_id=hold_id)
+    if HOLD_EXPIRY_NOTIFY:
+        try:
+            await bot.send_message(
+                hold['user_id'],
+                "⏳ <b>Бронь места истекла</b>\n\n"
+                "Мы вернули место в продажу. Если вы уже оплатили - просто пришлите чек сюда, "
+                "заказ будет сохранен. Если передумали - выберите тариф заново в меню.",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось напомнить {hold['user_id']} об истекшей брони: {e}")
+
+def schedule_checkout_expiry(user_id):
+    """Брошенная корзина на шаге оплаты очищается через CHECKOUT_TTL (срок сдвигается при каждом шаге)"""
+    scheduler.schedule(("checkout", user_id), time.time() + CHECKOUT_TTL, expire_checkout, user_id)
+
+def arm_checkout_timers():
+    """Восстанавливает сроки корзин на шаге оплаты из FSM-хранилища (таймеры живут только в памяти)
+    
+    Срок отсчитывается от последнего изменения сессии. В памяти корзины перезапуск
+    не переживают, а Redis не перебираем (как и в fsm_state_counts)."""
+    if not isinstance(storage, SQLiteStorage):
+        return 0
+    states = (OrderStates.waiting_for_payment.state, OrderStates.waiting_for_receipt.state)
+    armed = 0
+    for storage_key, updated_at in storage.sessions_in_states(states):
+        # Ключ личного чата: fsm:<bot_id>:<chat_id>:<user_id>:default
+        parts = storage_key.split(storage.key_builder.separator)
+        if len(parts) != 5 or parts[1] != str(bot.id) or parts[2] != parts[3]:
+            continue
+        user_id = int(parts[3])
+        scheduler.schedule(("checkout", user_id), updated_at + CHECKOUT_TTL, expire_checkout, user_id)
+        armed += 1
+    return armed
+
+async def expire_checkout(user_id):
+    key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+    context = FSMContext(storage=storage, key=key)
+    current = await context.get_state()
+    if current not in (OrderStates.waiting_for_payment.state, OrderStates.waiting_for_receipt.state):
+        return
+    data = await context.get_data()
+    if data.get('hold_id'):
+        await inventory.release(data['hold_id'])
+    await context.clear()
+    log_event(user_id, None, "🧹 КОРЗИНА ОЧИЩЕНА ПО СРОКУ", f"Тариф: {data.get('tariff_name')}")
+
+def schedule_order_expiry(order):
+    """Неподтвержденный заказ истекает через PENDING_ORDER_TTL после создания"""
+    if PENDING_ORDER_TTL <= 0:
+        return
+    try:
+        created = datetime.datetime.fromisoformat(order['created_at'])
+        # created_at без часового пояса - время UTC (как пишет Supabase)
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        created_at = created.timestamp()
+    except (KeyError, TypeError, ValueError):
+        created_at = time.time()
+    scheduler.schedule(("order", order['id']), created_at + PENDING_ORDER_TTL, expire_pending_order, order['id'])
+
+async def expire_pending_order(order_id):
+    order = await adb.get_order_by_id(order_id)
+    if not order or order['status'] != "pending" or order.get('receipt_verified'):
+        return
+    if not await adb.update_order_status(order_id, "expired", previous_status="pending"):
+        return
+    inventory.on_order_cancelled(order)
+    print(f"⏳ Заказ #{order_id} истек: не подтвержден за {format_duration(PENDING_ORDER_TTL)}")
+    log_event(order['user_id'], order.get('username'), "⏳ ЗАКАЗ ИСТЕК", f"Заказ #{order_id}", order_id=order_id)
+    try:
+        await bot.send_message(
+            order['user_id'],
+            f"⏳ <b>Заказ #{order_id} не был подтвержден вовремя</b>\n\n"
+            f"Если вы оплатили заказ, напишите в поддержку - мы все проверим.\n\n"
+            f"💬 <b>По вопросам:</b> @m5frls",
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        print(f"⚠️ Не удалось уведомить {order['user_id']} об истекшем заказе: {e}")
+
+# ЖУРНАЛ ЗАКАЗОВ
+class OrderJournal:
+    """Локальный журнал заказов (SQLite с fsync на каждую запись)
+    
+    Заказ сначала записывается в журнал и только потом отправляется в Supabase.
+    Если Supabase недоступен, пользователь все равно получает подтверждение, а
+    фоновая задача досылает заказ с растущей паузой. Повторная отправка не создает
+    дублей: у заказа уникальный client_ref. Заказ, который Supabase отклоняет по
+    существу (ограничения, данные), не держит очередь, а после JOURNAL_MAX_ERRORS
+    отказов откладывается (dead_at) с уведомлением админов."""
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self._connection = None
+        self.wakeup = None
+        # Одна досылка за раз: иначе две могут одновременно считать отказ одного заказа
+        self.replay_lock = asyncio.Lock()
+    
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = open_local_db(self.path)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS order_journal (
+                    client_ref TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    order_id INTEGER,
+                    errors INTEGER NOT NULL DEFAULT 0,
+                    dead_at REAL,
+                    last_error TEXT
+                )
+            """)
+            # Журналы, созданные до отложенных записей
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(order_journal)")}
+            for column, definition in (("errors", "INTEGER NOT NULL DEFAULT 0"), ("dead_at", "REAL"), ("last_error", "TEXT")):
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE order_journal ADD COLUMN {column} {definition}")
+        return self._connection
+    
+    def append(self, client_ref, payload):
+        """Записывает заказ на диск; пока идет первая попытка, фоновая задача его не трогает"""
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO order_journal (client_ref, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (client_ref, json.dumps(payload, ensure_ascii=False), now, now + DB_CALL_TIMEOUT + JOURNAL_RETRY_DELAY)
+            )
+    
+    def mark_synced(self, client_ref, order_id):
+        with self.connection:
+            self.connection.execute("UPDATE order_journal SET order_id = ? WHERE client_ref = ?", (order_id, client_ref))
+    
+    def reschedule(self, client_ref, attempts, errors=0, error=None):
+        """Следующая попытка - с удваивающейся паузой; возвращает паузу"""
+        delay = min(JOURNAL_MAX_DELAY, JOURNAL_RETRY_DELAY * 2 ** (attempts - 1))
+        with self.connection:
+            self.connection.execute(
+                "UPDATE order_journal SET attempts = ?, next_attempt_at = ?, errors = ?, last_error = ? WHERE client_ref = ?",
+                (attempts, time.time() + delay, errors, error, client_ref)
+            )
+        self.notify()
+        return delay
+    
+    def mark_dead(self, client_ref, attempts, errors, error):
+        """Откладывает заказ, который Supabase не принимает: повторы прекращаются до разбора админом"""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE order_journal SET attempts = ?, errors = ?, last_error = ?, dead_at = ? WHERE client_ref = ?",
+                (attempts, errors, error, time.time(), client_ref)
+            )
     
-    def get_all_orders(self, limit=100):
-        """ПОЛУЧЕНИЕ ВСЕХ ЗАКАЗОВ ИЗ SUPABASE"""
-        try:
-            result = self.supabase.table("orders")\
-                .select("*")\
-                .order("created_at", desc=True)\
-                .limit(limit)\
-                .execute()
-            
-            return result.data or []
-        except Exception as e:
-            print(f"❌ Ошибка получения заказов: {e}")
-            return []
+    def unsynced(self):
+        return self.connection.execute(
+            "SELECT client_ref, payload, attempts, errors, next_attempt_at FROM order_journal "
+            "WHERE order_id IS NULL AND dead_at IS NULL ORDER BY created_at"
+        ).fetchall()
     
-    def get_pending_orders(self):
-        """ПОЛУЧЕНИЕ ОЖИДАЮЩИХ ЗАКАЗОВ ИЗ SUPABASE"""
-        try:
-            result = self.supabase.table("orders")\
-                .select("*")\
-                .eq("status", "pending")\
-                .order("created_at", desc=True)\
-                .execute()
+    def dead(self):
+        return self.connection.execute(
+            "SELECT client_ref, payload, last_error FROM order_journal WHERE order_id IS NULL AND dead_at IS NOT NULL ORDER BY created_at"
+        ).fetchall()
+    
+    def prune(self):
+        """Удаляет давно отправленные записи"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM order_journal WHERE order_id IS NOT NULL AND created_at < ?",
+                (time.time() - JOURNAL_KEEP_DAYS * 86400,)
+            )
+    
+    def notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    async def replay_due(self):
+        """Досылает заказы, у которых наступил срок повтора; возвращает паузу до следующего"""
+        async with self.replay_lock:
+            return await self._replay_due()
+    
+    async def _replay_due(self):
+        next_delay = None
+        for client_ref, payload, attempts, errors, next_attempt_at in self.unsynced():
+            wait = next_attempt_at - time.time()
+            if wait > 0:
+                next_delay = wait if next_delay is None else min(next_delay, wait)
+                continue
             
-            return result.data or []
-        except Exception as e:
-            print(f"❌ Ошибка получения pending заказов: {e}")
-            return []
+            payload = json.loads(payload)
+            hold_id = payload.pop('hold_id', None)
+            try:
+                order = await adb.run(db.insert_order, **payload, client_ref=client_ref)
+            except Exception as e:
+                if is_transient_error(e):
+                    # Supabase все еще недоступен - остальные записи ждут вместе с этой
+                    print(f"⏳ Supabase недоступен, заказ {client_ref} ждет ({e or type(e).__name__})")
+                    return self.reschedule(client_ref, attempts + 1)
+                # Supabase отклонил именно этот заказ - остальные досылаются дальше
+                errors += 1
+                print(f"❌ Заказ из журнала {client_ref} отклонен ({errors}/{JOURNAL_MAX_ERRORS}): {e}")
+                if errors >= JOURNAL_MAX_ERRORS:
+                    self.mark_dead(client_ref, attempts + 1, errors, str(e))
+                    await alert_dead_order(client_ref, payload, e)
+                else:
+                    wait = self.reschedule(client_ref, attempts + 1, errors, str(e))
+                    next_delay = wait if next_delay is None else min(next_delay, wait)
+                continue
+            
+            self.mark_synced(client_ref, order['id'])
+            print(f"📒 Заказ из журнала {client_ref} сохранен в Supabase как #{order['id']} (попыток: {attempts + 1})")
+            if hold_id:
+                await inventory.order_stored(hold_id)
+            await on_order_saved(order, payload['receipt'], notify_user=True)
+        return next_delay
     
-    def get_paid_orders(self):
-        """ПОЛУЧЕНИЕ ОПЛАЧЕННЫХ ЗАКАЗОВ ИЗ SUPABASE"""
+    async def run_replayer(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                delay = await self.replay_due()
+            except Exception as e:
+                print(f"❌ Ошибка отправки заказов из журнала: {e}")
+                delay = JOURNAL_RETRY_DELAY
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+order_journal = OrderJournal()
+
+async def alert_dead_order(client_ref, payload, error):
+    """Сообщает админам о заказе, который не удалось сохранить в Supabase"""
+    log_event(payload['user_id'], payload.get('username'), "☠️ ЗАКАЗ ИЗ ЖУРНАЛА ОТЛОЖЕН", str(error), client_ref=client_ref)
+    text = (f"⚠️ <b>Заказ не сохранен в Supabase</b>\n\n"
+            f"Supabase {JOURNAL_MAX_ERRORS} раз отклонил заказ из журнала, повторы остановлены.\n"
+            f"👤 Пользователь: {payload['user_id']} (@{payload.get('username') or '—'})\n"
+            f"🎫 Тариф: {html.escape(str(payload['tariff']))}, {payload['total_price']}₽\n"
+            f"🔖 client_ref: <code>{client_ref}</code>\n"
+            f"❌ Ошибка: {html.escape(str(error)[:300])}\n\n"
+            f"Запись осталась в таблице order_journal ({LOCAL_DB_PATH}).")
+    for admin_id in ADMIN_IDS:
         try:
-            result = self.supabase.table("orders")\
-                .select("*")\
-                .eq("status", "paid")\
-                .order("created_at", desc=True)\
-                .execute()
-            
-            return result.data or []
+            await bot.send_message(admin_id, text, parse_mode="HTML")
         except Exception as e:
-            print(f"❌ Ошибка получения paid заказов: {e}")
-            return []
-    
-    def get_statistics(self):
-        """ПОЛУЧЕНИЕ СТАТИСТИКИ ИЗ SUPABASE"""
+            print(f"⚠️ Не удалось уведомить админа {admin_id} об отложенном заказе: {e}")
+
+async def on_order_saved(order, receipt, notify_user=False):
+    """Фоновые шаги после сохранения заказа в Supabase"""
+    remember_receipt_file_id(order['id'], receipt['file_id'], receipt['file_type'])
+    receipt_archiver.enqueue(order['id'], order['user_id'], receipt['file_id'], receipt['file_type'])
+    schedule_order_expiry(order)
+    if notify_user:
         try:
-            # Общее количество заказов
-            result_total = self.supabase.table("orders").select("id", count="exact").execute()
-            total_orders = result_total.count or 0
-            
-            # Оплаченные заказы
-            result_paid = self.supabase.table("orders").select("id", count="exact").eq("status", "paid").execute()
-            paid_orders = result_paid.count or 0
-            
-            # Ожидающие заказы
-            result_pending = self.supabase.table("orders").select("id", count="exact").eq("status", "pending").execute()
-            pending_orders = result_pending.count or 0
-            
-            # Общая выручка
-            result_revenue = self.supabase.table("orders").select("total_price").eq("status", "paid").execute()
-            total_revenue = sum(order['total_price'] for order in result_revenue.data) if result_revenue.data else 0
-            
-            # Уникальные пользователи
-            result_users = self.supabase.table("orders").select("user_id").execute()
-            unique_users = len(set(order['user_id'] for order in result_users.data)) if result_users.data else 0
-            
-            # Заказы за сегодня
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
-            result_today = self.supabase.table("orders").select("id", count="exact").gte("created_at", f"{today}T00:00:00").lt("created_at", f"{today}T23:59:59").execute()
-            today_orders = result_today.count or 0
-            
-            # Выручка за сегодня
-            result_today_revenue = self.supabase.table("orders").select("total_price").eq("status", "paid").gte("created_at", f"{today}T00:00:00").lt("created_at", f"{today}T23:59:59").execute()
-            today_revenue = sum(order['total_price'] for order in result_today_revenue.data) if result_today_revenue.data else 0
-            
-            return {
-                'total_orders': total_orders,
-                'paid_orders': paid_orders,
-                'pending_orders': pending_orders,
-                'total_revenue': total_revenue,
-                'unique_users': unique_users,
-                'today_orders': today_orders,
-                'today_revenue': today_revenue
-            }
-            
+            await bot.send_message(
+                order['user_id'],
+                f"📦 <b>Ваш заказ сохранен под номером #{order['id']}</b>\n\n"
+                f"⏳ Ожидайте подтверждения в течение 24 часов",
+                parse_mode="HTML"
+            )
         except Exception as e:
-            print(f"❌ Ошибка получения статистики из Supabase: {e}")
-            return {}
+            print(f"⚠️ Не удалось сообщить номер заказа {order['user_id']}: {e}")
+
+# ЗАПИСЬ АПДЕЙТОВ ДЛЯ ВОСПРОИЗВЕДЕНИЯ
+# Тексты кнопок главного меню: обработчики ловят их дословно, поэтому они не обезличиваются
+MENU_BUTTON_TEXTS = {"🚀 Старт", "📅 Информация о мероприятии", "🎫 Посмотреть тарифы", "💬 Помощь", "👨‍💼 Консоль Админа"}
+CAPTURE_DROPPED_FIELDS = {"last_name", "phone_number", "contact", "location", "venue", "bio", "photo_url"}
+
+def capture_pseudonym(value):
+    """Стабильный псевдоним id пользователя или чата (админы остаются админами)"""
+    if value in ADMIN_IDS:
+        return value
+    digest = hashlib.blake2b(f"{UPDATE_CAPTURE_SALT}:{value}".encode(), digest_size=5).digest()
+    pseudonym = 1_000_000_000 + int.from_bytes(digest, "big") % 9_000_000_000
+    return -pseudonym if value < 0 else pseudonym
+
+def capture_scrub_text(text):
+    """Заменяет буквы и цифры, сохраняя длину, строки, запятые, @ и эмодзи
+
+    Так данные участников остаются валидными для обработчика (3 поля, телефон из цифр),
+    а команды и кнопки меню - как есть, чтобы при воспроизведении сработали те же обработчики."""
+    if text in MENU_BUTTON_TEXTS or text.startswith("/"):
+        return text
+    return "".join(("x" if ch.isascii() else "х") if ch.isalpha() else "0" if ch.isdigit() else ch for ch in text)
+
+def capture_anonymize(value):
+    """Обезличивает апдейт (dict из model_dump): id, имена, тексты, file_id"""
+    if isinstance(value, list):
+        return [capture_anonymize(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    is_peer = "is_bot" in value or "type" in value and "id" in value
+    result = {}
+    for key, item in value.items():
+        if key in CAPTURE_DROPPED_FIELDS:
+            continue
+        if key == "id" and is_peer and isinstance(item, int) or key == "user_id" and isinstance(item, int):
+            item = capture_pseudonym(item)
+        elif key in ("first_name", "title"):
+            item = "User"
+        elif key == "username":
+            item = "u" + hashlib.blake2b(f"{UPDATE_CAPTURE_SALT}:{item}".encode(), digest_size=5).hexdigest()
+        elif key in ("text", "caption", "query") and isinstance(item, str):
+            item = capture_scrub_text(item)
+        elif key in ("file_id", "file_unique_id"):
+            item = "f" + hashlib.blake2b(f"{UPDATE_CAPTURE_SALT}:{item}".encode(), digest_size=8).hexdigest()
+        elif key == "file_name":
+            item = "file" + os.path.splitext(item)[1].lower()
+        else:
+            item = capture_anonymize(item)
+        result[key] = item
+    return result
 
-# СОЗДАЕМ ЭКЗЕМПЛЯР БАЗЫ ДАННЫХ
-db = Database()
+async def capture_update(handler, event: types.Update, data):
+    """Outer-middleware: пишет каждый апдейт одной строкой JSON (время прихода + обезличенный апдейт)"""
+    try:
+        record = {"t": round(time.time(), 3),
+                  "u": capture_anonymize(event.model_dump(mode="json", by_alias=True, exclude_none=True))}
+        log_pipeline.emit(UPDATE_CAPTURE_PATH, json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+    except Exception as e:
+        print(f"⚠️ Не удалось записать апдейт {event.update_id}: {e}")
+    return await handler(event, data)
+
+if UPDATE_CAPTURE_PATH:
+    dp.update.outer_middleware(capture_update)
 
 # Функция проверки прав админа
 def is_admin(user_id):
@@ -627,7 +2963,7 @@ async def cmd_check_storage(message: types.Message):
             return
         
         # Проверяем bucket receipts
-        buckets = supabase_client.storage.list_buckets()
+        buckets = await adb.run(supabase_client.storage.list_buckets)
         bucket_names = [bucket.name for bucket in buckets]
         
         storage_info = "<b>🔍 ИНФОРМАЦИЯ О SUPABASE STORAGE</b>\n\n"
@@ -636,7 +2972,7 @@ async def cmd_check_storage(message: types.Message):
             storage_info += "✅ Bucket 'receipts' существует\n"
             
             # Получаем список файлов
-            files = supabase_client.storage.from_("receipts").list()
+            files = await adb.run(supabase_client.storage.from_("receipts").list)
             storage_info += f"📁 Файлов в хранилище: {len(files)}\n\n"
             
             # Показываем последние 5 файлов
@@ -699,7 +3035,15 @@ async def button_start(message: types.Message, state: FSMContext):
     # Автоматически сохраняем пользователя для рассылки
     save_user(message.from_user.id)
     
-    welcome_text = """
+    events = list(catalog_snapshot.events.values())
+    if events:
+        events_text = "🎯 <b>Ближайшее событие:</b>" if len(events) == 1 else "🎯 <b>Ближайшие события:</b>"
+        for event in events:
+            events_text += f"\n<b>{event.title}</b> {event.emoji}\n{event.short_line}"
+    else:
+        events_text = "🎯 <b>Скоро анонсируем новые мероприятия!</b>"
+    
+    welcome_text = f"""
 <b>🎫 ДОБРО ПОЖАЛОВАТЬ В ОФИЦИАЛЬНЫЙ БОТ GEDAN!</b>
 
 Я - твой помощник в мире незабываемых мероприятий! 🎭
@@ -710,9 +3054,7 @@ async def button_start(message: types.Message, state: FSMContext):
 • Обеспечивать быструю и безопасную оплату
 • Предоставлять всю информацию о мероприятиях
 
-🎯 <b>Ближайшее событие:</b>
-<b>NEW YEAR GEDAN PARTY</b> 🎄✨
-27.12.2025 | 20:00 | Просторный дом с русской баней
+{events_text}
 
 Готовы окунуться в атмосферу новогодней магии? Выбирай раздел ниже! 👇
     """
@@ -730,60 +3072,191 @@ async def button_start(message: types.Message, state: FSMContext):
     
     await message.answer(welcome_text, reply_markup=markup, parse_mode="HTML")
 
-# ИСПРАВЛЕННАЯ ИНФОРМАЦИЯ О МЕРОПРИЯТИИ - ФОТО И ОПИСАНИЕ В ОДНОМ СООБЩЕНИИ
-@dp.message(F.text == "📅 Информация о мероприятии")
-async def button_event_info(message: types.Message):
-    save_user(message.from_user.id)  # Сохраняем для рассылки
-    log_event(message.from_user.id, message.from_user.username, "📅 ЗАПРОСИЛ(-а) ИНФО О МЕРОПРИЯТИИ")
-    
-    event_text = """
-<b>NEW YEAR GEDAN PARTY 🎄✨</b>
+# КЭШ FILE_ID КАРТИНОК
+# Ответы BadRequest, означающие, что сохраненный file_id больше не действует
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference expired", "file_reference_expired")
 
-🗓 <b>Когда:</b> 27 декабря
-🌙 <b>Время:</b> 20:00  
-📍 <b>Место:</b> Уютный дом с русской баней
-📌 <b>Адрес:</b> 55.923317, 38.423271
+class MediaCache:
+    """Картинка загружается в Telegram один раз, дальше отправляется по file_id
+    
+    file_id хранится в SQLite по sha256 содержимого файла: если файл заменить,
+    хэш изменится и картинка загрузится заново. Файл проверяется не чаще
+    раза в MEDIA_CHECK_INTERVAL секунд (по времени изменения и размеру)."""
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self.file_ids = {}
+        self.files = {}
+        self.uploads = {}
+        self._connection = None
+    
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = open_local_db(self.path)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    file_hash TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+        return self._connection
+    
+    def load(self):
+        for file_hash, file_id in self.connection.execute("SELECT file_hash, file_id FROM media_cache"):
+            self.file_ids[file_hash] = file_id
+    
+    def file_hash(self, file_path):
+        """sha256 файла (None, если файла нет); пересчитывается только при изменении файла"""
+        now = time.monotonic()
+        cached = self.files.get(file_path)
+        if cached and now - cached['checked_at'] < MEDIA_CHECK_INTERVAL:
+            return cached['hash']
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            self.files[file_path] = {'checked_at': now, 'stat': None, 'hash': None}
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if cached and cached['stat'] == signature:
+            cached['checked_at'] = now
+            return cached['hash']
+        with open(file_path, "rb") as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        self.files[file_path] = {'checked_at': now, 'stat': signature, 'hash': file_hash}
+        return file_hash
+    
+    def remember(self, file_hash, file_id):
+        self.file_ids[file_hash] = file_id
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO media_cache (file_hash, file_id, updated_at) VALUES (?, ?, ?)",
+                (file_hash, file_id, datetime.datetime.now().isoformat(timespec="seconds"))
+            )
+    
+    def forget(self, file_hash):
+        self.file_ids.pop(file_hash, None)
+        with self.connection:
+            self.connection.execute("DELETE FROM media_cache WHERE file_hash = ?", (file_hash,))
+    
+    async def send_photo(self, chat_id, file_path, **kwargs):
+        """Отправляет картинку; возвращает None, если файла нет"""
+        file_hash = self.file_hash(file_path)
+        if file_hash is None:
+            return None
+        
+        # Картинку уже загружает другой обработчик - дожидаемся его file_id
+        if file_hash not in self.file_ids and file_hash in self.uploads:
+            await asyncio.shield(self.uploads[file_hash])
+        
+        file_id = self.file_ids.get(file_hash)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                # Остальные BadRequest (подпись, разметка, чат) - ошибка запроса, а не file_id
+                if not any(reason in e.message.lower() for reason in STALE_FILE_ID_ERRORS):
+                    raise
+                print(f"⚠️ file_id картинки {file_path} больше не действует: {e}")
+                self.forget(file_hash)
+        
+        upload = asyncio.get_running_loop().create_future()
+        self.uploads[file_hash] = upload
+        try:
+            sent = await bot.send_photo(chat_id, FSInputFile(file_path), **kwargs)
+            self.remember(file_hash, sent.photo[-1].file_id)
+            print(f"🖼️ Картинка {file_path} загружена в Telegram, дальше отправляем по file_id")
+            return sent
+        finally:
+            upload.set_result(None)
+            self.uploads.pop(file_hash, None)
+    
+    async def warm_up(self, file_path, chat_id):
+        """Загружает картинку заранее, чтобы первый пользователь не ждал загрузки"""
+        file_hash = self.file_hash(file_path)
+        if file_hash is None or file_hash in self.file_ids:
+            return
+        sent = await self.send_photo(chat_id, file_path, disable_notification=True)
+        if sent:
+            await bot.delete_message(chat_id, sent.message_id)
 
-✨ <b>Что ждёт внутри:</b>
-• 🎁 Игры и подарки: Новогодние розыгрыши и сюрпризы для всех гостей
-• 🍹 Коктейльная карта: От классики до авторских рецептов
-• 🎅 Главный звук: Мощный DJ-сет, где хиты этого года встретятся с новогодней классикой
-• 🍪 Уютные зоны: Приватные комнаты для тёплых бесед и особых моментов
-• 🏠 Русская баня, бильярд и другие приятные мелочи
+media_cache = MediaCache()
 
-🎯 <b>Бонусы:</b>
-• 🖼️ Лакей: встречает вас на станции Захарово с 17:30 (Горьковское направление)  и заказывает такси (до нашего дома и обратно до станции до 5 утра!)
-• 💤 Часы сна: с 5 до 11 утра - соблюдаем тишину
-• 🔄 Возможность передать комнату другому участнику
+async def state_event(state: FSMContext):
+    """Мероприятие, выбранное пользователем (None - нужно выбрать или продаж нет)"""
+    data = await state.get_data()
+    return catalog_snapshot.event(data.get('event_id'))
 
-⚡ <i>Дамы и господа! Стартуем в Новый год вместе с Gedan! Ждём абсолютно каждого на нашей праздничной вечеринке!</i>
+async def send_events_choice(message: types.Message):
+    """Предлагает выбрать мероприятие, если их несколько"""
+    snapshot = catalog_snapshot
+    if not snapshot.events:
+        await message.answer(NO_EVENTS_TEXT)
+        return
+    await message.answer("📅 <b>ВЫБЕРИ МЕРОПРИЯТИЕ</b>", reply_markup=snapshot.events_markup, parse_mode="HTML")
 
-Готовы стать частью самого эпицентра праздника? Выбирай тариф ниже!
-    """
+async def send_event_info(message: types.Message, event):
+    """Фото и описание мероприятия в одном сообщении"""
+    if not event.image_path:
+        await message.answer(event.info_text, reply_markup=event.info_markup, parse_mode="HTML")
+        return
     
+    # Пытаемся отправить фото мероприятия С ОПИСАНИЕМ В ОДНОМ СООБЩЕНИИ (по кэшированному file_id)
+    try:
+        sent = await media_cache.send_photo(
+            message.chat.id,
+            event.image_path,
+            caption=event.info_text,
+            reply_markup=event.info_markup,
+            parse_mode="HTML"
+        )
+        if sent is None:
+            print(f"⚠️ Файл {event.image_path} не найден, отправляем только текст")
+            await message.answer(event.info_text, reply_markup=event.info_markup, parse_mode="HTML")
+    except Exception as e:
+        print(f"❌ Ошибка отправки фото: {e}")
+        # Если фото не отправилось, отправляем только текст
+        await message.answer(event.info_text, reply_markup=event.info_markup, parse_mode="HTML")
+
+async def send_rules(message: types.Message, state: FSMContext, event):
+    """Правила площадки перед выбором тарифа"""
     keyboard = [
-        [types.InlineKeyboardButton(text="🎫 ВЫБРАТЬ ТАРИФ", callback_data="show_tariffs")],
+        [types.InlineKeyboardButton(text="✅ Я ознакомлен(-а) и согласен(-а)", callback_data="accept_rules")],
         [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_main")]
     ]
     markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
     
-    # Пытаемся отправить фото мероприятия С ОПИСАНИЕМ В ОДНОМ СООБЩЕНИИ
-    try:
-        if os.path.exists(EVENT_IMAGE_PATH):
-            photo = FSInputFile(EVENT_IMAGE_PATH)
-            await message.answer_photo(
-                photo,
-                caption=event_text,
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-        else:
-            print(f"⚠️ Файл {EVENT_IMAGE_PATH} не найден, отправляем только текст")
-            await message.answer(event_text, reply_markup=markup, parse_mode="HTML")
-    except Exception as e:
-        print(f"❌ Ошибка отправки фото: {e}")
-        # Если фото не отправилось, отправляем только текст
-        await message.answer(event_text, reply_markup=markup, parse_mode="HTML")
+    await message.answer(event.rules_text, reply_markup=markup, parse_mode="HTML")
+    await state.update_data(event_id=event.id)
+    await state.set_state(OrderStates.waiting_for_rules_confirmation)
+
+# ИСПРАВЛЕННАЯ ИНФОРМАЦИЯ О МЕРОПРИЯТИИ - ФОТО И ОПИСАНИЕ В ОДНОМ СООБЩЕНИИ
+@dp.message(F.text == "📅 Информация о мероприятии")
+async def button_event_info(message: types.Message, state: FSMContext):
+    save_user(message.from_user.id)  # Сохраняем для рассылки
+    log_event(message.from_user.id, message.from_user.username, "📅 ЗАПРОСИЛ(-а) ИНФО О МЕРОПРИЯТИИ")
+    
+    event = catalog_snapshot.event()
+    if event is None:
+        await send_events_choice(message)
+        return
+    
+    await state.update_data(event_id=event.id)
+    await send_event_info(message, event)
+
+# ВЫБОР МЕРОПРИЯТИЯ (когда в продаже несколько)
+@dp.callback_query(F.data.startswith("event_"))
+async def process_event_selection(callback: types.CallbackQuery, state: FSMContext):
+    event_id = callback.data.replace("event_", "", 1)
+    event = catalog_snapshot.events.get(event_id)
+    if event is None:
+        await callback.answer("❌ Мероприятие больше недоступно", show_alert=True)
+        return
+    
+    log_event(callback.from_user.id, callback.from_user.username, "📅 ВЫБРАЛ(-а) МЕРОПРИЯТИЕ", event.title, event_id=event.id)
+    await state.update_data(event_id=event.id)
+    await send_event_info(callback.message, event)
+    await callback.answer()
 
 # ПОКАЗ ТАРИФОВ - ТЕПЕРЬ С ПРАВИЛАМИ
 @dp.message(F.text == "🎫 Посмотреть тарифы")
@@ -791,34 +3264,14 @@ async def cmd_tariffs(message: types.Message, state: FSMContext):
     save_user(message.from_user.id)  # Сохраняем для рассылки
     log_event(message.from_user.id, message.from_user.username, "🎫 ЗАПРОСИЛ(-а) ТАРИФЫ")
     
-    # Показываем правила вместо прямого перехода к тарифам
-    rules_text = """
-<b>ВАЖНО!</b>
-
-Правила площадки:
-- Посещение территории дома возможно только при наличии оригиналов соответствующих документов.
-- Каждый участник несет личную ответственность за свои действия, состояние и сохранность своих вещей.
-- Пронос алкогольной продукции и еды на территорию дома запрещен.
-- Наркотические вещества строго запрещены. За нарушение — штраф 10 000 ₽ и удаление с мероприятия без возврата денег.
-- Курение разрешено только в специально отведённой зоне на улице.
-- Запрещено проносить оружие, колюще-режущие предметы и опасные вещества.
-- Участники с заболеваниями обязаны иметь при себе необходимые лекарства и следить за своим здоровьем самостоятельно.
-- Нарушение законов РФ влечет ответственность по законодательству.
-- Требования организаторов обязаны для исполнения.
-- Без оплаты билета вход невозможен.
-- При нарушении правил организаторы вправе удалить участника без возврата денежных средств.
-
-Нажмите кнопку ниже, чтобы продолжить
-    """
-    
-    keyboard = [
-        [types.InlineKeyboardButton(text="✅ Я ознакомлен(-а) и согласен(-а)", callback_data="accept_rules")],
-        [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_main")]
-    ]
-    markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+    # Несколько мероприятий - сначала выбор мероприятия, тарифы будут в его карточке
+    event = catalog_snapshot.event()
+    if event is None:
+        await send_events_choice(message)
+        return
     
-    await message.answer(rules_text, reply_markup=markup, parse_mode="HTML")
-    await state.set_state(OrderStates.waiting_for_rules_confirmation)
+    # Показываем правила вместо прямого перехода к тарифам
+    await send_rules(message, state, event)
 
 # ОБРАБОТКА ПРИНЯТИЯ ПРАВИЛ
 @dp.callback_query(OrderStates.waiting_for_rules_confirmation, F.data == "accept_rules")
@@ -834,64 +3287,35 @@ async def accept_rules(callback: types.CallbackQuery, state: FSMContext):
 
 async def show_tariffs_menu(message: types.Message, state: FSMContext):
     """Показывает меню тарифов в 4 кнопках"""
-    tariffs_intro = """
-<b>🎫 ВЫБЕРИ СВОЙ ПУТЬ НА NEW YEAR GEDAN PARTY</b>
-
-Каждый тариф — это не просто билет, это твой уникальный опыт и комьюнити!
-    """
+    event = await state_event(state)
+    if event is None:
+        await send_events_choice(message)
+        return
     
-    # Создаем клавиатуру с 4 кнопками
-    keyboard = [
-        [
-            types.InlineKeyboardButton(text="🎅 ДЛЯ ПАРНЕЙ", callback_data="tariff_type_male"),
-            types.InlineKeyboardButton(text="👸 ДЛЯ ДЕВУШЕК", callback_data="tariff_type_female")
-        ],
-        [
-            types.InlineKeyboardButton(text="❤️ ДЛЯ ПАР", callback_data="tariff_type_couple"),
-            types.InlineKeyboardButton(text="⭐ VIP ТАРИФЫ", callback_data="tariff_type_vip")
-        ]
-    ]
-    markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+    catalog = inventory.catalog(event)
+    if not catalog.tariffs:
+        await message.answer(f"😔 Все билеты на {event.title} распроданы")
+        return
     
     # Отправляем новое сообщение с тарифами
-    await message.answer(tariffs_intro, reply_markup=markup, parse_mode="HTML")
+    await message.answer(catalog.intro_text, reply_markup=catalog.menu_markup, parse_mode="HTML")
     await state.set_state(OrderStates.waiting_for_tariff)
 
 # ОБРАБОТКА ВЫБОРА ТАРИФА НА МЕРОПРИЯТИЕ С ПРАВИЛАМИ
-@dp.callback_query(F.data == "show_tariffs")
+@dp.callback_query(F.data.startswith("show_tariffs"))
 async def show_tariffs(callback: types.CallbackQuery, state: FSMContext):
     log_event(callback.from_user.id, callback.from_user.username, "🎫 НАЖАЛ 'ВЫБРАТЬ ТАРИФ'")
     
-    # Вместо прямого показа тарифов, показываем правила в НОВОМ сообщении
-    rules_text = """
-<b>ВАЖНО!</b>
-
-Правила площадки:
-- Посещение территории дома возможно только при наличии оригиналов соответствующих документов.
-- Каждый участник несет личную ответственность за свои действия, состояние и сохранность своих вещей.
-- Пронос алкогольной продукции и еды на территорию дома запрещен.
-- Наркотические вещества строго запрещены. За нарушение — штраф 10 000 ₽ и удаление с мероприятия без возврата денег.
-- Курение разрешено только в специально отведённой зоне на улице.
-- Запрещено проносить оружие, колюще-режущие предметы и опасные вещества.
-- Участники с заболеваниями обязаны иметь при себе необходимые лекарства и следить за своим здоровьем самостоятельно.
-- Нарушение законов РФ влечет ответственность по законодательству.
-- Требования организаторов обязаны для исполнения.
-- Без оплаты билета вход невозможен.
-- При нарушении правил организаторы вправе удалить участника без возврата денежных средств.
-
-Нажмите кнопку ниже, чтобы продолжить
-    """
-    
-    keyboard = [
-        [types.InlineKeyboardButton(text="✅ Я ознакомлен(-а) и согласен(-а)", callback_data="accept_rules")],
-        [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_main")]
-    ]
-    markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    # Отправляем новое сообщение с правилами
-    await callback.message.answer(rules_text, reply_markup=markup, parse_mode="HTML")
+    # В карточке мероприятия id зашит в кнопку; в старых сообщениях его нет - берем из состояния
+    event_id = callback.data.replace("show_tariffs", "", 1).lstrip("_")
+    event = catalog_snapshot.events.get(event_id) if event_id else await state_event(state)
+    if event is None:
+        await send_events_choice(callback.message)
+        await callback.answer()
+        return
     
-    await state.set_state(OrderStates.waiting_for_rules_confirmation)
+    # Вместо прямого показа тарифов, показываем правила в НОВОМ сообщении
+    await send_rules(callback.message, state, event)
     await callback.answer()
 
 # ОБНОВЛЕННЫЙ ОБРАБОТЧИК КНОПКИ "НАЗАД" ИЗ ПРАВИЛ
@@ -911,43 +3335,15 @@ async def back_to_main_from_rules(callback: types.CallbackQuery, state: FSMConte
 async def process_tariff_type(callback: types.CallbackQuery, state: FSMContext):
     tariff_type = callback.data.replace("tariff_type_", "")
     
-    type_names = {
-        "male": "🎅 <b>ТАРИФЫ ДЛЯ ПАРНЕЙ</b>",
-        "female": "👸 <b>ТАРИФЫ ДЛЯ ДЕВУШЕК</b>",
-        "couple": "❤️ <b>ТАРИФЫ ДЛЯ ПАР</b>",
-        "vip": "⭐ <b>VIP ТАРИФЫ</b>"
-    }
-    
-    if tariff_type == "male":
-        keyboard = [
-            [types.InlineKeyboardButton(text="🎅 Сам себе Санта - 3000₽", callback_data="tariff_Сам себе Санта")],
-            [types.InlineKeyboardButton(text="👥 Братья по шампанскому - 5500₽", callback_data="tariff_Братья по шампанскому")],
-            [types.InlineKeyboardButton(text="👥👥 Компания друзей - 10500₽", callback_data="tariff_Компания друзей")],
-            [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
-        ]
-    elif tariff_type == "female":
-        keyboard = [
-            [types.InlineKeyboardButton(text="👸 Снежная королева - 2500₽", callback_data="tariff_Снежная королева")],
-            [types.InlineKeyboardButton(text="👭 Сестры по глинтвейну - 4500₽", callback_data="tariff_Сестры по глинтвейну")],
-            [types.InlineKeyboardButton(text="👭👭 Квартет снегурочек - 8500₽", callback_data="tariff_Квартет снегурочек")],
-            [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
-        ]
-    elif tariff_type == "couple":
-        keyboard = [
-            [types.InlineKeyboardButton(text="❤️ Мистер и миссис Клаус - 5100₽", callback_data="tariff_Мистер и миссис Клаус")],
-            [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
-        ]
-    elif tariff_type == "vip":
-        keyboard = [
-            [types.InlineKeyboardButton(text="❤️ DUO VIP - 6500₽", callback_data="tariff_DUO VIP")],
-            [types.InlineKeyboardButton(text="🎄 SQUAD SUPER VIP - 12000₽", callback_data="tariff_SQUAD SUPER VIP")],
-            [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
-        ]
-    
-    markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+    event = await state_event(state)
+    catalog = inventory.catalog(event) if event else None
+    markup = catalog.group_markups.get(tariff_type) if catalog else None
+    if markup is None:
+        await callback.answer("😔 Тарифы этой категории распроданы", show_alert=True)
+        return
     
     await callback.message.edit_text(
-        type_names.get(tariff_type, "🎫 <b>ВЫБЕРИ ТАРИФ</b>"),
+        catalog.group_titles.get(tariff_type, "🎫 <b>ВЫБЕРИ ТАРИФ</b>"),
         reply_markup=markup,
         parse_mode="HTML"
     )
@@ -958,37 +3354,12 @@ async def process_tariff_type(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data == "show_all_tariffs")
 async def show_all_tariffs(callback: types.CallbackQuery, state: FSMContext):
     """Показывает все тарифы в одном сообщении"""
-    all_tariffs_text = """
-<b>🎫 ВСЕ ТАРИФЫ НА NEW YEAR GEDAN PARTY</b>
-
-🎅 <b>ДЛЯ ПАРНЕЙ:</b>
-• 🎅 Сам себе Санта - 3000₽
-• 👥 Братья по шампанскому - 5500₽ (2750₽/чел)
-• 👥👥 Компания друзей - 10500₽ (2625₽/чел)
-
-👸 <b>ДЛЯ ДЕВУШЕК:</b>
-• 👸 Снежная королева - 2500₽
-• 👭 Сестры по глинтвейну - 4500₽ (2250₽/чел)
-• 👭👭 Квартет снегурочек - 8500₽ (2125₽/чел)
-
-❤️ <b>ДЛЯ ПАР:</b>
-• ❤️ Мистер и миссис Клаус - 5100₽ (2550₽/чел)
-
-⭐ <b>VIP ТАРИФЫ:</b>
-• ❤️ DUO VIP - 6500₽ (именная комната + подарки)
-• 🎄 SQUAD SUPER VIP - 12000₽ (эксклюзивная комната + подарки)
-"""
-
-    keyboard = [
-        [types.InlineKeyboardButton(text="🎅 ВЫБРАТЬ ДЛЯ ПАРНЕЙ", callback_data="tariff_type_male")],
-        [types.InlineKeyboardButton(text="👸 ВЫБРАТЬ ДЛЯ ДЕВУШЕК", callback_data="tariff_type_female")],
-        [types.InlineKeyboardButton(text="❤️ ВЫБРАТЬ ДЛЯ ПАР", callback_data="tariff_type_couple")],
-        [types.InlineKeyboardButton(text="⭐ ВЫБРАТЬ VIP", callback_data="tariff_type_vip")],
-        [types.InlineKeyboardButton(text="⬅️ НАЗАД", callback_data="back_to_tariff_types")]
-    ]
-    markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    await callback.message.edit_text(all_tariffs_text, reply_markup=markup, parse_mode="HTML")
+    event = await state_event(state)
+    if event is None:
+        await callback.answer("❌ Мероприятие не выбрано", show_alert=True)
+        return
+    catalog = inventory.catalog(event)
+    await callback.message.edit_text(catalog.all_tariffs_text, reply_markup=catalog.all_tariffs_markup, parse_mode="HTML")
     await callback.answer()
 
 # Назад к выбору типа тарифа
@@ -1001,49 +3372,22 @@ async def back_to_tariff_types(callback: types.CallbackQuery, state: FSMContext)
 @dp.callback_query(F.data.startswith("tariff_"))
 async def process_tariff_selection(callback: types.CallbackQuery, state: FSMContext):
     try:
-        tariff_name = callback.data.replace("tariff_", "")
-        log_tariff_selection(callback.from_user.id, callback.from_user.username, tariff_name, TARIFFS[tariff_name])
+        tariff_key = callback.data.replace("tariff_", "", 1)
         
-        if tariff_name not in TARIFFS:
-            await callback.answer(f"❌ Тариф '{tariff_name}' не найден", show_alert=True)
+        view = catalog_snapshot.tariffs.get(tariff_key)
+        if view is None:
+            await callback.answer("❌ Тариф больше недоступен, выбери другой", show_alert=True)
+            return
+        if not inventory.has_room(view):
+            await callback.answer("😔 Этот тариф распродан, выбери другой", show_alert=True)
             return
         
-        tariff = TARIFFS[tariff_name]
-        await state.update_data(selected_tariff=tariff_name)
-        
-        description = f"{tariff['emoji']} <b>«{tariff_name}»</b>\n"
-
-        if tariff_name == "DUO VIP":
-            description += f"💵 <b>6500₽ за двоих</b>\n"
-            description += f"💳 <b>Всего: 6500₽</b>\n"
-        elif tariff_name == "SQUAD SUPER VIP":
-            description += f"💵 <b>12000₽ за четверых</b>\n"
-            description += f"💳 <b>Всего: 12000₽</b>\n"
-        elif 'total' in tariff:
-            description += f"💵 <b>{tariff['price']}₽ с человека</b>\n"
-            description += f"💳 <b>Всего: {tariff['total']}₽</b>\n"
-        else:
-            description += f"💵 <b>Стоимость: {tariff['price']}₽</b>\n"
-        
-        description += f"\n📖 {tariff['description']}\n"
-        description += f"\n✅ <b>Включено:</b>\n"
-        description += f"• {tariff['includes']}\n"
-        description += f"• Полный доступ на New Year Gedan Party\n"
-        description += f"• Участие в новогодних розыгрышах\n"
-        description += f"• Доступ к бане, бильярду и уютным зонам\n"
-        description += f"• Услуги лакея (такси туда и обратно до 5 утра)\n"
-
-        if tariff['min_people'] == 1:
-            message_text = f"{description}\n\n📝 <b>Теперь введите свои данные в формате:</b>\n<code>ФИО, телеграмм, номер телефона</code>\n\n<b>Пример:</b>\n<code>Иванов Иван Иванович, @ivanov, 79991234567</code>"
-        else:
-            message_text = f"{description}\n\n📝 <b>Теперь введите данные всех {tariff['min_people']} участников в формате:</b>\nКаждый участник с новой строки:\n<code>ФИО, телеграмм, номер телефона</code>\n\n<b>Пример для {tariff['min_people']} человек:</b>\n<code>Иванов Иван Иванович, @ivanov, 79991234567</code>\n<code>Петрова Анна Сергеевна, @petrova, 79997654321</code>"
-        
-        keyboard = [[types.InlineKeyboardButton(text="⬅️ ВЫБРАТЬ ДРУГОЙ ТАРИФ", callback_data="back_to_tariffs")]]
-        markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+        log_tariff_selection(callback.from_user.id, callback.from_user.username, view)
+        await state.update_data(selected_tariff=view.key, event_id=view.event_id)
         
-        await callback.message.edit_text(message_text, reply_markup=markup, parse_mode="HTML")
+        await callback.message.edit_text(view.selection_text, reply_markup=view.selection_markup, parse_mode="HTML")
         await state.set_state(OrderStates.waiting_for_participants)
-        await callback.answer(f"✅ Выбран: {tariff_name}")
+        await callback.answer(f"✅ Выбран: {view.name}")
         
     except Exception as e:
         error_msg = f"Ошибка при выборе тарифа: {e}"
@@ -1056,22 +3400,29 @@ async def process_tariff_selection(callback: types.CallbackQuery, state: FSMCont
 async def process_participants_input(message: types.Message, state: FSMContext):
     try:
         user_data = await state.get_data()
-        tariff_name = user_data['selected_tariff']
-        tariff = TARIFFS[tariff_name]
+        snapshot = catalog_snapshot
+        tariff = snapshot.tariffs.get(user_data['selected_tariff'])
+        if tariff is None:
+            # Тариф убрали из каталога, пока пользователь вводил данные
+            await message.answer("❌ Этот тариф больше недоступен, выбери другой")
+            await show_tariffs_menu(message, state)
+            return
+        tariff_name = tariff.name
+        event = snapshot.events[tariff.event_id]
         
         log_event(message.from_user.id, message.from_user.username, "📝 ВВЕЛ(-а) ДАННЫЕ УЧАСТНИКОВ", f"Тариф: {tariff_name}")
         
         # Парсим введенные данные
         lines = [line.strip() for line in message.text.strip().split('\n') if line.strip()]
         
-        if len(lines) != tariff['min_people']:
-            error_msg = f"Неправильное количество участников: {len(lines)} вместо {tariff['min_people']}"
+        if len(lines) != tariff.min_people:
+            error_msg = f"Неправильное количество участников: {len(lines)} вместо {tariff.min_people}"
             log_event(message.from_user.id, message.from_user.username, "❌ ОШИБКА ВВОДА", error_msg)
             await message.answer(
-                f"❌ Для тарифа '{tariff_name}' нужно указать ровно {tariff['min_people']} участника.\n"
+                f"❌ Для тарифа '{tariff_name}' нужно указать ровно {tariff.min_people} участника.\n"
                 f"Ты указал(-а) {len(lines)}. Попробуй еще раз (каждый участник с новой строки):\n\n"
                 f"<b>Формат для каждого участника:</b>\nФИО, телеграмм, номер телефона\n\n"
-                f"<b>Пример для {tariff['min_people']} человек:</b>\n"
+                f"<b>Пример для {tariff.min_people} человек:</b>\n"
                 f"Иванов Иван Иванович, @ivanov, 79991234567\n"
                 f"Петрова Анна Сергеевна, @petrova, 79997654321"
             )
@@ -1115,11 +3466,12 @@ async def process_participants_input(message: types.Message, state: FSMContext):
             return
         
         # СОХРАНЯЕМ ВСЕ ДАННЫЕ В СОСТОЯНИЕ
-        total_price = tariff.get('total', tariff['price'])
+        total_price = tariff.total
         await state.update_data(
             participants=participants,
             tariff_name=tariff_name,  # ДОБАВЛЯЕМ ЭТО!
-            total_price=total_price   # ДОБАВЛЯЕМ ЭТО!
+            total_price=total_price,  # ДОБАВЛЯЕМ ЭТО!
+            event_id=event.id
         )
         
         keyboard = [
@@ -1135,24 +3487,21 @@ async def process_participants_input(message: types.Message, state: FSMContext):
             participants_text += f"   • Telegram: {participant['telegram']}\n"
             participants_text += f"   • Телефон: {participant['phone']}\n\n"
         
+        bonuses_text = f"🎄 <b>Бонусы мероприятия:</b>\n{event.bonuses}\n\n" if event.bonuses else ""
         summary_text = f"""
 <b>✅ ВАШ ЗАКАЗ ПОДТВЕРЖДЁН! 🎫</b>
 
 {participants_text}
-📋 <b>Тариф:</b> {tariff['emoji']} {tariff_name}
+📅 <b>Мероприятие:</b> {event.title}
+📋 <b>Тариф:</b> {tariff.emoji} {tariff_name}
 💎 <b>Сумма:</b> {total_price}₽
 
-🎄 <b>Бонусы мероприятия:</b>
-• Лакей: такси туда и обратно до 5 утра
-• Уютные комнаты и русская баня
-• Новогодние розыгрыши и подарки
-• Часы сна: с 5 до 11 утра - соблюдаем тишину
-
-Нажмите ниже для завершения бронирования ⬇️
+{bonuses_text}Нажмите ниже для завершения бронирования ⬇️
         """
         
         await message.answer(summary_text, reply_markup=markup, parse_mode="HTML")
         await state.set_state(OrderStates.waiting_for_payment)
+        schedule_checkout_expiry(message.from_user.id)
         
     except Exception as e:
         error_msg = f"Ошибка при вводе данных участников: {e}"
@@ -1179,10 +3528,21 @@ async def process_payment(callback: types.CallbackQuery, state: FSMContext):
             await state.clear()
             return
         
-        tariff_name = user_data['selected_tariff']
+        tariff_name = user_data.get('tariff_name', user_data['selected_tariff'])
         participants = user_data['participants']
         total_price = user_data['total_price']
-        tariff = TARIFFS[tariff_name]
+        
+        # БРОНИРУЕМ МЕСТО НА ВРЕМЯ ОПЛАТЫ (повторное нажатие использует ту же бронь)
+        hold_id = user_data.get('hold_id')
+        if not inventory.is_held(hold_id):
+            tariff = catalog_snapshot.tariffs.get(user_data['selected_tariff'])
+            hold_id = await inventory.reserve(callback.from_user.id, tariff) if tariff else None
+            if hold_id is None:
+                log_event(callback.from_user.id, callback.from_user.username, "😔 МЕСТ НЕТ", f"Тариф: {tariff_name}", tariff=tariff_name)
+                await callback.answer("😔 Места на этот тариф закончились, выбери другой", show_alert=True)
+                await show_tariffs_menu(callback.message, state)
+                return
+            await state.update_data(hold_id=hold_id)
         
         log_payment_start(callback.from_user.id, callback.from_user.username, tariff_name, participants, total_price)
         
@@ -1210,6 +3570,7 @@ async def process_payment(callback: types.CallbackQuery, state: FSMContext):
 
 ⚠️ <b>Важно:</b>
 
+• Место забронировано за вами на {format_duration(HOLD_TTL)} - пришлите чек за это время
 • Бронирование подтверждается только после проверки чека
 • Чек должен содержать сумму и дату перевода
 • Проверка занимает до 24 часов
@@ -1226,6 +3587,7 @@ async def process_payment(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.edit_text(payment_text, reply_markup=markup, parse_mode="HTML")
         
         await state.set_state(OrderStates.waiting_for_receipt)
+        schedule_checkout_expiry(callback.from_user.id)
         await callback.answer()
         
     except Exception as e:
@@ -1235,15 +3597,24 @@ async def process_payment(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Ошибка при создании заказа", show_alert=True)
 
 # НАВИГАЦИЯ
+async def release_hold(state: FSMContext):
+    """Освобождает забронированное место, если пользователь ушел с шага оплаты"""
+    data = await state.get_data()
+    if data.get('hold_id'):
+        await inventory.release(data['hold_id'])
+        await state.update_data(hold_id=None)
+
 @dp.callback_query(F.data == "back_to_tariffs")
 async def back_to_tariffs(callback: types.CallbackQuery, state: FSMContext):
     log_event(callback.from_user.id, callback.from_user.username, "⬅️ ВЕРНУЛСЯ К ВЫБОРУ ТАРИФОВ")
+    await release_hold(state)
     await show_tariffs_menu(callback.message, state)
     await callback.answer()
 
 @dp.callback_query(F.data == "back_to_main")
 async def back_to_main(callback: types.CallbackQuery, state: FSMContext):
     log_event(callback.from_user.id, callback.from_user.username, "⬅️ ВЕРНУЛСЯ В ГЛАВНОЕ МЕНЮ")
+    await release_hold(state)
     await state.clear()
     await show_main_menu(callback.message)
     await callback.answer()
@@ -1277,7 +3648,7 @@ async def process_receipt(message: types.Message, state: FSMContext):
         participants = user_data['participants']
         total_price = user_data['total_price']
         
-        log_event(message.from_user.id, message.from_user.username, "📎 ОТПРАВИЛ ЧЕК", f"Тариф: {tariff_name}")
+        log_event(message.from_user.id, message.from_user.username, "📎 ОТПРАВИЛ ЧЕК", f"Тариф: {tariff_name}", tariff=tariff_name)
         
         # ПРОВЕРКА РАЗМЕРА ФАЙЛА ДЛЯ ДОКУМЕНТОВ
         if message.document:
@@ -1301,86 +3672,66 @@ async def process_receipt(message: types.Message, state: FSMContext):
                 )
                 return
         
-        print(f"💾 Начинаем сохранение заказа в базу после получения чека...")
-        
-        # Сохраняем заказ в Supabase
-        order = db.add_order(
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            tariff=tariff_name,
-            participants=participants,
-            total_price=total_price
-        )
-        
-        if not order:
-            await message.answer("❌ Ошибка при сохранении заказа. Попробуйте еще раз или свяжитесь с поддержкой.")
-            await state.clear()
-            return
-        
-        supabase_order_id = order['id']
-        print(f"✅ Заказ #{supabase_order_id} сохранен в Supabase")
-        
-        # СОХРАНЯЕМ ИНФОРМАЦИЮ О ФАЙЛЕ
-        file_info = None
-        receipt_data = None
-        
+        # Чек сохраняется в заказе как Telegram file_id - без скачивания и загрузки
         if message.document:
-            file_info = {
+            receipt = {
                 'file_id': message.document.file_id,
-                'file_type': 'document',
-                'filename': message.document.file_name or f"receipt_{supabase_order_id}.pdf",
                 'file_unique_id': message.document.file_unique_id,
-                'file_size': message.document.file_size
+                'file_type': 'document'
             }
-            print(f"📎 Сохраняем документ-чек для заказа #{supabase_order_id}: {file_info['filename']} ({file_info['file_size']} bytes)")
-            
-        elif message.photo:
+        else:
             # Для фото берем самое качественное (последнее в массиве)
-            file_info = {
+            receipt = {
                 'file_id': message.photo[-1].file_id,
-                'file_type': 'photo', 
-                'filename': f"receipt_photo_{supabase_order_id}.jpg",
                 'file_unique_id': message.photo[-1].file_unique_id,
-                'file_size': "unknown"
+                'file_type': 'photo'
             }
-            print(f"📎 Сохраняем фото-чек для заказа #{supabase_order_id}")
         
-        # ЗАГРУЖАЕМ ФАЙЛ В SUPABASE STORAGE
-        if file_info:
-            user_info = {
-                'user_id': message.from_user.id,
-                'username': message.from_user.username or 'unknown'
-            }
-            
-            receipt_data = await upload_receipt_to_supabase(
-                bot, 
-                file_info['file_id'], 
-                file_info['file_type'], 
-                supabase_order_id,
-                user_info
-            )
-            
-            if receipt_data:
-                print(f"✅ Чек загружен в Supabase Storage: {receipt_data['file_name']}")
-                log_event(message.from_user.id, message.from_user.username, 
-                         "☁️ ЧЕК ЗАГРУЖЕН В SUPABASE", 
-                         f"Файл: {receipt_data['file_name']}, URL: {receipt_data['public_url']}")
-            else:
-                print(f"❌ Не удалось загрузить чек в Supabase Storage для заказа #{supabase_order_id}")
+        print(f"💾 Начинаем сохранение заказа в базу после получения чека...")
+        
+        # Сначала заказ попадает в локальный журнал: он не потеряется, даже если Supabase недоступен
+        client_ref = uuid.uuid4().hex
+        order_payload = {
+            'user_id': message.from_user.id,
+            'username': message.from_user.username,
+            'tariff': tariff_name,
+            'participants': participants,
+            'total_price': total_price,
+            'event_id': user_data.get('event_id'),
+            'receipt': receipt
+        }
+        # hold_id в журнале: бронь снимается, только когда заказ сохранен в Supabase
+        order_journal.append(client_ref, {**order_payload, 'hold_id': user_data.get('hold_id')})
+        
+        # Сохраняем заказ в Supabase одним запросом
+        order = await adb.add_order(**order_payload, client_ref=client_ref)
         
-        print(f"✅ Заказ #{supabase_order_id} успешно сохранен в базу после отправки чека")
+        if order:
+            order_journal.mark_synced(client_ref, order['id'])
+            print(f"✅ Заказ #{order['id']} сохранен в Supabase")
+            order_line = f"📦 <b>Заказ:</b> #{order['id']}"
+            status_line = "✅ <b>Статус:</b> Заказ сохранен в систему"
+        else:
+            # Supabase недоступен - заказ досылается из журнала, номер придет отдельным сообщением
+            delay = order_journal.reschedule(client_ref, 1)
+            print(f"📒 Заказ {client_ref} записан в журнал, повтор через {delay:.0f}с")
+            log_event(message.from_user.id, message.from_user.username, "📒 ЗАКАЗ В ЖУРНАЛЕ",
+                      f"client_ref: {client_ref}", tariff=tariff_name, client_ref=client_ref)
+            order_line = "📦 <b>Заказ:</b> номер пришлем отдельным сообщением"
+            status_line = "✅ <b>Статус:</b> Заказ принят"
         
+        # Отвечаем сразу: копия чека в Storage загрузится в фоне
         success_text = f"""
 <b>✅ ЧЕК ПОЛУЧЕН И ЗАКАЗ СОХРАНЕН!</b>
 
-📦 <b>Заказ:</b> #{supabase_order_id}
+{order_line}
 🎯 <b>Тариф:</b> {tariff_name}
 💎 <b>Сумма:</b> {total_price}₽
 
-✅ <b>Статус:</b> Заказ сохранен в систему
+{status_line}
 ⏳ <b>Ожидайте:</b> Подтверждение в течение 24 часов
 
-{'☁️ <b>Чек загружен в облачное хранилище</b>' if receipt_data else '📎 Файл чека сохранен'}
+📎 Файл чека сохранен
 
 💬 <b>По вопросам:</b> @m5frls
         """
@@ -1388,12 +3739,249 @@ async def process_receipt(message: types.Message, state: FSMContext):
         await message.answer(success_text, parse_mode="HTML")
         await state.clear()
         
+        scheduler.cancel(("checkout", message.from_user.id))
+        if order:
+            await on_order_saved(order, receipt)
+        
+        # Бронь превращается в заказ
+        if not await inventory.confirm(user_data.get('hold_id'), tariff_name, user_data.get('event_id'), stored=order is not None):
+            print(f"⚠️ Заказ {order['id'] if order else client_ref} превысил лимит мест тарифа '{tariff_name}' (бронь истекла)")
+            log_event(message.from_user.id, message.from_user.username, "⚠️ ПРЕВЫШЕН ЛИМИТ МЕСТ",
+                      f"Заказ {order['id'] if order else client_ref}, тариф: {tariff_name}", tariff=tariff_name, client_ref=client_ref)
+        
     except Exception as e:
         error_msg = f"Ошибка при обработке чека: {e}"
         print(f"🔴 {error_msg}")
         log_event(message.from_user.id, message.from_user.username, "❌ ОШИБКА ОБРАБОТКИ ЧЕКА", str(e))
         await message.answer("❌ Ошибка при обработке чека. Попробуйте еще раз или свяжитесь с поддержкой.")
 
+# ДВИЖОК РАССЫЛКИ
+class TokenBucket:
+    """Ограничитель скорости отправки: rate токенов в секунду, пауза при flood-wait"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def pause(self, seconds):
+        """Останавливает все отправки на seconds (Telegram вернул RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+# Общий лимитер исходящих массовых сообщений
+telegram_rate_limiter = TokenBucket(BROADCAST_RATE)
+
+# Ответы BadRequest, означающие, что получателю больше ничего не доставить
+UNREACHABLE_CHAT_ERRORS = ("chat not found", "user is deactivated")
+
+async def send_with_rate_limit(send, limiter=telegram_rate_limiter, max_retries=BROADCAST_MAX_RETRIES):
+    """Выполняет отправку через лимитер; при RetryAfter ставит лимитер на паузу и повторяет
+    
+    Возвращает "ok", "blocked" (бот заблокирован / чат не найден / аккаунт удален) или "failed".
+    Остальные BadRequest (разметка, длина подписи, file_id) - ошибка сообщения, а не получателя."""
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        try:
+            await send()
+            return "ok"
+        except TelegramRetryAfter as e:
+            print(f"⏳ Flood-wait от Telegram: пауза {e.retry_after}с")
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError as e:
+            print(f"🚫 Сообщение не доставлено: {e}")
+            return "blocked"
+        except TelegramBadRequest as e:
+            if any(reason in e.message.lower() for reason in UNREACHABLE_CHAT_ERRORS):
+                print(f"🚫 Сообщение не доставлено: {e}")
+                return "blocked"
+            print(f"❌ Telegram отклонил сообщение: {e}")
+            return "failed"
+        except Exception as e:
+            print(f"❌ Ошибка отправки: {e}")
+            return "failed"
+    return "failed"
+
+def write_json_atomic(path, data):
+    """Записывает JSON через временный файл, чтобы файл не повредился при падении"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class BroadcastJob:
+    """Рассылка с сохраняемым курсором: после перезапуска продолжается с места остановки
+    
+    cursor - все получатели до этого индекса обработаны; done_ahead - индексы после курсора,
+    уже обработанные параллельными отправками."""
+    def __init__(self, data):
+        self.data = data
+        self.user_ids = data['user_ids']
+        self.done_ahead = set(data.get('done_ahead', []))
+        self.next_index = data.get('cursor', 0)
+        self.persisted_at = 0.0
+        self.reported_at = 0.0
+        # Записи курсора идут по одной: более старый снимок не перезапишет новый
+        self.persist_lock = asyncio.Lock()
+    
+    @classmethod
+    def create(cls, broadcast_data, user_ids, chat_id, message_id, admin_id, admin_username):
+        return cls({
+            'broadcast_data': broadcast_data,
+            'user_ids': sorted(user_ids),
+            'cursor': 0,
+            'done_ahead': [],
+            'success': 0,
+            'failed': 0,
+            'blocked': 0,
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'admin_id': admin_id,
+            'admin_username': admin_username,
+            'started_at': datetime.datetime.now().isoformat()
+        })
+    
+    @classmethod
+    def load(cls, path=BROADCAST_JOB_PATH):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, KeyError) as e:
+            print(f"⚠️ Не удалось прочитать незавершенную рассылку: {e}")
+            return None
+    
+    async def persist(self, path=BROADCAST_JOB_PATH):
+        """Сохраняет курсор; запись с fsync идет в потоке, а не в event loop"""
+        self.persisted_at = time.monotonic()
+        self.data['done_ahead'] = sorted(self.done_ahead)
+        snapshot = dict(self.data)
+        async with self.persist_lock:
+            await asyncio.to_thread(write_json_atomic, path, snapshot)
+    
+    @staticmethod
+    def remove(path=BROADCAST_JOB_PATH):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    def mark_done(self, index, result):
+        key = {"ok": 'success', "blocked": 'blocked'}.get(result, 'failed')
+        self.data[key] += 1
+        self.done_ahead.add(index)
+        while self.data['cursor'] in self.done_ahead:
+            self.done_ahead.discard(self.data['cursor'])
+            self.data['cursor'] += 1
+    
+    def progress_text(self):
+        total = len(self.user_ids)
+        processed = self.data['success'] + self.data['failed'] + self.data['blocked']
+        return (f"🔄 Рассылка: {processed}/{total}\n"
+                f"✅ {self.data['success']} • 🚫 {self.data['blocked']} • ❌ {self.data['failed']}")
+
+async def send_broadcast_message(user_id, broadcast_data):
+    if broadcast_data["type"] == "text":
+        await bot.send_message(user_id, broadcast_data["content"], parse_mode="HTML")
+    elif broadcast_data["type"] == "photo":
+        await bot.send_photo(
+            user_id,
+            photo=broadcast_data["photo_file_id"],
+            caption=broadcast_data.get("caption", ""),
+            parse_mode="HTML"
+        )
+
+async def update_broadcast_progress(job, text):
+    try:
+        await bot.edit_message_text(text, chat_id=job.data['chat_id'], message_id=job.data['message_id'], parse_mode="HTML")
+    except Exception as e:
+        print(f"⚠️ Не удалось обновить прогресс рассылки: {e}")
+
+async def run_broadcast(job):
+    """Выполняет рассылку: BROADCAST_CONCURRENCY воркеров, общий лимит скорости, периодический прогресс"""
+    broadcast_data = job.data['broadcast_data']
+    
+    async def worker():
+        while job.next_index < len(job.user_ids):
+            index = job.next_index
+            job.next_index += 1
+            if index in job.done_ahead:
+                continue
+            user_id = job.user_ids[index]
+            result = await send_with_rate_limit(lambda: send_broadcast_message(user_id, broadcast_data))
+            job.mark_done(index, result)
+            broadcast_messages.inc(result=result)
+            # Исключаем из следующих рассылок только тех, кому доставить нельзя (Forbidden, чат
+            # удален); ошибка в самом сообщении ("failed") получателя не исключает
+            if result == "blocked":
+                user_registry.set_blocked(user_id)
+            
+            now = time.monotonic()
+            if now - job.persisted_at >= BROADCAST_PERSIST_INTERVAL:
+                await job.persist()
+            if now - job.reported_at >= BROADCAST_PROGRESS_INTERVAL:
+                job.reported_at = now
+                await update_broadcast_progress(job, job.progress_text())
+    
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(BROADCAST_CONCURRENCY)))
+    elapsed = time.monotonic() - started
+    
+    # Обновляем сообщение о прогрессе
+    result_text = f"""
+✅ <b>Рассылка завершена!</b>
+
+📊 <b>Статистика:</b>
+• Всего получателей: {len(job.user_ids)}
+• ✅ Успешно: {job.data['success']}
+• 🚫 Заблокировали бота: {job.data['blocked']}
+• ❌ Не удалось: {job.data['failed']}
+• ⏱ Время: {elapsed:.0f}с
+"""
+    await update_broadcast_progress(job, result_text)
+    BroadcastJob.remove()
+    log_admin_action(job.data['admin_id'], job.data['admin_username'], "✅ ЗАВЕРШИЛ РАССЫЛКУ",
+                     f"Успешно: {job.data['success']}, Заблокировали: {job.data['blocked']}, Ошибки: {job.data['failed']}")
+
+broadcast_task = None
+
+def start_broadcast(job):
+    """Запускает рассылку в фоне (одновременно выполняется только одна)"""
+    global broadcast_task
+    broadcast_task = asyncio.create_task(run_broadcast(job))
+    return broadcast_task
+
+def broadcast_running():
+    return broadcast_task is not None and not broadcast_task.done()
+
+def resume_broadcast():
+    """Продолжает рассылку, прерванную перезапуском бота"""
+    job = BroadcastJob.load()
+    if job is None:
+        return False
+    print(f"🔁 Продолжаем рассылку: {job.data['cursor']}/{len(job.user_ids)} уже обработано")
+    start_broadcast(job)
+    return True
+
 # Команда рассылки
 @dp.message(Command("broadcast"))
 async def cmd_broadcast(message: types.Message, state: FSMContext):
@@ -1508,48 +4096,25 @@ async def confirm_broadcast(callback: types.CallbackQuery, state: FSMContext):
         await state.clear()
         return
     
-    success_count = 0
-    fail_count = 0
+    if broadcast_running():
+        await callback.message.answer("⏳ Уже идет другая рассылка. Дождитесь ее завершения.")
+        return
     
     progress_message = await callback.message.answer(f"🔄 Начинаю рассылку для {len(users)} пользователей...")
     
-    # Рассылка в зависимости от типа контента
-    for user_id in users:
-        try:
-            if broadcast_data["type"] == "text":
-                await bot.send_message(
-                    user_id, 
-                    broadcast_data["content"], 
-                    parse_mode="HTML"
-                )
-                success_count += 1
-                
-            elif broadcast_data["type"] == "photo":
-                await bot.send_photo(
-                    user_id,
-                    photo=broadcast_data["photo_file_id"],
-                    caption=broadcast_data.get("caption", ""),
-                    parse_mode="HTML"
-                )
-                success_count += 1
-                
-        except Exception as e:
-            print(f"❌ Не удалось отправить рассылку пользователю {user_id}: {e}")
-            fail_count += 1
-    
-    # Обновляем сообщение о прогрессе
-    result_text = f"""
-✅ <b>Рассылка завершена!</b>
-
-📊 <b>Статистика:</b>
-• Всего получателей: {len(users)}
-• ✅ Успешно: {success_count}
-• ❌ Не удалось: {fail_count}
-"""
+    job = BroadcastJob.create(
+        broadcast_data,
+        users,
+        chat_id=progress_message.chat.id,
+        message_id=progress_message.message_id,
+        admin_id=callback.from_user.id,
+        admin_username=callback.from_user.username
+    )
+    await job.persist()
+    start_broadcast(job)
     
-    await progress_message.edit_text(result_text, parse_mode="HTML")
     await state.clear()
-    log_admin_action(callback.from_user.id, callback.from_user.username, "✅ ЗАВЕРШИЛ РАССЫЛКУ", f"Успешно: {success_count}, Ошибки: {fail_count}")
+    log_admin_action(callback.from_user.id, callback.from_user.username, "🚀 НАЧАЛ РАССЫЛКУ", f"Получателей: {len(users)}")
 
 # Отмена рассылки через callback
 @dp.callback_query(BroadcastState.confirmation, F.data == "cancel_broadcast")
@@ -1569,11 +4134,13 @@ async def cmd_users(message: types.Message):
     
     users = load_users()
     users_count = len(users)
+    total_count, blocked_count = user_registry.counts()
     
     stats_text = f"""
 <b>📊 СТАТИСТИКА ПОЛЬЗОВАТЕЛЕЙ ДЛЯ РАССЫЛКИ</b>
 
-👥 <b>Всего пользователей:</b> {users_count}
+👥 <b>Всего пользователей:</b> {total_count}
+🚫 <b>Заблокировали бота:</b> {blocked_count}
 
 💡 <b>Как добавляются пользователи:</b>
 • Автоматически при команде /start
@@ -1614,6 +4181,7 @@ async def button_admin_panel(message: types.Message):
 👤 <b>Управление заказами:</b>
 /pending - ожидающие оплаты (с реальными чеками)
 /paid - оплаченные
+/bulk approve|cancel 12 15-20 - подтвердить или отменить список заказов
 
 📢 <b>Рассылка:</b>
 /broadcast - рассылка сообщений
@@ -1666,7 +4234,7 @@ async def cmd_stats(message: types.Message):
     log_admin_action(message.from_user.id, message.from_user.username, "📊 ЗАПРОСИЛ СТАТИСТИКУ")
     
     try:
-        stats = db.get_statistics()
+        stats = await adb.get_statistics()
         
         stats_text = f"""
 <b>📊 СТАТИСТИКА ИЗ SUPABASE</b>
@@ -1691,9 +4259,62 @@ async def cmd_stats(message: types.Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка получения статистики: {e}")
 
+# СПИСКИ ЗАКАЗОВ С ПОСТРАНИЧНОЙ НАВИГАЦИЕЙ
+ORDER_LISTS = {
+    "all": {"status": None, "title": "📋 ЗАКАЗЫ", "empty": "📭 В базе нет заказов"},
+    "paid": {"status": "paid", "title": "✅ ОПЛАЧЕННЫЕ ЗАКАЗЫ", "empty": "💰 Нет оплаченных заказов"}
+}
+ORDER_STATUS_EMOJI = {"paid": "✅", "pending": "⏳", "canceled": "❌", "expired": "⌛"}
+
+def orders_page_text(kind, orders, stats):
+    response = f"<b>{ORDER_LISTS[kind]['title']}</b>\n"
+    # Итоги из кэша статистики, а не из выборки всех строк
+    if stats:
+        if kind == "paid":
+            response += f"💰 Оплачено: {stats['paid_orders']} заказов, выручка {stats['total_revenue']}₽\n"
+        else:
+            response += f"📊 Всего: {stats['total_orders']} (✅ {stats['paid_orders']}, ⏳ {stats['pending_orders']})\n"
+    response += "\n"
+    
+    for order in orders:
+        response += f"{ORDER_STATUS_EMOJI.get(order['status'], '•')} <b>Заказ #{order['id']}</b>\n"
+        response += f"👤 @{order['username']} (ID: {order['user_id']})\n"
+        response += f"🎫 Тариф: {order['tariff']}\n"
+        response += f"💰 Сумма: {order['total_price']}₽\n"
+        response += f"👥 Участников: {order.get('participants_count') or '—'}\n"
+        response += f"📅 Дата: {order['created_at'][:16]}\n"
+        if kind == "all":
+            response += f"📊 Статус: {order['status']}\n"
+        response += "\n"
+    return response
+
+def orders_page_markup(kind, orders, has_prev, has_next):
+    """Кнопки листания: в callback_data зашит курсор (created_at, id) крайнего заказа"""
+    buttons = []
+    if has_prev:
+        first = orders[0]
+        buttons.append(types.InlineKeyboardButton(text="⬅️ Новее", callback_data=f"opg:{kind}:p:{first['id']}:{first['created_at']}"))
+    if has_next:
+        last = orders[-1]
+        buttons.append(types.InlineKeyboardButton(text="Старее ➡️", callback_data=f"opg:{kind}:n:{last['id']}:{last['created_at']}"))
+    return types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+async def send_orders_page(message: types.Message, kind):
+    page = await adb.get_orders_page(ORDER_LISTS[kind]['status'])
+    if page is None:
+        await message.answer("❌ Ошибка получения заказов")
+        return
+    orders, has_next = page
+    if not orders:
+        await message.answer(ORDER_LISTS[kind]['empty'])
+        return
+    stats = await adb.get_statistics()
+    await message.answer(orders_page_text(kind, orders, stats),
+                         reply_markup=orders_page_markup(kind, orders, False, has_next), parse_mode="HTML")
+
 @dp.message(Command("orders"))
 async def cmd_orders(message: types.Message):
-    """Все заказы из Supabase"""
+    """Все заказы из Supabase (постранично)"""
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет доступа")
         return
@@ -1701,59 +4322,43 @@ async def cmd_orders(message: types.Message):
     log_admin_action(message.from_user.id, message.from_user.username, "📋 ЗАПРОСИЛ ВСЕ ЗАКАЗЫ")
     
     try:
-        orders = db.get_all_orders(limit=15)
-        
-        if not orders:
-            await message.answer("📭 В базе нет заказов")
-            return
-        
-        response = "<b>📋 ПОСЛЕДНИЕ 15 ЗАКАЗОВ:</b>\n\n"
-        
-        for order in orders:
-            status_emoji = "✅" if order['status'] == 'paid' else "⏳"
-            if order['status'] == 'canceled':
-                status_emoji = "❌"
-                
-            response += f"{status_emoji} <b>Заказ #{order['id']}</b>\n"
-            response += f"👤 @{order['username']} (ID: {order['user_id']})\n"
-            response += f"🎫 Тариф: {order['tariff']}\n"
-            response += f"💰 Сумма: {order['total_price']}₽\n"
-            response += f"👥 Участников: {len(order['participants'])}\n"
-            response += f"📅 Дата: {order['created_at'][:16]}\n"
-            response += f"📊 Статус: {order['status']}\n\n"
-        
-        await message.answer(response, parse_mode="HTML")
-        
+        await send_orders_page(message, "all")
     except Exception as e:
         await message.answer(f"❌ Ошибка получения заказов: {e}")
 
-# ОБНОВЛЕННАЯ КОМАНДА /pending - СРАЗУ С ЧЕКАМИ И ВСЕМИ ДАННЫМИ
-@dp.message(Command("pending"))
-async def cmd_pending(message: types.Message):
-    """Заказы ожидающие оплаты СРАЗУ С ЧЕКАМИ И ВСЕМИ ДАННЫМИ"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ У вас нет доступа")
+@dp.callback_query(F.data.startswith("opg:"))
+async def orders_page_callback(callback: types.CallbackQuery):
+    """Листание списка заказов: сообщение редактируется на месте"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа", show_alert=True)
         return
     
-    log_admin_action(message.from_user.id, message.from_user.username, "⏳ ЗАПРОСИЛ PENDING ЗАКАЗЫ С ЧЕКАМИ")
-    
     try:
-        orders = db.get_pending_orders()
-        
+        _, kind, direction, order_id, created_at = callback.data.split(":", 4)
+        backwards = direction == "p"
+        page = await adb.get_orders_page(ORDER_LISTS[kind]['status'], (created_at, int(order_id)), backwards)
+        if page is None:
+            await callback.answer("❌ Ошибка получения заказов", show_alert=True)
+            return
+        orders, has_more = page
         if not orders:
-            await message.answer("✅ Нет заказов ожидающих оплаты")
+            await callback.answer("📭 Больше заказов нет", show_alert=True)
             return
         
-        # Сразу отправляем статистику
-        stats_text = f"<b>⏳ ЗАКАЗЫ ОЖИДАЮЩИЕ ОПЛАТЫ</b>\n\n"
-        stats_text += f"📊 Всего: {len(orders)} заказов на сумму {sum(o['total_price'] for o in orders)}₽\n\n"
-        await message.answer(stats_text, parse_mode="HTML")
-        
-        # Отправляем каждый заказ с чеком и полными данными
-        for order in orders:
-            try:
-                # Формируем информацию о заказе с полными данными участников
-                order_info = f"""
+        # Пришли со страницы в противоположном направлении - значит, она существует
+        has_prev, has_next = (has_more, True) if backwards else (True, has_more)
+        stats = await adb.get_statistics()
+        await callback.message.edit_text(orders_page_text(kind, orders, stats),
+                                         reply_markup=orders_page_markup(kind, orders, has_prev, has_next),
+                                         parse_mode="HTML")
+        await callback.answer()
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка получения заказов: {e}", show_alert=True)
+
+# ПРОВЕРКА ОПЛАТ: ОДНА КАРТОЧКА ЗАКАЗА, КОТОРАЯ ЛИСТАЕТСЯ НА МЕСТЕ
+def pending_order_text(order):
+    """Описание заказа для проверки: покупатель, тариф, участники"""
+    order_info = f"""
 <b>🎫 ЗАКАЗ #{order['id']}</b>
 
 👤 <b>Покупатель:</b>
@@ -1765,114 +4370,340 @@ async def cmd_pending(message: types.Message):
 • Сумма: {order['total_price']}₽
 • Дата: {order['created_at'][:16]}
 • Статус: {order['status']}
+• Чек: {RECEIPT_PROCESSING_LABELS.get(order.get('processing_status'), '☁️ в облачном хранилище' if order.get('receipt_file_name') else '📎 в Telegram')}
 
 👥 <b>Участники ({len(order['participants'])} чел.):</b>
 """
-                
-                # Добавляем информацию о каждом участнике
-                for i, participant in enumerate(order['participants'], 1):
-                    order_info += f"""
+    for i, participant in enumerate(order['participants'], 1):
+        order_info += f"""
 <b>Участник {i}:</b>
 • ФИО: {participant['full_name']}
 • Telegram: {participant['telegram']}
 • Телефон: {participant['phone']}
 """
-                
-                # Проверяем наличие файла в Supabase Storage
-                supabase_file_info = await get_supabase_file_info(order['id'])
-                
-                if supabase_file_info:
-                    # Скачиваем файл из Supabase Storage
-                    file_data = supabase_client.storage.from_("receipts").download(supabase_file_info['file_name'])
-                    
-                    if file_data:
-                        # Сохраняем временно
-                        temp_file = f"temp_{supabase_file_info['file_name']}"
-                        with open(temp_file, 'wb') as f:
-                            f.write(file_data)
-                        
-                        document = FSInputFile(temp_file)
-                        
-                        # Определяем тип файла для отправки
-                        if supabase_file_info['file_name'].endswith('.pdf'):
-                            await bot.send_document(
-                                message.chat.id,
-                                document,
-                                caption=order_info + f"\n📎 <b>Чек прикреплен</b> (PDF)\n🔗 <a href='{supabase_file_info['public_url']}'>Ссылка на чек</a>",
-                                parse_mode="HTML"
-                            )
-                        else:
-                            await bot.send_photo(
-                                message.chat.id,
-                                document,
-                                caption=order_info + f"\n📎 <b>Чек прикреплен</b> (Фото)\n🔗 <a href='{supabase_file_info['public_url']}'>Ссылка на чек</a>",
-                                parse_mode="HTML"
-                            )
-                        
-                        # Удаляем временный файл
-                        os.remove(temp_file)
-                        
-                    else:
-                        # Если не удалось скачать файл, отправляем только информацию с ссылкой
-                        await message.answer(
-                            order_info + f"\n❌ <b>Не удалось загрузить файл чека</b>\n🔗 <a href='{supabase_file_info['public_url']}'>Ссылка на чек в Supabase</a>",
-                            parse_mode="HTML"
-                        )
-                else:
-                    # Если чека нет
-                    await message.answer(
-                        order_info + "\n❌ <b>Чек не прикреплен</b>",
-                        parse_mode="HTML"
-                    )
-                
-                # Добавляем кнопки управления для каждого заказа
-                keyboard = [
-                    [
-                        types.InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=f"approve_{order['id']}"),
-                        types.InlineKeyboardButton(text="❌ Отменить заказ", callback_data=f"cancel_{order['id']}")
-                    ],
-                    [
-                        types.InlineKeyboardButton(text="📞 Связаться с покупателем", 
-                                                 url=f"tg://user?id={order['user_id']}"),
-                        types.InlineKeyboardButton(text="🔄 Обновить чек", callback_data=f"refresh_{order['id']}")
-                    ]
-                ]
-                markup = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
-                
-                await message.answer(
-                    f"⚡ <b>Управление заказа #{order['id']}</b>",
-                    reply_markup=markup,
-                    parse_mode="HTML"
-                )
-                
-                # Добавляем разделитель между заказами
-                await message.answer("─" * 40)
-                    
-            except Exception as e:
-                error_msg = f"❌ Ошибка при обработке заказа #{order['id']}: {e}"
-                print(error_msg)
-                await message.answer(error_msg)
-                continue
-        
-        # Финальная статистика
-        final_stats = f"""
-✅ <b>ОБРАБОТКА ЗАВЕРШЕНА</b>
+    return order_info
 
-📈 <b>Итоговая статистика:</b>
-• 📋 Всего заказов: {len(orders)}
-• 💰 Общая сумма: {sum(o['total_price'] for o in orders)}₽
-• 👥 Всего участников: {sum(len(o['participants']) for o in orders)}
+async def load_receipt_media(order):
+    """Чек заказа для карточки: (file_id или файл из Storage, 'document' | 'photo') либо None"""
+    cached = get_receipt_file_id(order)
+    if cached:
+        return cached
+    
+    supabase_file_info = await get_supabase_file_info(order['id'], order)
+    if not supabase_file_info:
+        return None
+    file_data = await adb.run(supabase_client.storage.from_("receipts").download, supabase_file_info['file_name'])
+    if not file_data:
+        return None
+    file_type = 'document' if supabase_file_info['file_name'].endswith('.pdf') else 'photo'
+    return BufferedInputFile(file_data, filename=supabase_file_info['file_name']), file_type
 
-💡 <b>Быстрые команды:</b>
-Используйте кнопки выше для управления заказами
-        """
+class ReviewSession:
+    """Очередь проверки оплат одного админа
+    
+    Все заказы показываются в одном сообщении-карточке: подтверждение, отмена и
+    «Следующий» редактируют его на месте, а чек следующего заказа загружается заранее,
+    пока админ смотрит текущий."""
+    
+    def __init__(self, orders):
+        self.orders = orders
+        self.index = 0
+        self.message_id = None
+        self.has_media = False
+        self.done = {"paid": 0, "canceled": 0}
+        self.receipts = {}  # order_id -> задача загрузки чека
+        self.lock = asyncio.Lock()
+    
+    def current(self):
+        return self.orders[self.index] if self.orders else None
+    
+    def advance(self, remove=False):
+        """Переходит к следующему заказу; обработанный заказ убирается из очереди"""
+        if remove:
+            order = self.orders.pop(self.index)
+            task = self.receipts.pop(order['id'], None)
+            if task:
+                task.cancel()
+        else:
+            self.index += 1
+        if self.index >= len(self.orders):
+            self.index = 0
+    
+    def receipt(self, order):
+        """Задача загрузки чека заказа (запускается при первом обращении)"""
+        task = self.receipts.get(order['id'])
+        if task is None:
+            task = spawn(load_receipt_media(order))
+            self.receipts[order['id']] = task
+        return task
+    
+    def prefetch(self):
+        """Заранее загружает чек заказа, который будет показан следующим"""
+        if len(self.orders) > 1:
+            self.receipt(self.orders[(self.index + 1) % len(self.orders)])
+    
+    def close(self):
+        # Загрузки не отменяются: карточка этой очереди может еще ждать чек в другом обработчике
+        self.receipts.clear()
+
+# Активные очереди проверки: admin_id -> ReviewSession
+review_sessions = {}
+
+def review_card_markup(order, remaining):
+    keyboard = [
+        [
+            types.InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=f"review_approve_{order['id']}"),
+            types.InlineKeyboardButton(text="❌ Отменить заказ", callback_data=f"review_cancel_{order['id']}")
+        ],
+        [types.InlineKeyboardButton(text="📞 Связаться с покупателем", url=f"tg://user?id={order['user_id']}")]
+    ]
+    if remaining > 1:
+        keyboard[1].append(types.InlineKeyboardButton(text="⏭ Следующий", callback_data="review_next"))
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def show_review_card(chat_id, session):
+    """Показывает текущий заказ очереди, редактируя карточку на месте"""
+    order = session.current()
+    if order is None:
+        text = (f"✅ <b>Все заказы проверены</b>\n\n"
+                f"• Подтверждено: {session.done['paid']}\n"
+                f"• Отменено: {session.done['canceled']}")
+        if session.message_id and not session.has_media:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=session.message_id, parse_mode="HTML")
+        else:
+            if session.message_id:
+                await delete_review_card(chat_id, session)
+            await bot.send_message(chat_id, text, parse_mode="HTML")
+        session.close()
+        return
+    
+    header = (f"⏳ <b>Проверка оплат: {session.index + 1} из {len(session.orders)}</b> "
+              f"(на сумму {sum(o['total_price'] for o in session.orders)}₽)\n")
+    markup = review_card_markup(order, len(session.orders))
+    try:
+        receipt = await session.receipt(order)
+    except Exception as e:
+        print(f"⚠️ Не удалось загрузить чек заказа #{order['id']}: {e}")
+        receipt = None
+    session.prefetch()
+    
+    text = header + pending_order_text(order)
+    if receipt:
+        media, file_type = receipt
+        caption = text + f"\n📎 <b>Чек прикреплен</b> ({'Фото' if file_type == 'photo' else 'PDF'})"
+    else:
+        caption = text + "\n❌ <b>Чек не прикреплен</b>"
+    
+    sent = None
+    # Карточку с файлом нельзя превратить в текстовую и наоборот - тогда она пересоздается
+    if session.message_id and session.has_media == bool(receipt):
+        try:
+            if receipt:
+                input_media = (types.InputMediaPhoto if file_type == 'photo' else types.InputMediaDocument)(
+                    media=media, caption=caption, parse_mode="HTML")
+                sent = await bot.edit_message_media(input_media, chat_id=chat_id, message_id=session.message_id,
+                                                    reply_markup=markup)
+            else:
+                sent = await bot.edit_message_text(caption, chat_id=chat_id, message_id=session.message_id,
+                                                   reply_markup=markup, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            print(f"⚠️ Не удалось обновить карточку заказа #{order['id']}: {e}")
+    
+    if sent is None:
+        if session.message_id:
+            await delete_review_card(chat_id, session)
+        if receipt and file_type == 'photo':
+            sent = await bot.send_photo(chat_id, media, caption=caption, reply_markup=markup, parse_mode="HTML")
+        elif receipt:
+            sent = await bot.send_document(chat_id, media, caption=caption, reply_markup=markup, parse_mode="HTML")
+        else:
+            sent = await bot.send_message(chat_id, caption, reply_markup=markup, parse_mode="HTML")
+    
+    session.message_id = sent.message_id
+    session.has_media = bool(receipt)
+    
+    # Чек загружен из Storage - следующие показы пойдут по file_id
+    if receipt and not isinstance(media, str):
+        file_id = sent.photo[-1].file_id if file_type == 'photo' else sent.document.file_id
+        remember_receipt_file_id(order['id'], file_id, file_type)
+        session.receipts.pop(order['id'], None)
+        await adb.update_order_fields(order['id'], {"receipt_file_id": file_id, "receipt_file_type": file_type})
+
+async def delete_review_card(chat_id, session):
+    try:
+        await bot.delete_message(chat_id, session.message_id)
+    except Exception as e:
+        print(f"⚠️ Не удалось удалить карточку проверки: {e}")
+    session.message_id = None
+
+@dp.message(Command("pending"))
+async def cmd_pending(message: types.Message):
+    """Заказы, ожидающие оплаты: одна карточка с чеком, участниками и кнопками"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа")
+        return
+    
+    log_admin_action(message.from_user.id, message.from_user.username, "⏳ ЗАПРОСИЛ PENDING ЗАКАЗЫ С ЧЕКАМИ")
+    
+    try:
+        orders = await adb.get_pending_orders()
+        
+        if not orders:
+            await message.answer("✅ Нет заказов ожидающих оплаты")
+            return
         
-        await message.answer(final_stats, parse_mode="HTML")
+        # Повторный /pending начинает проверку заново с актуальной очередью
+        previous = review_sessions.pop(message.from_user.id, None)
+        if previous:
+            previous.close()
+        session = ReviewSession(orders)
+        review_sessions[message.from_user.id] = session
+        async with session.lock:
+            await show_review_card(message.chat.id, session)
         
     except Exception as e:
         await message.answer(f"❌ Ошибка получения pending заказов: {e}")
 
-# ДОБАВЛЯЕМ ОБРАБОТЧИКИ ДЛЯ КНОПОК УПРАВЛЕНИЯ
+async def review_action(callback: types.CallbackQuery, action):
+    """Кнопки карточки проверки: подтвердить / отменить / следующий"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа", show_alert=True)
+        return
+    
+    session = review_sessions.get(callback.from_user.id)
+    if session is None or session.message_id != callback.message.message_id:
+        await callback.answer("⌛ Карточка устарела, откройте /pending заново", show_alert=True)
+        return
+    
+    async with session.lock:
+        order = session.current()
+        if order is None:
+            await callback.answer()
+            return
+        # Кнопка нажата на карточке другого заказа (двойное нажатие)
+        if action != "next" and callback.data.rsplit("_", 1)[-1] != str(order['id']):
+            await callback.answer()
+            return
+        
+        try:
+            notice = None
+            if action == "next":
+                session.advance()
+            else:
+                # Ошибка Supabase - не повод убирать заказ из очереди: карточка остается
+                try:
+                    fresh = await adb.run(db.get_order_by_id, order['id'])
+                except Exception as e:
+                    print(f"❌ Не удалось загрузить заказ {order['id']}: {e}")
+                    await callback.answer(f"❌ Не удалось загрузить заказ #{order['id']}, попробуйте еще раз", show_alert=True)
+                    return
+                if fresh is None:
+                    notice = "❌ Заказ не найден"
+                    session.advance(remove=True)
+                elif fresh['status'] != "pending":
+                    # Заказ уже подтвердил или отменил другой админ (или истек срок оплаты)
+                    notice = f"{ORDER_STATUS_EMOJI.get(fresh['status'], 'ℹ️')} Заказ #{order['id']} уже обработан"
+                    session.advance(remove=True)
+                elif action == "approve":
+                    log_admin_action(callback.from_user.id, callback.from_user.username, "✅ ПОДТВЕРДИЛ ОПЛАТУ ЧЕРЕЗ CALLBACK", f"Order ID: {order['id']}")
+                    if not await approve_order(order['id'], fresh):
+                        await callback.answer(f"❌ Не удалось подтвердить заказ #{order['id']}", show_alert=True)
+                        return
+                    session.done["paid"] += 1
+                    session.advance(remove=True)
+                    notice = f"✅ Заказ #{order['id']} подтвержден"
+                else:
+                    log_admin_action(callback.from_user.id, callback.from_user.username, "❌ ОТМЕНИЛ ЗАКАЗ ЧЕРЕЗ CALLBACK", f"Order ID: {order['id']}")
+                    if not await cancel_order(fresh):
+                        await callback.answer(f"❌ Не удалось отменить заказ #{order['id']}", show_alert=True)
+                        return
+                    session.done["canceled"] += 1
+                    session.advance(remove=True)
+                    notice = f"❌ Заказ #{order['id']} отменен"
+            
+            await show_review_card(callback.message.chat.id, session)
+            if session.current() is None:
+                review_sessions.pop(callback.from_user.id, None)
+            await callback.answer(notice)
+        except Exception as e:
+            await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
+
+@dp.callback_query(F.data.startswith("review_approve_"))
+async def review_approve_callback(callback: types.CallbackQuery):
+    await review_action(callback, "approve")
+
+@dp.callback_query(F.data.startswith("review_cancel_"))
+async def review_cancel_callback(callback: types.CallbackQuery):
+    await review_action(callback, "cancel")
+
+@dp.callback_query(F.data == "review_next")
+async def review_next_callback(callback: types.CallbackQuery):
+    await review_action(callback, "next")
+
+# ПОДТВЕРЖДЕНИЕ И ОТМЕНА ЗАКАЗА
+async def notify_order_approved(order):
+    """Сообщает покупателю о подтверждении оплаты"""
+    # Дата и место берутся из каталога, а не из текста в коде
+    event = catalog_snapshot.event(order.get('event_id'))
+    event_text = f"📅 <b>{event.title}</b>\n🗓 {event.short_line}\n\n" if event else ""
+    await bot.send_message(
+        order['user_id'],
+        f"🎉 <b>ВАШ ЗАКАЗ ПОДТВЕРЖДЕН!</b>\n\n"
+        f"Заказ #{order['id']} успешно подтвержден администратором.\n"
+        f"Ждем вас на мероприятии!\n\n"
+        f"{event_text}"
+        f"💬 <b>По вопросам:</b> @m5frls",
+        parse_mode="HTML"
+    )
+
+async def notify_order_canceled(order):
+    """Сообщает покупателю об отмене заказа"""
+    await bot.send_message(
+        order['user_id'],
+        f"❌ <b>ВАШ ЗАКАЗ ОТМЕНЕН</b>\n\n"
+        f"Заказ #{order['id']} был отменен администратором.\n"
+        f"Если у вас есть вопросы, пожалуйста, свяжитесь с поддержкой.\n\n"
+        f"<b>Детали отмененного заказа:</b>\n"
+        f"• Тариф: {order['tariff']}\n"
+        f"• Участники: {len(order['participants'])} человек\n"
+        f"• Сумма: {order['total_price']}₽\n\n"
+        f"💬 <b>По вопросам:</b> @m5frls",
+        parse_mode="HTML"
+    )
+
+async def approve_order(order_id, order):
+    """Переводит заказ в paid и уведомляет покупателя; order - текущая строка заказа или None"""
+    previous_status = order['status'] if order else None
+    success = await adb.update_order_status(order_id, "paid", True, previous_status=previous_status)
+    if not success:
+        return False
+    
+    scheduler.cancel(("order", order_id))
+    if order and order['user_id']:
+        try:
+            await notify_order_approved(order)
+        except Exception as e:
+            print(f"❌ Не удалось уведомить пользователя: {e}")
+    return True
+
+async def cancel_order(order):
+    """Отменяет заказ, освобождает место и уведомляет покупателя"""
+    success = await adb.update_order_status(order['id'], "canceled", previous_status=order['status'])
+    if not success:
+        return False
+    
+    scheduler.cancel(("order", order['id']))
+    if order['status'] not in RELEASED_STATUSES:
+        inventory.on_order_cancelled(order)
+    
+    user_id = order['user_id']
+    try:
+        await notify_order_canceled(order)
+        log_event(user_id, order['username'], "❌ ЗАКАЗ ОТМЕНЕН АДМИНОМ", f"Order #{order['id']}")
+    except Exception as e:
+        print(f"❌ Не удалось уведомить пользователя {user_id}: {e}")
+    return True
+
 @dp.callback_query(F.data.startswith("approve_"))
 async def approve_order_callback(callback: types.CallbackQuery):
     """Подтверждение оплаты через callback"""
@@ -1885,29 +4716,11 @@ async def approve_order_callback(callback: types.CallbackQuery):
     try:
         log_admin_action(callback.from_user.id, callback.from_user.username, "✅ ПОДТВЕРДИЛ ОПЛАТУ ЧЕРЕЗ CALLBACK", f"Order ID: {order_id}")
         
-        # Обновляем статус в Supabase
-        success = db.update_order_status(int(order_id), "paid", True)
+        # Получаем информацию о заказе (для статистики и уведомления пользователя)
+        order = await adb.get_order_by_id(int(order_id))
         
-        if success:
+        if await approve_order(int(order_id), order):
             await callback.message.edit_text(f"✅ Заказ #{order_id} подтвержден и перемещен в оплаченные!")
-            
-            # Получаем информацию о заказе для уведомления пользователя
-            order = db.get_order_by_id(int(order_id))
-            if order and order['user_id']:
-                try:
-                    await bot.send_message(
-                        order['user_id'],
-                        f"🎉 <b>ВАШ ЗАКАЗ ПОДТВЕРЖДЕН!</b>\n\n"
-                        f"Заказ #{order_id} успешно подтвержден администратором.\n"
-                        f"Ждем вас на мероприятии!\n\n"
-                        f"📅 <b>NEW YEAR GEDAN PARTY</b>\n"
-                        f"🗓 27.12.2024 | 20:00\n"
-                        f"📍 Просторный дом с русской баней\n\n"
-                        f"💬 <b>По вопросам:</b> @m5frls",
-                        parse_mode="HTML"
-                    )
-                except Exception as e:
-                    print(f"❌ Не удалось уведомить пользователя: {e}")
         else:
             await callback.message.edit_text(f"❌ Не удалось подтвердить заказ #{order_id}")
             
@@ -1929,34 +4742,12 @@ async def cancel_order_callback(callback: types.CallbackQuery):
         log_admin_action(callback.from_user.id, callback.from_user.username, "❌ ОТМЕНИЛ ЗАКАЗ ЧЕРЕЗ CALLBACK", f"Order ID: {order_id}")
         
         # Получаем информацию о заказе перед отменой
-        order = db.get_order_by_id(int(order_id))
+        order = await adb.get_order_by_id(int(order_id))
         if not order:
             await callback.answer("❌ Заказ не найден", show_alert=True)
             return
         
-        # Обновляем статус в Supabase
-        success = db.update_order_status(int(order_id), "canceled")
-        
-        if success:
-            # Уведомляем пользователя об отмене заказа
-            user_id = order['user_id']
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"❌ <b>ВАШ ЗАКАЗ ОТМЕНЕН</b>\n\n"
-                    f"Заказ #{order_id} был отменен администратором.\n"
-                    f"Если у вас есть вопросы, пожалуйста, свяжитесь с поддержкой.\n\n"
-                    f"<b>Детали отмененного заказа:</b>\n"
-                    f"• Тариф: {order['tariff']}\n"
-                    f"• Участники: {len(order['participants'])} человек\n"
-                    f"• Сумма: {order['total_price']}₽\n\n"
-                    f"💬 <b>По вопросам:</b> @m5frls",
-                    parse_mode="HTML"
-                )
-                log_event(user_id, order['username'], "❌ ЗАКАЗ ОТМЕНЕН АДМИНОМ", f"Order #{order_id}")
-            except Exception as e:
-                print(f"❌ Не удалось уведомить пользователя {user_id}: {e}")
-            
+        if await cancel_order(order):
             await callback.message.edit_text(f"❌ Заказ #{order_id} отменен! Пользователь уведомлен.")
         else:
             await callback.message.edit_text(f"❌ Не удалось отменить заказ #{order_id}")
@@ -1966,6 +4757,101 @@ async def cancel_order_callback(callback: types.CallbackQuery):
     except Exception as e:
         await callback.answer(f"❌ Ошибка отмены заказа: {e}", show_alert=True)
 
+# МАССОВОЕ ПОДТВЕРЖДЕНИЕ / ОТМЕНА
+BULK_ACTIONS = {
+    "approve": {"status": "paid", "done": "подтвержден", "notify": notify_order_approved},
+    "cancel": {"status": "canceled", "done": "отменен", "notify": notify_order_canceled}
+}
+
+def parse_order_ids(args):
+    """'12 15-20, 31' -> [12, 15, 16, 17, 18, 19, 20, 31]; ValueError при ошибке"""
+    order_ids = set()
+    for token in args.replace(",", " ").split():
+        if not all(part.isdigit() for part in token.split("-", 1)):
+            raise ValueError(f"неверный номер «{token}»")
+        if "-" in token:
+            first, last = (int(part) for part in token.split("-", 1))
+            if first > last:
+                first, last = last, first
+            if last - first >= BULK_MAX_ORDERS:
+                raise ValueError(f"слишком большой диапазон {token}")
+            order_ids.update(range(first, last + 1))
+        else:
+            order_ids.add(int(token))
+    return sorted(order_ids)
+
+async def send_long_text(message: types.Message, lines, limit=4000):
+    """Отправляет строки несколькими сообщениями, не превышая лимит длины Telegram"""
+    chunk = ""
+    for line in lines:
+        if chunk and len(chunk) + len(line) + 1 > limit:
+            await message.answer(chunk, parse_mode="HTML")
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await message.answer(chunk, parse_mode="HTML")
+
+@dp.message(Command("bulk"))
+async def cmd_bulk(message: types.Message):
+    """Подтверждение или отмена сразу нескольких заказов: /bulk approve 12 15-20"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа")
+        return
+    
+    parts = (message.text or "").split(maxsplit=2)
+    usage = ("Использование:\n"
+             "<code>/bulk approve 12 15-20 31</code> - подтвердить оплату\n"
+             "<code>/bulk cancel 12 15-20 31</code> - отменить заказы")
+    if len(parts) < 3 or parts[1] not in BULK_ACTIONS:
+        await message.answer(usage, parse_mode="HTML")
+        return
+    
+    action = BULK_ACTIONS[parts[1]]
+    try:
+        order_ids = parse_order_ids(parts[2])
+    except ValueError as e:
+        await message.answer(f"❌ Не удалось разобрать номера заказов: {e}\n\n{usage}", parse_mode="HTML")
+        return
+    if not order_ids or len(order_ids) > BULK_MAX_ORDERS:
+        await message.answer(f"❌ Укажите от 1 до {BULK_MAX_ORDERS} заказов")
+        return
+    
+    log_admin_action(message.from_user.id, message.from_user.username, f"📦 МАССОВО {parts[1].upper()}",
+                     f"{len(order_ids)} заказов: {parts[2]}")
+    
+    result = await adb.update_orders_status(order_ids, action['status'], action['status'] == "paid")
+    if result is None:
+        await message.answer("❌ Не удалось обновить заказы, попробуйте позже")
+        return
+    updated, previous = result
+    
+    for order in updated:
+        scheduler.cancel(("order", order['id']))
+        if action['status'] == "canceled" and previous.get(order['id']) not in RELEASED_STATUSES:
+            inventory.on_order_cancelled(order)
+    
+    # Уведомления покупателям - через общий лимитер исходящих сообщений
+    deliveries = await asyncio.gather(*(
+        send_with_rate_limit(functools.partial(action['notify'], order)) for order in updated
+    ))
+    delivered = {order['id']: outcome for order, outcome in zip(updated, deliveries)}
+    for order in updated:
+        if action['status'] == "canceled" and delivered[order['id']] == "ok":
+            log_event(order['user_id'], order['username'], "❌ ЗАКАЗ ОТМЕНЕН АДМИНОМ", f"Order #{order['id']}")
+    
+    lines = [f"📦 <b>Массовая операция: {len(updated)} из {len(order_ids)} заказов {action['done']}о</b>\n"]
+    for order_id in order_ids:
+        if order_id in delivered:
+            notice = "покупатель уведомлен" if delivered[order_id] == "ok" else "уведомление не доставлено"
+            lines.append(f"✅ #{order_id} - {action['done']}, {notice}")
+        elif order_id not in previous:
+            lines.append(f"❓ #{order_id} - не найден")
+        elif previous[order_id] == action['status']:
+            lines.append(f"➖ #{order_id} - уже {action['status']}")
+        else:
+            lines.append(f"⚠️ #{order_id} - статус изменился, не обновлен")
+    await send_long_text(message, lines)
+
 @dp.callback_query(F.data.startswith("refresh_"))
 async def refresh_receipt_callback(callback: types.CallbackQuery):
     """Обновление информации о чеке"""
@@ -1977,13 +4863,14 @@ async def refresh_receipt_callback(callback: types.CallbackQuery):
     
     try:
         # Получаем актуальную информацию о заказе
-        order = db.get_order_by_id(int(order_id))
+        order = await adb.get_order_by_id(int(order_id))
         if not order:
             await callback.answer("❌ Заказ не найден", show_alert=True)
             return
         
-        # Проверяем наличие файла в Supabase Storage
-        supabase_file_info = await get_supabase_file_info(int(order_id))
+        # Проверяем наличие файла в Supabase Storage (заново, минуя индекс)
+        receipt_name_index.pop(int(order_id), None)
+        supabase_file_info = await get_supabase_file_info(int(order_id), order)
         
         if supabase_file_info:
             info_text = f"🔄 <b>Обновленная информация по заказу #{order_id}</b>\n\n"
@@ -2001,7 +4888,7 @@ async def refresh_receipt_callback(callback: types.CallbackQuery):
 
 @dp.message(Command("paid"))
 async def cmd_paid(message: types.Message):
-    """Оплаченные заказы"""
+    """Оплаченные заказы (постранично)"""
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет доступа")
         return
@@ -2009,30 +4896,7 @@ async def cmd_paid(message: types.Message):
     log_admin_action(message.from_user.id, message.from_user.username, "✅ ЗАПРОСИЛ(-а) PAID ЗАКАЗЫ")
     
     try:
-        orders = db.get_paid_orders()
-        
-        if not orders:
-            await message.answer("💰 Нет оплаченных заказов")
-            return
-        
-        response = "<b>✅ ОПЛАЧЕННЫЕ ЗАКАЗЫ:</b>\n\n"
-        
-        for order in orders[:10]:
-            response += f"🎫 <b>Заказ #{order['id']}</b>\n"
-            response += f"👤 @{order['username']} (ID: {order['user_id']})\n"
-            response += f"📋 Тариф: {order['tariff']}\n"
-            response += f"💰 Сумма: {order['total_price']}₽\n"
-            response += f"👥 Участников: {len(order['participants'])}\n"
-            response += f"📅 Дата: {order['created_at'][:16]}\n\n"
-        
-        if len(orders) > 10:
-            response += f"📎 ... и еще {len(orders) - 10} заказов\n"
-        
-        total_revenue = sum(o['total_price'] for o in orders)
-        response += f"💰 <b>Общая выручка:</b> {total_revenue}₽"
-        
-        await message.answer(response, parse_mode="HTML")
-        
+        await send_orders_page(message, "paid")
     except Exception as e:
         await message.answer(f"❌ Ошибка получения paid заказов: {e}")
 
@@ -2075,39 +4939,258 @@ async def handle_other_messages(message: types.Message):
     log_event(message.from_user.id, message.from_user.username, "💬 ОТПРАВИЛ(-а) СООБЩЕНИЕ", f"Текст: {message.text}")
     await show_main_menu(message)
 
+# РЕЖИМ WEBHOOK
+class BackgroundWebhookHandler(SimpleRequestHandler):
+    """Отвечает Telegram 200 сразу, обрабатывая обновление в фоновой задаче;
+    при остановке дожидается уже принятых обновлений"""
+    async def close(self):
+        pending = set(self._background_feed_update_tasks)
+        if pending:
+            print(f"⏳ Ждем завершения {len(pending)} обработчиков...")
+            await asyncio.wait(pending, timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        # Сессию бота закрывает main() после остановки всех подсистем
+
+async def handle_health(request):
+    return web.Response(text="ok")
+
+# МЕТРИКИ И ПРОВЕРКИ ГОТОВНОСТИ
+# Доступность Supabase проверяется в фоне, /readyz отдает последний результат без запроса
+supabase_health = {"ok": None, "checked_at": None, "error": None}
+
+async def run_supabase_health_check(interval=HEALTH_CHECK_INTERVAL):
+    while True:
+        try:
+            await adb.run(db.ping)
+            ok, error = True, None
+        except asyncio.TimeoutError:
+            ok, error = False, f"нет ответа за {adb.timeout:.0f}с"
+        except Exception as e:
+            ok, error = False, str(e)
+        supabase_health.update(ok=ok, checked_at=time.time(), error=error)
+        await asyncio.sleep(interval)
+
+def fsm_state_counts():
+    """Сессии FSM по состояниям; None для Redis (там пришлось бы перебирать все ключи)"""
+    if isinstance(storage, SQLiteStorage):
+        return storage.count_states()
+    if isinstance(storage, MemoryStorage):
+        counts = {}
+        for record in storage.storage.values():
+            if record.state:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+    return None
+
+@metrics.collector
+def collect_state_gauges():
+    """Gauge, которые дешевле посчитать в момент запроса /metrics"""
+    stats, _ = db.stats.snapshot()
+    if stats:
+        orders_gauge.replace([({"status": "all"}, stats['total_orders']),
+                              ({"status": "paid"}, stats['paid_orders']),
+                              ({"status": "pending"}, stats['pending_orders'])])
+    broadcast_running_gauge.set(int(broadcast_running()))
+    supabase_up.set(int(bool(supabase_health["ok"])))
+    counts = fsm_state_counts()
+    if counts is not None:
+        fsm_sessions.replace([({"state": state}, count) for state, count in counts.items()])
+
+async def handle_metrics(request):
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return web.Response(status=401, text="unauthorized")
+    return web.Response(body=metrics.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def handle_livez(request):
+    # Ответил - значит event loop жив
+    return web.json_response({"status": "ok"})
+
+async def handle_readyz(request):
+    """Готов принимать трафик, если последняя проверка Supabase успешна и предохранитель не разомкнут"""
+    checked_at = supabase_health["checked_at"]
+    ready = supabase_health["ok"] is True and adb.breaker.state != "open"
+    return web.json_response({
+        "status": "ready" if ready else "not ready",
+        "supabase": supabase_health["ok"],
+        "checked_ago_sec": round(time.time() - checked_at, 1) if checked_at else None,
+        "breaker": adb.breaker.state,
+        "error": supabase_health["error"],
+        "catalog": catalog_snapshot.source
+    }, status=200 if ready else 503)
+
+def add_observability_routes(app):
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/livez", handle_livez)
+    app.router.add_get("/readyz", handle_readyz)
+
+metrics_runner = None
+
+async def run_metrics_server():
+    """Отдельный web-сервер метрик для режима polling"""
+    global metrics_runner
+    app = web.Application()
+    app.router.add_get("/healthz", handle_health)
+    add_observability_routes(app)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, WEB_HOST, METRICS_PORT).start()
+    print(f"📈 Метрики: http://{WEB_HOST}:{METRICS_PORT}/metrics")
+
+def create_web_app():
+    """aiohttp-приложение: webhook Telegram, проверки живости и метрики"""
+    app = web.Application()
+    BackgroundWebhookHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    app.router.add_get("/healthz", handle_health)
+    add_observability_routes(app)
+    return app
+
+async def run_webhook():
+    """Поднимает web-сервер, регистрирует webhook и работает до SIGTERM/SIGINT"""
+    runner = web.AppRunner(create_web_app())
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    print(f"🌐 Web-сервер слушает {WEB_HOST}:{WEB_PORT}")
+    
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    print(f"🔗 Webhook установлен: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+        print("🟡 Получен сигнал остановки, завершаем работу...")
+    finally:
+        # Останавливает прием запросов, ждет обработчики и закрывает хранилище FSM
+        await runner.cleanup()
+
 # ОСНОВНАЯ ФУНКЦИЯ ЗАПУСКА
-async def main():
+# ЗАПУСК: короткий обязательный этап, остальное - в фоне после начала приема обновлений
+startup_timings = {}  # Шаг запуска -> длительность, сек
+
+async def timed_step(name, step, timeout=STARTUP_CHECK_TIMEOUT):
+    """Выполняет шаг запуска с таймаутом и запоминает его длительность
+    
+    Ошибка или таймаут шага не останавливают запуск. Возвращает результат шага или None."""
+    started = time.perf_counter()
+    try:
+        return await asyncio.wait_for(step, timeout)
+    except asyncio.TimeoutError:
+        print(f"⚠️ {name}: нет ответа за {timeout:.0f}с, продолжаем без этого шага")
+    except Exception as e:
+        print(f"⚠️ {name}: {e}")
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+    return None
+
+def format_timings(names):
+    return ", ".join(f"{name} {startup_timings[name]:.2f}с" for name in names if name in startup_timings)
+
+async def load_catalog():
+    """Каталог и занятые места - без них нельзя показывать тарифы"""
+    await refresh_catalog(reconcile=False)
+    await inventory.reconcile()
+
+async def arm_pending_order_timers():
+    """Восстанавливает сроки неподтвержденных заказов по created_at (таймеры живут только в памяти)
+    
+    Если Supabase не ответил, повторяет через ORDER_TIMERS_RETRY_DELAY, чтобы заказы,
+    созданные до перезапуска, не остались без срока."""
+    try:
+        orders = await adb.run(db.get_pending_orders)
+    except Exception as e:
+        print(f"⚠️ Сроки заказов не восстановлены ({e or type(e).__name__}), повтор через {ORDER_TIMERS_RETRY_DELAY}с")
+        scheduler.schedule(("order_timers",), time.time() + ORDER_TIMERS_RETRY_DELAY, arm_pending_order_timers)
+        return
+    for order in orders:
+        schedule_order_expiry(order)
+    print(f"⏳ Сроки неподтвержденных заказов: {len(orders)} шт. (истекают через {format_duration(PENDING_ORDER_TTL)} после создания)")
+
+async def warm_up_event_images():
+    """Заранее загружает картинки мероприятий в Telegram (для file_id)"""
+    for event in catalog_snapshot.events.values():
+        if not event.image_path:
+            continue
+        try:
+            await media_cache.warm_up(event.image_path, int(MEDIA_WARMUP_CHAT_ID))
+        except Exception as e:
+            print(f"⚠️ Не удалось заранее загрузить картинку мероприятия: {e}")
+
+async def run_startup_checks():
+    """Проверки Supabase и прогрев кэшей параллельно, пока бот уже отвечает пользователям"""
+    started = time.perf_counter()
+    steps = [
+        timed_step("Storage", adb.run(create_receipts_bucket)),
+        timed_step("таблица orders", adb.run(db.check_orders_table)),
+        timed_step("статистика", adb.get_statistics()),
+        timed_step("догрузка чеков", receipt_archiver.resume())
+    ]
+    if PENDING_ORDER_TTL > 0:
+        steps.append(timed_step("сроки заказов", arm_pending_order_timers()))
+    if MEDIA_WARMUP_CHAT_ID:
+        steps.append(timed_step("картинки", warm_up_event_images(), timeout=HTTP_TOTAL_TIMEOUT))
+    bucket_ready, table_ready, stats, *_ = await asyncio.gather(*steps)
+    
+    print(f"☁️ Supabase Storage: {'✅' if bucket_ready else '❌'} bucket 'receipts'")
+    print(f"📊 Таблица orders: {'✅' if table_ready else '❌'}")
+    if stats:
+        print(f"📈 Supabase статистика: {stats['total_orders']} заказов, {stats['total_revenue']}₽ выручки")
+    print(f"⏱ Фоновые проверки: {time.perf_counter() - started:.2f}с "
+          f"({format_timings(['Storage', 'таблица orders', 'статистика', 'догрузка чеков', 'сроки заказов', 'картинки'])})")
+
+async def startup():
+    """Все, что нужно до приема обновлений (бенчмарки bench/ вызывают это вместо main)"""
+    started = time.perf_counter()
     print("=" * 70)
     print("🤖 ЗАПУСК БОТА - ТОЛЬКО SUPABASE")
     print("=" * 70)
     
-    # Создаем bucket для чеков
-    create_receipts_bucket()
+    # Фоновая запись логов пачками
+    spawn(log_pipeline.run_writer())
     
-    # Создаем файл пользователей если его нет
-    if not os.path.exists("users.json"):
-        with open("users.json", 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-        print("✅ Файл users.json создан для рассылки")
+    # Загружаем реестр пользователей (один раз) и запускаем фоновое сохранение
+    local_started = time.perf_counter()
+    user_registry.load()
+    spawn(user_registry.run_flusher())
+    media_cache.load()
+    order_journal.prune()
+    backlog = len(order_journal.unsynced())
+    dead_orders = len(order_journal.dead())
+    startup_timings["локальные данные"] = time.perf_counter() - local_started
+    
+    # Сохранение корзин пользователей (хранилище закрывает сам диспетчер при остановке)
+    if isinstance(storage, SQLiteStorage):
+        spawn(storage.run_flusher())
+        print(f"🧺 Сроки корзин на шаге оплаты: {arm_checkout_timers()} шт. (очищаются через {format_duration(CHECKOUT_TTL)})")
+    print(f"🗂 FSM хранилище: {type(storage).__name__}")
+    
+    # Единственный шаг, который ждет Supabase до начала работы: без каталога нечего продавать
+    await timed_step("каталог", load_catalog())
+    spawn(run_catalog_refresher())
+    spawn(inventory.run_reconciler())
     
-    # Проверка подключений
     print("🔍 ПРОВЕРКА СИСТЕМЫ...")
     print(f"📊 Supabase: {'✅' if supabase_client else '❌'}")
-    print(f"☁️ Supabase Storage: ✅ Bucket 'receipts' создан")
-    print(f"📎 Хранение чеков: ✅ Облачное хранилище готово")
     print(f"📄 Поддержка PDF: ✅ Макс. размер {MAX_FILE_SIZE // (1024*1024)}MB")
     print(f"💳 Сбербанк: ✅ {SBER_ACCOUNT}")
-    print(f"🎫 Тарифы: {len(TARIFFS)} шт.")
-    print(f"🖼️ Картинка мероприятия: {'✅' if os.path.exists(EVENT_IMAGE_PATH) else '❌'}")
+    print(f"📒 Журнал заказов: {'✅ пуст' if not backlog else f'{backlog} заказов ждут отправки в Supabase'}")
+    if dead_orders:
+        print(f"☠️ Отложенных заказов в журнале (Supabase их отклонил): {dead_orders}")
+    print(f"🎉 Мероприятия: {len(catalog_snapshot.events)} шт. (каталог: {catalog_snapshot.source}, версия {catalog_snapshot.version})")
+    print(f"🎫 Тарифы: {len(catalog_snapshot.tariffs)} шт.")
+    for event in catalog_snapshot.events.values():
+        if event.image_path:
+            print(f"🖼️ Картинка «{event.title}»: {'✅' if os.path.exists(event.image_path) else '❌'}")
     print(f"👨‍💼 Админы: {len(ADMIN_IDS)} человек")
-    
-    # Показываем статистику пользователей
-    users = load_users()
-    print(f"👥 Пользователей для рассылки: {len(users)}")
-    
-    # Показываем статистику Supabase
-    stats = db.get_statistics()
-    print(f"📈 Supabase статистика: {stats['total_orders']} заказов, {stats['total_revenue']}₽ выручки")
+    print(f"👥 Пользователей для рассылки: {len(load_users())}")
+    if UPDATE_CAPTURE_PATH:
+        print(f"🎥 Запись апдейтов (обезличенных): {UPDATE_CAPTURE_PATH}")
     
     print("\n🎯 ОСНОВНЫЕ ФУНКЦИИ:")
     print("   • 🎫 Выбор мероприятия и тарифа")
@@ -2120,12 +5203,47 @@ async def main():
     print("   • 📢 РАССЫЛКА: автоматическое сохранение всех пользователей")
     print("=" * 70)
     
+    # Досылаем заказы из журнала, следим за сроками, загружаем чеки в Storage
+    spawn(order_journal.run_replayer())
+    spawn(scheduler.run())
+    receipt_archiver.start()
+    
+    # Продолжаем прерванную рассылку, если она была
+    resume_broadcast()
+    
+    # Проверки Supabase и прогрев кэшей идут параллельно с приемом обновлений
+    spawn(run_startup_checks())
+    spawn(run_supabase_health_check())
+    spawn(run_loop_lag_monitor())
+    if BOT_MODE != "webhook" and METRICS_PORT:
+        try:
+            await run_metrics_server()
+        except OSError as e:
+            print(f"⚠️ Не удалось поднять сервер метрик на порту {METRICS_PORT}: {e}")
+    print(f"⏱ До приема обновлений: {time.perf_counter() - started:.2f}с ({format_timings(['локальные данные', 'каталог'])})")
+
+async def shutdown():
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await bot.session.close()
+    await close_http_session()
+    user_registry.close()
+    adb.shutdown()
+    log_pipeline.close()
+
+async def main():
+    await startup()
+    
     try:
-        print("🟢 Бот начал работу...")
-        await dp.start_polling(bot)
+        print(f"🟢 Бот начал работу ({BOT_MODE})...")
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
     except Exception as e:
         print(f"🔴 КРИТИЧЕСКАЯ ОШИБКА: {e}")
     finally:
+        await shutdown()
         print("🟡 Бот остановлен")
 
 if __name__ == "__main__":
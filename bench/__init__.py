@@ -0,0 +1 @@
+"""Бенчмарки бота на локальных заглушках Telegram Bot API и Supabase (см. bench/run.py)"""
@@ -0,0 +1,380 @@
+"""Локальная замена Supabase (PostgREST + Storage) для бенчмарков
+
+Таблицы живут в памяти. Поддерживается то подмножество PostgREST, которым
+пользуется бот: фильтры eq/neq/lt/lte/gt/gte/in/is, not., or=(...) с вложенным
+and(...), order, limit/offset, select с проекцией колонок, Prefer count=exact,
+upsert с on_conflict и RPC order_statistics / active_order_counts. Таблицы, которых нет в схеме,
+отвечают 404, как несозданные таблицы в настоящем Supabase - тогда бот
+работает с каталогом по умолчанию. Колонки из missing_columns ведут себя как
+непримененная миграция: запись с ними отвечает PGRST204, чтение - 42703."""
+import asyncio
+import datetime
+import itertools
+import random
+from collections import Counter
+
+from aiohttp import web
+
+# Колонки orders, которые PostgREST вернул бы как null, если их не передали
+ORDER_DEFAULTS = {
+    "status": "pending",
+    "receipt_verified": False,
+    "event_id": None,
+    "receipt_file_id": None,
+    "receipt_file_type": None,
+    "receipt_file_unique_id": None,
+    "receipt_file_name": None,
+    "receipt_file_url": None,
+    "processing_status": None,
+    "processing_attempts": 0,
+    "client_ref": None
+}
+
+DEFAULT_TABLES = ("orders", "seat_holds")
+
+
+def now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def split_top_level(text, separator=","):
+    """Делит строку по разделителю вне скобок и кавычек"""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == separator and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def unquote(value):
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def coerce(value, sample):
+    """Приводит значение из запроса к типу значения в строке таблицы"""
+    if value == "null":
+        return None
+    if isinstance(sample, bool):
+        # postgrest-py пишет eq.True, Postgres принимает булевы значения без учета регистра
+        return value.lower() == "true"
+    if isinstance(sample, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(sample, float):
+        return float(value)
+    return value
+
+
+def matches(row, column, op, value):
+    negate = op.startswith("not.")
+    if negate:
+        op, value = (op[4:] + "." + value).split(".", 1)
+    actual = row.get(column)
+    if op == "in":
+        options = [coerce(unquote(item), actual) for item in split_top_level(value[1:-1])]
+        result = actual in options
+    elif op == "is":
+        result = actual is None if value == "null" else actual == (value.lower() == "true")
+    else:
+        expected = coerce(unquote(value), actual)
+        if op == "eq":
+            result = actual == expected
+        elif op == "neq":
+            result = actual != expected
+        elif actual is None or expected is None:
+            result = False
+        else:
+            result = {
+                "lt": actual < expected, "lte": actual <= expected,
+                "gt": actual > expected, "gte": actual >= expected
+            }[op]
+    return not result if negate else result
+
+
+def condition(expression):
+    """Условие из or=(...): col.op.value, and(...) или or(...) -> функция от строки"""
+    for group, combine in (("and(", all), ("or(", any)):
+        if expression.startswith(group):
+            inner = [condition(part) for part in split_top_level(expression[len(group):-1])]
+            return lambda row: combine(check(row) for check in inner)
+    column, rest = expression.split(".", 1)
+    if rest.startswith("not."):
+        op, value = rest[4:].split(".", 1)
+        op = "not." + op
+    else:
+        op, value = rest.split(".", 1)
+    return lambda row: matches(row, column, op, value)
+
+
+class FakeSupabase:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, tables=DEFAULT_TABLES, seed=None,
+                 missing_columns=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.tables = {name: [] for name in tables}
+        self.missing_columns = missing_columns or {}  # {таблица: колонки, которых "нет" в схеме}
+        self.ids = {name: itertools.count(1) for name in tables}
+        self.buckets = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self.runner = None
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024, middlewares=[self.middleware])
+        app.router.add_post("/rest/v1/rpc/{function}", self.handle_rpc)
+        app.router.add_route("*", "/rest/v1/{table}", self.handle_table)
+        app.router.add_get("/storage/v1/bucket", self.list_buckets)
+        app.router.add_post("/storage/v1/bucket", self.create_bucket)
+        app.router.add_post("/storage/v1/object/list/{bucket}", self.list_objects)
+        app.router.add_get("/storage/v1/object/public/{bucket}/{name:.+}", self.download)
+        app.router.add_get("/storage/v1/object/{bucket}/{name:.+}", self.download)
+        app.router.add_route("*", "/storage/v1/object/{bucket}/{name:.+}", self.upload)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def snapshot(self):
+        return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        route = "storage" if request.path.startswith("/storage") else request.match_info.get("table") or "rpc"
+        key = f"{request.method} {route}"
+        self.calls[key] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[key] += 1
+            return web.json_response({"code": "XX000", "message": "fake error", "details": None, "hint": None}, status=500)
+        return await handler(request)
+
+    # ТАБЛИЦЫ
+    def seed(self, table, rows):
+        """Добавляет строки в таблицу (создает ее, если ее не было)"""
+        self.tables.setdefault(table, [])
+        self.ids.setdefault(table, itertools.count(1))
+        for row in rows:
+            self.insert_row(table, dict(row))
+
+    def insert_row(self, table, row):
+        if table == "orders":
+            row = {**ORDER_DEFAULTS, **row}
+            row["participants_count"] = len(row.get("participants") or [])
+            for column in self.missing_columns.get(table, ()):
+                row.pop(column, None)
+        if table != "seat_holds":
+            row.setdefault("id", next(self.ids[table]))
+        row.setdefault("created_at", now_iso())
+        self.tables[table].append(row)
+        return row
+
+    def filtered(self, table, query):
+        rows = self.tables[table]
+        for key, value in query.items():
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key == "or":
+                check = condition(f"or{value}")
+            elif key == "and":
+                check = condition(f"and{value}")
+            else:
+                op, _, operand = value.partition(".")
+                if op == "not":
+                    op2, _, operand = operand.partition(".")
+                    op = f"not.{op2}"
+                check = (lambda column, op, operand: lambda row: matches(row, column, op, operand))(key, op, operand)
+            rows = [row for row in rows if check(row)]
+        return rows
+
+    @staticmethod
+    def ordered(rows, query):
+        for item in reversed(",".join(query.getall("order", [])).split(",")):
+            if not item:
+                continue
+            column, *flags = item.split(".")
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            present.sort(key=lambda row: row[column], reverse="desc" in flags)
+            rows = missing + present if "nullsfirst" in flags else present + missing
+        return rows
+
+    @staticmethod
+    def projected(rows, query):
+        columns = [column.strip() for column in query.get("select", "*").split(",")]
+        if "*" in columns:
+            return [dict(row) for row in rows]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def schema_error(self, table, query, body=()):
+        """Ответ PostgREST на колонку, которой нет в таблице (None - все колонки есть)"""
+        missing = self.missing_columns.get(table, ())
+        for row in body:
+            column = next((column for column in row if column in missing), None)
+            if column:
+                return web.json_response({"code": "PGRST204", "details": None, "hint": None,
+                                          "message": f"Could not find the '{column}' column of '{table}' in the schema cache"},
+                                         status=400)
+        read = [column.strip() for column in query.get("select", "*").split(",")]
+        read += [key for key in query if key not in ("select", "order", "limit", "offset", "on_conflict", "columns", "or", "and")]
+        read += [item.split(".")[0] for item in ",".join(query.getall("order", [])).split(",")]
+        read += [query["on_conflict"]] if "on_conflict" in query else []
+        column = next((column for column in read if column in missing), None)
+        if column:
+            return web.json_response({"code": "42703", "message": f"column {table}.{column} does not exist",
+                                      "details": None, "hint": None}, status=400)
+        return None
+
+    @staticmethod
+    def prefer(request):
+        return {part.strip() for part in request.headers.get("Prefer", "").split(",") if part.strip()}
+
+    async def handle_table(self, request):
+        table = request.match_info["table"]
+        if table not in self.tables:
+            return web.json_response({"code": "42P01", "message": f'relation "public.{table}" does not exist',
+                                      "details": None, "hint": None}, status=404)
+        query = request.query
+        prefer = self.prefer(request)
+        body = None
+        if request.method in ("POST", "PATCH"):
+            body = await request.json()
+        rows_in = (body if isinstance(body, list) else [body]) if body is not None else []
+        error = self.schema_error(table, query, rows_in)
+        if error is not None:
+            return error
+
+        if request.method in ("GET", "HEAD"):
+            rows = self.ordered(self.filtered(table, query), query)
+            total = len(rows)
+            offset = int(query.get("offset", 0))
+            if "limit" in query:
+                rows = rows[offset:offset + int(query["limit"])]
+            else:
+                rows = rows[offset:]
+            headers = {}
+            if "count=exact" in prefer:
+                headers["Content-Range"] = f"{offset}-{offset + len(rows) - 1 if rows else '*'}/{total}"
+            return web.json_response(self.projected(rows, query), headers=headers)
+
+        if request.method == "POST":
+            rows = rows_in
+            conflict = query.get("on_conflict")
+            created = []
+            for row in rows:
+                existing = None
+                if conflict and row.get(conflict) is not None:
+                    existing = next((r for r in self.tables[table] if r.get(conflict) == row[conflict]), None)
+                if existing is not None:
+                    if "resolution=merge-duplicates" in prefer:
+                        existing.update(row)
+                        created.append(existing)
+                    continue
+                created.append(self.insert_row(table, dict(row)))
+            return web.json_response(self.projected(created, query), status=201)
+
+        if request.method == "PATCH":
+            rows = self.filtered(table, query)
+            for row in rows:
+                row.update(body)
+            return web.json_response(self.projected(rows, query))
+
+        if request.method == "DELETE":
+            rows = self.filtered(table, query)
+            self.tables[table] = [row for row in self.tables[table] if row not in rows]
+            return web.json_response(self.projected(rows, query))
+
+        return web.json_response({"message": "method not allowed"}, status=405)
+
+    async def handle_rpc(self, request):
+        function = request.match_info["function"]
+        params = await request.json() if request.can_read_body else {}
+        if function == "order_statistics" and "orders" in self.tables:
+            return web.json_response(self.order_statistics(params.get("day_start"), params.get("day_end")))
+        if function == "active_order_counts" and "orders" in self.tables:
+            return web.json_response(self.active_order_counts())
+        return web.json_response({"code": "PGRST202", "message": f"Could not find the function public.{function}",
+                                  "details": None, "hint": None}, status=404)
+
+    def active_order_counts(self):
+        active = {event["id"] for event in self.tables.get("events", []) if event.get("is_active")}
+        counts = Counter((order.get("event_id"), order["tariff"]) for order in self.tables["orders"]
+                         if order["status"] not in ("canceled", "expired")
+                         and (order.get("event_id") is None or order.get("event_id") in active))
+        return [{"event_id": event_id, "tariff": tariff, "orders": count} for (event_id, tariff), count in counts.items()]
+
+    def order_statistics(self, day_start, day_end):
+        orders = self.tables["orders"]
+        paid = [order for order in orders if order["status"] == "paid"]
+        today = [order for order in orders if day_start and day_start <= order["created_at"] < day_end]
+        return {
+            "total_orders": len(orders),
+            "paid_orders": len(paid),
+            "pending_orders": sum(order["status"] == "pending" for order in orders),
+            "total_revenue": sum(order["total_price"] for order in paid),
+            "unique_users": len({order["user_id"] for order in orders}),
+            "today_orders": len(today),
+            "today_revenue": sum(order["total_price"] for order in today if order["status"] == "paid")
+        }
+
+    # STORAGE
+    def bucket_info(self, name):
+        return {"id": name, "name": name, "owner": "", "public": True, "created_at": now_iso(), "updated_at": now_iso(),
+                "file_size_limit": None, "allowed_mime_types": None}
+
+    async def list_buckets(self, request):
+        return web.json_response([self.bucket_info(name) for name in self.buckets])
+
+    async def create_bucket(self, request):
+        body = await request.json()
+        self.buckets.setdefault(body.get("id") or body.get("name"), {})
+        return web.json_response({"name": body.get("name")})
+
+    async def upload(self, request):
+        if request.method not in ("POST", "PUT"):
+            return web.json_response({"message": "method not allowed"}, status=405)
+        bucket = self.buckets.setdefault(request.match_info["bucket"], {})
+        data = await request.read()
+        bucket[request.match_info["name"]] = (data, request.headers.get("Content-Type", "application/octet-stream"))
+        return web.json_response({"Key": f"{request.match_info['bucket']}/{request.match_info['name']}"})
+
+    async def download(self, request):
+        stored = self.buckets.get(request.match_info["bucket"], {}).get(request.match_info["name"])
+        if stored is None:
+            return web.json_response({"statusCode": "404", "error": "not_found", "message": "Object not found"}, status=400)
+        data, content_type = stored
+        return web.Response(body=data, content_type=content_type)
+
+    async def list_objects(self, request):
+        body = await request.json()
+        search = body.get("search") or ""
+        names = sorted(name for name in self.buckets.get(request.match_info["bucket"], {}) if name.startswith(search))
+        offset, limit = body.get("offset", 0), body.get("limit", 100)
+        files = self.buckets.get(request.match_info["bucket"], {})
+        return web.json_response([
+            {"name": name, "id": name, "metadata": {"size": len(files[name][0]), "mimetype": files[name][1]}}
+            for name in names[offset:offset + limit]
+        ])
@@ -0,0 +1,110 @@
+"""Локальная замена Telegram Bot API для бенчмарков
+
+Отвечает на вызовы бота правдоподобными объектами (Message, File, True), считает
+вызовы по методам и умеет добавлять задержку и ошибки. Бот подключается к нему
+через TELEGRAM_API_URL."""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Методы, которые в ответ возвращают сообщение
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"
+}
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, file_size=200 * 1024, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.file_size = file_size
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.message_ids = itertools.count(1)
+        self.runner = None
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def snapshot(self):
+        return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    async def handle_method(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        await self.delay()
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[method] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error (fake)"}, status=500)
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    async def handle_file(self, request):
+        self.calls["file"] += 1
+        await self.delay()
+        return web.Response(body=b"%PDF-1.4 " + b"0" * max(self.file_size - 9, 0), content_type="application/pdf")
+
+    def result(self, method, params):
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {"file_id": file_id, "file_unique_id": f"u_{file_id}", "file_size": self.file_size,
+                    "file_path": f"documents/{file_id}.pdf"}
+        if method == "getUpdates":
+            return []
+        if method in MESSAGE_METHODS:
+            return self.message(method, params)
+        # answerCallbackQuery, deleteMessage, setWebhook и прочие
+        return True
+
+    def message(self, method, params):
+        chat_id = params.get("chat_id", "0")
+        message_id = params.get("message_id")
+        message = {
+            "message_id": int(message_id) if message_id else next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "Bench"}
+        }
+        media_type = method
+        if method == "editMessageMedia":
+            media_type = "send" + json.loads(params.get("media", "{}")).get("type", "").capitalize()
+        if media_type == "sendPhoto":
+            file_id = f"photo_{message['message_id']}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": f"u_{file_id}", "width": 1280, "height": 720}]
+        elif media_type == "sendDocument":
+            file_id = f"doc_{message['message_id']}"
+            message["document"] = {"file_id": file_id, "file_unique_id": f"u_{file_id}", "file_name": "receipt.pdf"}
+        elif "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
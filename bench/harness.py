@@ -0,0 +1,202 @@
+"""Стенд для прогона настоящих обработчиков бота без сети
+
+Поднимает FakeTelegram и FakeSupabase, направляет на них бота через
+TELEGRAM_API_URL / SUPABASE_URL, импортирует Gedan_bot во временном каталоге
+(users.json, bot_state.db, логи и журнал рассылки не трогают рабочие файлы)
+и подает апдейты прямо в dp.feed_update. Вывод бота уходит в лог-файл, чтобы
+print в обработчиках не искажал замеры и отчет."""
+import importlib
+import itertools
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench.fake_supabase import FakeSupabase
+from bench.fake_telegram import FakeTelegram
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = "123456:BENCH-TOKEN"
+# supabase-py проверяет, что ключ похож на JWT
+BENCH_SUPABASE_KEY = "bench.bench.bench"
+
+
+def percentile(values, q):
+    """Перцентиль методом ближайшего ранга; None для пустого списка"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """Сводка замеров: задержки в мс и обработанные апдейты в секунду"""
+    return {
+        "updates": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        "updates_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None
+    }
+
+
+class Harness:
+    def __init__(self, telegram_latency=0.0, supabase_latency=0.0, jitter=0.0, error_rate=0.0,
+                 log_path=os.devnull, env=None, seed=None):
+        self.telegram = FakeTelegram(telegram_latency, jitter, error_rate, seed=seed)
+        self.supabase = FakeSupabase(supabase_latency, jitter, error_rate, seed=seed)
+        self.log_path = log_path
+        self.env = env or {}
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.console = sys.stdout
+        self.workdir = None
+        self.log = None
+        self.g = None
+
+    def say(self, text=""):
+        """Печать в консоль (stdout бота перенаправлен в лог)"""
+        print(text, file=self.console, flush=True)
+
+    async def start(self):
+        await self.telegram.start()
+        await self.supabase.start()
+
+        self.workdir = tempfile.mkdtemp(prefix="gedan-bench-")
+        shutil.copy(os.path.join(REPO_ROOT, "event_image.jpg"), self.workdir)
+        os.environ.update({
+            "BOT_TOKEN": BENCH_TOKEN,
+            "TELEGRAM_API_URL": self.telegram.url,
+            "SUPABASE_URL": self.supabase.url,
+            "SUPABASE_KEY": BENCH_SUPABASE_KEY,
+            "BOT_MODE": "polling",
+            "FSM_STORAGE": "memory",
+            "LOG_CONSOLE": "0",
+            **self.env
+        })
+        os.chdir(self.workdir)
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+
+        self.log = open(self.log_path, "w", encoding="utf-8")
+        sys.stdout = self.log
+        self.g = importlib.import_module("Gedan_bot")
+        await self.g.startup()
+        # Пользователь-бот для сообщений, которые «отправил» бот
+        self.bot_user = {"id": self.g.bot.id, "is_bot": True, "first_name": "Bench"}
+        return self
+
+    async def close(self):
+        try:
+            if self.g:
+                await self.g.shutdown()
+        finally:
+            sys.stdout = self.console
+            if self.log:
+                self.log.close()
+            await self.telegram.stop()
+            await self.supabase.stop()
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    @property
+    def bot(self):
+        return self.g.bot
+
+    @property
+    def dp(self):
+        return self.g.dp
+
+    def outbound_calls(self):
+        """Сколько запросов бот сделал к Telegram и Supabase на данный момент"""
+        return sum(self.telegram.calls.values()), sum(self.supabase.calls.values())
+
+    # АПДЕЙТЫ
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+
+    def validate(self, data):
+        return self.g.types.Update.model_validate(data, context={"bot": self.bot})
+
+    def message_update(self, user_id, text=None, document=None, photo=None):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id)
+        }
+        if text is not None:
+            message["text"] = text
+        if document is not None:
+            message["document"] = document
+        if photo is not None:
+            message["photo"] = photo
+        return self.validate({"update_id": next(self.update_ids), "message": message})
+
+    def callback_update(self, user_id, data, message_id=None):
+        message = {
+            "message_id": message_id or next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.bot_user,
+            "text": "bench"
+        }
+        callback = {
+            "id": str(next(self.update_ids)),
+            "from": self.user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": message
+        }
+        return self.validate({"update_id": next(self.update_ids), "callback_query": callback})
+
+    def receipt_document(self, user_id, size=120 * 1024):
+        file_id = f"receipt_{user_id}_{next(self.message_ids)}"
+        return {"file_id": file_id, "file_unique_id": f"u_{file_id}", "file_name": "receipt.pdf",
+                "mime_type": "application/pdf", "file_size": size}
+
+    def state(self, user_id):
+        return self.dp.fsm.get_context(bot=self.bot, chat_id=user_id, user_id=user_id)
+
+    async def feed(self, update):
+        """Обрабатывает апдейт; возвращает (длительность, успех)"""
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+            return time.perf_counter() - started, True
+        except Exception as e:
+            print(f"🔴 Необработанная ошибка в бенчмарке: {e}")
+            return time.perf_counter() - started, False
+
+    # ДАННЫЕ ДЛЯ СЦЕНАРИЕВ
+    def tariff(self, people=1):
+        """Первый тариф каталога на нужное число участников"""
+        for view in self.g.catalog_snapshot.tariffs.values():
+            if view.min_people == people:
+                return view
+        return next(iter(self.g.catalog_snapshot.tariffs.values()))
+
+    @staticmethod
+    def participants_text(count):
+        return "\n".join(f"Участник{i} Бенчмарк Тестович, @bench{i}, 7999000{i:04d}" for i in range(count))
+
+    def seed_pending_orders(self, count, start_user=10_000_000):
+        tariff = self.tariff()
+        self.supabase.seed("orders", [{
+            "user_id": start_user + i,
+            "username": f"bench{start_user + i}",
+            "tariff": tariff.name,
+            "participants": [{"full_name": "Бенчмарк Тестович", "telegram": "@bench", "phone": "79990000000"}],
+            "total_price": tariff.total,
+            "status": "pending",
+            "receipt_file_id": f"seed_receipt_{i}",
+            "receipt_file_type": "document"
+        } for i in range(count)])
+
+    def seed_users(self, count, start_user=20_000_000):
+        for i in range(count):
+            self.g.user_registry.touch(start_user + i)
@@ -0,0 +1,268 @@
+"""Нагрузочный тест: тысячи синтетических покупателей проходят всю воронку заказа
+
+Каждый пользователь, как при старте продаж, проходит весь путь через dp.feed_update:
+🚀 Старт → show_tariffs → accept_rules → tariff_type_* → tariff_* → данные участников →
+proceed_to_payment → чек PDF. Между шагами он «думает» (экспоненциальное время со
+средним --think-ms) и с вероятностью --abandon уходит из воронки. Пользователи
+приходят равномерно за --ramp секунд.
+
+Нагрузка растет по уровням (--levels). Для каждого уровня печатаются:
+- задержка очереди: сколько апдейт ждал начала обработки после момента прихода
+  (занятый event loop или все --workers заняты);
+- задержка обработчика;
+- доля ошибок и пропускная способность.
+
+Точка насыщения - первый уровень, на котором пропускная способность перестала
+расти, p95 обработчика вышел за --slo-ms или ошибок больше --max-error-rate.
+
+Запуск из корня репозитория:
+    python -m bench.load
+    python -m bench.load --levels 500,1000,2000,4000 --think-ms 500 --abandon 0.1
+    python -m bench.load --workers 50 --telegram-latency 40 --supabase-latency 25
+    python -m bench.load --save bench/load.json"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import time
+from collections import Counter, defaultdict
+
+from bench.harness import Harness, percentile
+from bench.run import git_revision, wait_background
+
+STEPS = ("start", "show_tariffs", "accept_rules", "tariff_type", "tariff", "participants", "payment", "receipt")
+
+
+class Checkout:
+    """Один синтетический покупатель: строит апдейты шагов и знает, куда шаг должен привести"""
+    def __init__(self, h, user_id, rng):
+        self.h = h
+        self.user_id = user_id
+        self.rng = rng
+        self.event = None
+        self.group = None
+        self.tariff = None
+
+    def build(self, step):
+        """Апдейт шага и ожидаемое состояние FSM после него (None - проверять нечего)"""
+        h, g = self.h, self.h.g
+        if step == "start":
+            self.event = g.catalog_snapshot.event()
+            return h.message_update(self.user_id, "🚀 Старт"), None
+        if step == "show_tariffs":
+            return h.callback_update(self.user_id, f"show_tariffs_{self.event.id}"), g.OrderStates.waiting_for_rules_confirmation
+        if step == "accept_rules":
+            return h.callback_update(self.user_id, "accept_rules"), g.OrderStates.waiting_for_tariff
+        if step == "tariff_type":
+            # Пользователь видит только группы, в которых остались места
+            self.group = self.rng.choice(list(g.inventory.catalog(self.event).group_markups))
+            return h.callback_update(self.user_id, f"tariff_type_{self.group}"), g.OrderStates.waiting_for_tariff
+        if step == "tariff":
+            markup = g.inventory.catalog(self.event).group_markups.get(self.group)
+            keys = [button.callback_data.replace("tariff_", "", 1) for row in markup.inline_keyboard for button in row
+                    if button.callback_data.startswith("tariff_")] if markup else []
+            self.tariff = g.catalog_snapshot.tariffs.get(self.rng.choice(keys)) if keys else None
+            key = self.tariff.key if self.tariff else "sold_out"
+            return h.callback_update(self.user_id, f"tariff_{key}"), g.OrderStates.waiting_for_participants
+        if step == "participants":
+            return h.message_update(self.user_id, h.participants_text(self.tariff.min_people)), g.OrderStates.waiting_for_payment
+        if step == "payment":
+            return h.callback_update(self.user_id, "proceed_to_payment"), g.OrderStates.waiting_for_receipt
+        if step == "receipt":
+            return h.message_update(self.user_id, document=h.receipt_document(self.user_id)), None
+        raise ValueError(f"неизвестный шаг {step}")
+
+
+class LevelStats:
+    def __init__(self, users):
+        self.users = users
+        self.queue = []
+        self.handler = []
+        self.steps = defaultdict(list)
+        self.outcomes = Counter()
+        self.errors = 0
+        self.stuck = 0
+
+    def report(self, elapsed, telegram_calls, supabase_calls, injected_errors):
+        updates = len(self.handler)
+
+        def ms(values, q):
+            value = percentile(values, q)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "users": self.users,
+            "updates": updates,
+            "updates_per_sec": round(updates / elapsed, 1) if elapsed else None,
+            "queue_p50_ms": ms(self.queue, 50),
+            "queue_p95_ms": ms(self.queue, 95),
+            "queue_p99_ms": ms(self.queue, 99),
+            "handler_p50_ms": ms(self.handler, 50),
+            "handler_p95_ms": ms(self.handler, 95),
+            "handler_p99_ms": ms(self.handler, 99),
+            "errors": self.errors,
+            "stuck": self.stuck,
+            "error_rate": round((self.errors + self.stuck) / updates, 4) if updates else 0,
+            "injected_errors": injected_errors,
+            "completed": self.outcomes["completed"],
+            "abandoned": self.outcomes["abandoned"],
+            "failed": self.outcomes["failed"],
+            "telegram_calls_per_update": round(telegram_calls / max(updates, 1), 2),
+            "supabase_calls_per_update": round(supabase_calls / max(updates, 1), 2),
+            "elapsed_sec": round(elapsed, 2),
+            "steps": {step: {"p50_ms": ms(values, 50), "p95_ms": ms(values, 95), "count": len(values)}
+                      for step, values in self.steps.items()}
+        }
+
+
+async def walk(h, checkout, arrival, stats, slots, args):
+    """Проводит пользователя по воронке; arrival - когда должен прийти первый апдейт"""
+    state = h.state(checkout.user_id)
+    for index, step in enumerate(STEPS):
+        if index and checkout.rng.random() < args.abandon:
+            stats.outcomes["abandoned"] += 1
+            return
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        update, expected = checkout.build(step)
+        async with slots or contextlib.nullcontext():
+            # Задержка очереди: от момента прихода апдейта до начала обработки
+            stats.queue.append(max(0.0, time.perf_counter() - arrival))
+            elapsed, ok = await h.feed(update)
+        stats.handler.append(elapsed)
+        stats.steps[step].append(elapsed)
+        if not ok:
+            stats.errors += 1
+            stats.outcomes["failed"] += 1
+            return
+        if expected is not None and await state.get_state() != expected.state:
+            # Обработчик ответил ошибкой или «мест нет» - дальше по воронке не пройти
+            stats.stuck += 1
+            stats.outcomes["failed"] += 1
+            return
+        think = checkout.rng.expovariate(1000 / args.think_ms) if args.think_ms else 0.0
+        arrival = time.perf_counter() + think
+    stats.outcomes["completed"] += 1
+
+
+async def run_level(h, users, user_base, rng, args):
+    stats = LevelStats(users)
+    slots = asyncio.Semaphore(args.workers) if args.workers else None
+    telegram_before, supabase_before = h.outbound_calls()
+    injected_before = sum(h.telegram.errors.values()) + sum(h.supabase.errors.values())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        walk(h, Checkout(h, user_base + i, random.Random(rng.random())),
+             started + rng.uniform(0, args.ramp), stats, slots, args)
+        for i in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+    await wait_background(h)
+
+    telegram_after, supabase_after = h.outbound_calls()
+    injected = sum(h.telegram.errors.values()) + sum(h.supabase.errors.values()) - injected_before
+    return stats.report(elapsed, telegram_after - telegram_before, supabase_after - supabase_before, injected)
+
+
+def saturation_reason(previous, current, args):
+    """Почему уровень считается точкой насыщения (None - еще не насыщен)"""
+    if current["handler_p95_ms"] is not None and current["handler_p95_ms"] > args.slo_ms:
+        return f"p95 обработчика {current['handler_p95_ms']} мс > {args.slo_ms} мс"
+    if current["error_rate"] > args.max_error_rate:
+        return f"ошибок {current['error_rate']:.1%} > {args.max_error_rate:.1%}"
+    if previous and previous["updates_per_sec"] and current["users"] > previous["users"]:
+        growth = current["updates_per_sec"] / previous["updates_per_sec"] - 1
+        if growth < args.min_growth:
+            return f"пропускная способность выросла на {growth:.0%} при росте нагрузки"
+    return None
+
+
+async def run(args):
+    env = {"BROADCAST_RATE": "1000"}
+    h = Harness(args.telegram_latency / 1000, args.supabase_latency / 1000, args.jitter / 1000,
+                args.error_rate, log_path=args.log, env=env, seed=args.seed)
+    await h.start()
+    rng = random.Random(args.seed)
+    levels = [int(level) for level in args.levels.split(",") if level]
+    results, saturation = [], None
+    try:
+        h.say(f"🏁 Нагрузка: уровни {', '.join(map(str, levels))} пользователей, приход за {args.ramp}с, "
+              f"раздумье ~{args.think_ms} мс, уход {args.abandon:.0%} на шаге, "
+              f"обработчиков {args.workers or 'без ограничения'}")
+        h.say(f"{'польз.':>7}{'апд/с':>9}{'оч.p50':>9}{'оч.p95':>9}{'обр.p50':>9}{'обр.p95':>9}{'обр.p99':>9}"
+              f"{'ошибки':>8}{'дошли':>7}{'ушли':>7}{'сбой':>6}")
+        for index, users in enumerate(levels):
+            result = await run_level(h, users, 30_000_000 + index * 1_000_000, rng, args)
+            results.append(result)
+            h.say(f"{users:>7}{result['updates_per_sec']:>9}{result['queue_p50_ms']:>9}{result['queue_p95_ms']:>9}"
+                  f"{result['handler_p50_ms']:>9}{result['handler_p95_ms']:>9}{result['handler_p99_ms']:>9}"
+                  f"{result['error_rate']:>8.1%}{result['completed']:>7}{result['abandoned']:>7}{result['failed']:>6}")
+            reason = saturation_reason(results[-2] if len(results) > 1 else None, result, args)
+            if reason and saturation is None:
+                saturation = {"users": users, "reason": reason}
+                if args.stop_at_saturation:
+                    break
+
+        busiest = results[-1] if results else None
+        if busiest:
+            h.say(f"\n🔎 Шаги воронки на уровне {busiest['users']}:")
+            h.say(f"{'шаг':<16}{'p50':>9}{'p95':>9}{'апдейтов':>10}")
+            for step in STEPS:
+                data = busiest["steps"].get(step)
+                if data:
+                    h.say(f"{step:<16}{data['p50_ms']:>9}{data['p95_ms']:>9}{data['count']:>10}")
+        if saturation:
+            h.say(f"\n🧱 Насыщение на {saturation['users']} пользователях: {saturation['reason']}")
+        else:
+            h.say("\n✅ Насыщение не достигнуто - добавьте уровней")
+    finally:
+        await h.close()
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("log", "save")},
+        "levels": results,
+        "saturation": saturation
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        h.say(f"\n💾 Результаты сохранены: {args.save}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест воронки заказа на локальных заглушках")
+    parser.add_argument("--levels", default="100,200,400,800,1600", help="число пользователей на уровнях через запятую")
+    parser.add_argument("--ramp", type=float, default=2, help="за сколько секунд приходят пользователи уровня")
+    parser.add_argument("--think-ms", type=float, default=300, help="среднее время раздумья между шагами, мс")
+    parser.add_argument("--abandon", type=float, default=0.05, help="вероятность уйти перед каждым следующим шагом")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="одновременно обрабатываемых апдейтов (0 - без ограничения, как polling aiogram)")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="порог p95 обработчика для точки насыщения, мс")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="порог доли ошибок для точки насыщения")
+    parser.add_argument("--min-growth", type=float, default=0.1,
+                        help="насыщение, если пропускная способность выросла меньше этой доли")
+    parser.add_argument("--stop-at-saturation", action="store_true", help="не прогонять уровни после насыщения")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--supabase-latency", type=float, default=0, help="задержка ответа Supabase, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов заглушек с ошибкой 500")
+    parser.add_argument("--seed", type=int, default=1, help="seed для пользователей, задержек и ошибок заглушек")
+    parser.add_argument("--log", default=os.devnull, help="куда писать вывод бота (по умолчанию - никуда)")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+    for path in ("log", "save"):
+        if getattr(args, path) and getattr(args, path) != os.devnull:
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,243 @@
+"""Воспроизведение записанного трафика на локальных заглушках
+
+Бот пишет обезличенные апдейты, если задан UPDATE_CAPTURE_PATH (строки
+{"t": время прихода, "u": апдейт}; при ротации логов - еще и .gz архивы).
+Этот скрипт подает их в dp.feed_update с исходными паузами (--speed 1),
+ускоренно (--speed 10) или без пауз (--speed 0), сохраняя порядок апдейтов
+каждого пользователя, и считает задержку по обработчикам и исходящие запросы
+к Telegram и Supabase по методам.
+
+Запуск из корня репозитория:
+    python -m bench.replay updates.jsonl updates.jsonl.*.gz --speed 20
+    python -m bench.replay updates.jsonl --speed 0 --save bench/replay_before.json
+    python -m bench.replay updates.jsonl --speed 0 --compare bench/replay_before.json
+
+Каталог берется из заглушки Supabase (мероприятие по умолчанию): callback'и тарифов
+записанных из Supabase-каталога ответят «тариф недоступен»."""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import platform
+import time
+from collections import Counter, defaultdict
+
+from bench.harness import Harness, summarize
+from bench.run import git_revision, wait_background
+
+
+def read_records(paths, limit=None):
+    """Записи из всех файлов по времени прихода; битые строки пропускаются"""
+    records, skipped = [], 0
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records.append((float(record["t"]), record["u"]))
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+    records.sort(key=lambda record: record[0])
+    return records[:limit] if limit else records, skipped
+
+
+def schedule(records, speed, max_gap):
+    """Смещение каждого апдейта от начала воспроизведения, сек (простои длиннее max_gap сжимаются)"""
+    offsets, offset, previous = [], 0.0, None
+    for t, _ in records:
+        if previous is not None and speed:
+            offset += min(t - previous, max_gap) / speed
+        offsets.append(offset)
+        previous = t
+    return offsets
+
+
+async def replay(h, records, args):
+    handler_names = {}
+
+    async def remember_handler(handler, event, data):
+        # Внутренний middleware видит, какой обработчик выбран для апдейта
+        handler_names[data["event_update"].update_id] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+    for observer in (h.dp.message, h.dp.callback_query, h.dp.edited_message):
+        observer.middleware(remember_handler)
+
+    latencies, lags = defaultdict(list), []
+    errors = Counter()
+    slots = asyncio.Semaphore(args.concurrency) if not args.speed else None
+    telegram_before, supabase_before = Counter(h.telegram.calls), Counter(h.supabase.calls)
+
+    async def one(update, due, previous):
+        # Апдейты одного пользователя идут по порядку: в записи следующий пришел после ответа на предыдущий
+        if previous is not None:
+            await asyncio.wait([previous])
+        if slots:
+            await slots.acquire()
+        try:
+            lags.append(max(0.0, time.perf_counter() - due))
+            elapsed, ok = await h.feed(update)
+        finally:
+            if slots:
+                slots.release()
+        name = handler_names.pop(update.update_id, f"без обработчика ({update.event_type})")
+        latencies[name].append(elapsed)
+        errors[name] += not ok
+
+    offsets = schedule(records, args.speed, args.max_gap)
+    tasks, last_by_user, invalid = [], {}, 0
+    started = time.perf_counter()
+    for (_, data), offset in zip(records, offsets):
+        due = started + offset
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        try:
+            update = h.validate(data)
+        except Exception:
+            invalid += 1
+            continue
+        user = getattr(update.event, "from_user", None)
+        key = user.id if user else None
+        task = asyncio.create_task(one(update, due, last_by_user.get(key)))
+        if key is not None:
+            last_by_user[key] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await wait_background(h)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total = summarize(all_latencies, sum(errors.values()), elapsed)
+    total["invalid"] = invalid
+    total["lag_p95_ms"] = summarize(lags, 0, elapsed)["p95_ms"]
+    return {
+        "total": total,
+        "handlers": {name: summarize(values, errors[name], elapsed)
+                     for name, values in sorted(latencies.items(), key=lambda item: -len(item[1]))},
+        "outbound": {
+            "telegram": dict(Counter(h.telegram.calls) - telegram_before),
+            "supabase": dict(Counter(h.supabase.calls) - supabase_before)
+        }
+    }
+
+
+def print_report(h, report):
+    total = report["total"]
+    h.say(f"{'обработчик':<34}{'апд.':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'ошибки':>8}")
+    for name, result in report["handlers"].items():
+        h.say(f"{name[:33]:<34}{result['updates']:>7}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+              f"{result['p99_ms']:>9}{result['errors']:>8}")
+    h.say(f"{'ВСЕГО':<34}{total['updates']:>7}{total['p50_ms']:>9}{total['p95_ms']:>9}"
+          f"{total['p99_ms']:>9}{total['errors']:>8}")
+    h.say(f"\n⏩ {total['updates_per_sec']} апд/с, отставание от расписания p95 {total['lag_p95_ms']} мс, "
+          f"непрочитанных апдейтов: {total['invalid']}")
+    for service, calls in report["outbound"].items():
+        if calls:
+            h.say(f"📤 {service}: " + ", ".join(f"{method} {count}" for method, count in sorted(calls.items())))
+
+
+def compare(h, current, baseline):
+    """Разница задержек по обработчикам и исходящих запросов с базовой линией"""
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "-"
+
+    h.say("\n📊 Сравнение с базовой линией "
+          f"({baseline.get('git_revision') or '?'}, {baseline.get('created_at', '?')[:16]}):")
+    h.say(f"{'обработчик':<34}{'метрика':<10}{'было':>10}{'стало':>10}{'изм.':>9}")
+    rows = list(current["handlers"].items()) + [("ВСЕГО", current["total"])]
+    before_rows = {**baseline.get("handlers", {}), "ВСЕГО": baseline.get("total", {})}
+    for name, result in rows:
+        before = before_rows.get(name)
+        if not before:
+            h.say(f"{name[:33]:<34}{'новый':<10}")
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(metric), result.get(metric)
+            if old is not None and new is not None:
+                h.say(f"{name[:33]:<34}{metric:<10}{old:>10}{new:>10}{change(old, new):>9}")
+
+    h.say(f"\n{'запрос':<44}{'было':>10}{'стало':>10}{'изм.':>9}")
+    for service in ("telegram", "supabase"):
+        old_calls = baseline.get("outbound", {}).get(service, {})
+        new_calls = current["outbound"].get(service, {})
+        for method in sorted(set(old_calls) | set(new_calls)):
+            old, new = old_calls.get(method, 0), new_calls.get(method, 0)
+            if old != new:
+                h.say(f"{f'{service} {method}'[:43]:<44}{old:>10}{new:>10}{change(old, new):>9}")
+        h.say(f"{f'{service} всего':<44}{sum(old_calls.values()):>10}{sum(new_calls.values()):>10}"
+              f"{change(sum(old_calls.values()), sum(new_calls.values())):>9}")
+
+
+async def run(args):
+    records, skipped = read_records(args.paths, args.limit)
+    if not records:
+        print("⚠️ В файлах нет записанных апдейтов")
+        return None
+
+    h = Harness(args.telegram_latency / 1000, args.supabase_latency / 1000, args.jitter / 1000,
+                args.error_rate, log_path=args.log, env={"BROADCAST_RATE": "1000"}, seed=args.seed)
+    await h.start()
+    try:
+        span = records[-1][0] - records[0][0]
+        h.say(f"▶️ Воспроизведение: {len(records)} апдейтов за {span:.0f}с записи"
+              + (f", пропущено битых строк: {skipped}" if skipped else "")
+              + (f", скорость x{args.speed:g}" if args.speed else ", без пауз"))
+        result = await replay(h, records, args)
+        print_report(h, result)
+    finally:
+        await h.close()
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "paths": args.paths,
+            "records": len(records),
+            "speed": args.speed,
+            "max_gap": args.max_gap,
+            "concurrency": args.concurrency,
+            "telegram_latency_ms": args.telegram_latency,
+            "supabase_latency_ms": args.supabase_latency,
+            "jitter_ms": args.jitter,
+            "error_rate": args.error_rate
+        },
+        **result
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(h, report, json.load(f))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        h.say(f"\n💾 Результаты сохранены: {args.save}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов на локальных заглушках")
+    parser.add_argument("paths", nargs="+", help="файлы записи (.jsonl или .jsonl.*.gz)")
+    parser.add_argument("--speed", type=float, default=1, help="ускорение относительно записи (0 - без пауз)")
+    parser.add_argument("--max-gap", type=float, default=5, help="простои длиннее, сек записи, сжимаются до этого значения")
+    parser.add_argument("--concurrency", type=int, default=50, help="апдейтов одновременно при --speed 0")
+    parser.add_argument("--limit", type=int, help="воспроизвести только первые N апдейтов")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--supabase-latency", type=float, default=0, help="задержка ответа Supabase, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов заглушек с ошибкой 500")
+    parser.add_argument("--seed", type=int, default=1, help="seed для задержек и ошибок заглушек")
+    parser.add_argument("--log", default=os.devnull, help="куда писать вывод бота (по умолчанию - никуда)")
+    parser.add_argument("--save", help="сохранить результаты в JSON (базовая линия)")
+    parser.add_argument("--compare", help="сравнить с сохраненной базовой линией")
+    args = parser.parse_args(argv)
+    args.paths = [os.path.abspath(path) for path in args.paths]
+    for path in ("log", "save", "compare"):
+        if getattr(args, path) and getattr(args, path) != os.devnull:
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
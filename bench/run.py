@@ -0,0 +1,233 @@
+"""Бенчмарк сценариев бота на локальных заглушках Telegram и Supabase
+
+Запуск из корня репозитория:
+    python -m bench.run
+    python -m bench.run --flows start,receipt --iterations 500 --concurrency 50
+    python -m bench.run --telegram-latency 40 --supabase-latency 25 --error-rate 0.01
+    python -m bench.run --save bench/baseline.json       # записать базовую линию
+    python -m bench.run --compare bench/baseline.json    # сравнить с базовой линией
+
+Для каждого сценария печатаются p50/p95/p99 задержки обработчика, апдейты в секунду,
+ошибки и число исходящих запросов к Telegram и Supabase на один апдейт."""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+
+from bench.harness import REPO_ROOT, Harness, summarize
+
+FLOWS = ("start", "tariff_selection", "participants", "receipt", "pending", "broadcast")
+
+
+# СЦЕНАРИИ: подготовка состояния (не входит в замер) и апдейт, который замеряется
+async def flow_start(h, user_id):
+    return h.message_update(user_id, "/start")
+
+
+async def flow_tariff_selection(h, user_id):
+    return h.callback_update(user_id, f"tariff_{h.tariff().key}")
+
+
+async def flow_participants(h, user_id):
+    tariff = h.tariff()
+    state = h.state(user_id)
+    await state.set_state(h.g.OrderStates.waiting_for_participants)
+    await state.set_data({"selected_tariff": tariff.key, "event_id": tariff.event_id})
+    return h.message_update(user_id, h.participants_text(tariff.min_people))
+
+
+async def flow_receipt(h, user_id):
+    tariff = h.tariff()
+    state = h.state(user_id)
+    await state.set_state(h.g.OrderStates.waiting_for_receipt)
+    await state.set_data({
+        "selected_tariff": tariff.key,
+        "event_id": tariff.event_id,
+        "tariff_name": tariff.name,
+        "participants": [{"full_name": "Бенчмарк Тестович", "telegram": "@bench", "phone": "79990000000"}] * tariff.min_people,
+        "total_price": tariff.total
+    })
+    return h.message_update(user_id, document=h.receipt_document(user_id))
+
+
+async def flow_pending(h, user_id):
+    return h.message_update(h.g.ADMIN_IDS[user_id % len(h.g.ADMIN_IDS)], "/pending")
+
+
+async def flow_broadcast(h, user_id):
+    admin_id = h.g.ADMIN_IDS[0]
+    state = h.state(admin_id)
+    await state.set_state(h.g.BroadcastState.confirmation)
+    await state.set_data({"broadcast_data": {"type": "text", "content": "Бенчмарк рассылки"}})
+    return h.callback_update(admin_id, "confirm_broadcast")
+
+
+FLOW_BUILDERS = {
+    "start": flow_start,
+    "tariff_selection": flow_tariff_selection,
+    "participants": flow_participants,
+    "receipt": flow_receipt,
+    "pending": flow_pending,
+    "broadcast": flow_broadcast
+}
+
+
+async def wait_background(h, timeout=60):
+    """Ждет фоновую работу, запущенную сценарием (рассылка, загрузка чеков)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not h.g.broadcast_running() and h.g.receipt_archiver.queue.empty():
+            return
+        await asyncio.sleep(0.05)
+
+
+async def run_flow(h, name, iterations, concurrency, user_base):
+    """Прогоняет сценарий iterations раз, не более concurrency апдейтов одновременно"""
+    build = FLOW_BUILDERS[name]
+    # Рассылка выполняется по одной: новая не стартует, пока идет предыдущая
+    if name == "broadcast":
+        concurrency = 1
+    updates = [await build(h, user_base + i) for i in range(iterations)] if name != "broadcast" else None
+    latencies, errors = [], 0
+    telegram_before, supabase_before = h.outbound_calls()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            update = updates[i] if updates is not None else await build(h, user_base + i)
+            elapsed, ok = await h.feed(update)
+            latencies.append(elapsed)
+            errors += not ok
+            if name == "broadcast":
+                await wait_background(h)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(iterations)))
+    elapsed = time.perf_counter() - started
+    await wait_background(h)
+
+    telegram_after, supabase_after = h.outbound_calls()
+    result = summarize(latencies, errors, elapsed)
+    result["telegram_calls_per_update"] = round((telegram_after - telegram_before) / max(iterations, 1), 2)
+    result["supabase_calls_per_update"] = round((supabase_after - supabase_before) / max(iterations, 1), 2)
+    if name == "broadcast":
+        result["recipients"] = len(h.g.load_users())
+        result["broadcast_sec"] = round(elapsed / max(iterations, 1), 2)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(h, current, baseline):
+    """Печатает изменение p50/p95/p99 и пропускной способности относительно базовой линии"""
+    h.say("\n📊 Сравнение с базовой линией "
+          f"({baseline.get('git_revision') or '?'}, {baseline.get('created_at', '?')[:16]}):")
+    h.say(f"{'сценарий':<18}{'метрика':<28}{'было':>10}{'стало':>10}{'изм.':>9}")
+    for flow, result in current["flows"].items():
+        before = baseline.get("flows", {}).get(flow)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "updates_per_sec", "supabase_calls_per_update", "telegram_calls_per_update"):
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.0f}%" if old else "-"
+            h.say(f"{flow:<18}{metric:<28}{old:>10}{new:>10}{change:>9}")
+
+
+async def run(args):
+    env = {"BROADCAST_RATE": str(args.broadcast_rate)}
+    h = Harness(args.telegram_latency / 1000, args.supabase_latency / 1000, args.jitter / 1000,
+                args.error_rate, log_path=args.log, env=env, seed=args.seed)
+    await h.start()
+    flows = [flow for flow in args.flows.split(",") if flow]
+    results = {}
+    try:
+        if "pending" in flows:
+            h.seed_pending_orders(args.pending_orders)
+        if "broadcast" in flows:
+            h.seed_users(args.broadcast_users)
+
+        h.say(f"🏁 Бенчмарк: {len(flows)} сценариев, {args.iterations} апдейтов, параллельно {args.concurrency}")
+        h.say(f"{'сценарий':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'апд/с':>9}{'ошибки':>8}{'tg/апд':>8}{'db/апд':>8}")
+        for index, flow in enumerate(flows):
+            if flow not in FLOW_BUILDERS:
+                h.say(f"⚠️ Неизвестный сценарий {flow}, доступны: {', '.join(FLOWS)}")
+                continue
+            iterations = args.broadcast_iterations if flow == "broadcast" else args.iterations
+            # Warm-up не входит в замер: первый апдейт прогревает кэши и соединения
+            await run_flow(h, flow, min(args.warmup, iterations), args.concurrency, 1_000_000 * (index + 1))
+            result = await run_flow(h, flow, iterations, args.concurrency, 1_000_000 * (index + 1) + 500_000)
+            results[flow] = result
+            h.say(f"{flow:<18}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+                  f"{result['updates_per_sec']:>9}{result['errors']:>8}"
+                  f"{result['telegram_calls_per_update']:>8}{result['supabase_calls_per_update']:>8}")
+    finally:
+        await h.close()
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "telegram_latency_ms": args.telegram_latency,
+            "supabase_latency_ms": args.supabase_latency,
+            "jitter_ms": args.jitter,
+            "error_rate": args.error_rate,
+            "pending_orders": args.pending_orders,
+            "broadcast_users": args.broadcast_users,
+            "broadcast_rate": args.broadcast_rate
+        },
+        "flows": results
+    }
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(h, report, json.load(f))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        h.say(f"\n💾 Результаты сохранены: {args.save}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота на локальных заглушках")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"сценарии через запятую: {', '.join(FLOWS)}")
+    parser.add_argument("--iterations", type=int, default=200, help="апдейтов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=20, help="апдейтов одновременно")
+    parser.add_argument("--warmup", type=int, default=5, help="апдейтов прогрева перед замером")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--supabase-latency", type=float, default=0, help="задержка ответа Supabase, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов заглушек с ошибкой 500")
+    parser.add_argument("--pending-orders", type=int, default=200, help="неподтвержденных заказов для /pending")
+    parser.add_argument("--broadcast-users", type=int, default=1000, help="получателей рассылки")
+    parser.add_argument("--broadcast-rate", type=float, default=1000, help="BROADCAST_RATE бота на время бенчмарка")
+    parser.add_argument("--broadcast-iterations", type=int, default=3, help="рассылок в сценарии broadcast")
+    parser.add_argument("--seed", type=int, default=1, help="seed для задержек и ошибок заглушек")
+    parser.add_argument("--log", default=os.devnull, help="куда писать вывод бота (по умолчанию - никуда)")
+    parser.add_argument("--save", help="сохранить результаты в JSON (базовая линия)")
+    parser.add_argument("--compare", help="сравнить с сохраненной базовой линией")
+    args = parser.parse_args(argv)
+    for path in ("log", "save", "compare"):
+        if getattr(args, path) and getattr(args, path) != os.devnull:
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,48 @@
+-- Каталог мероприятий и тарифов: бот перечитывает его каждые CATALOG_REFRESH_INTERVAL секунд,
+-- новое мероприятие или цена появляются без перезапуска и деплоя.
+-- Выполните в Supabase Dashboard → SQL Editor
+-- Пока таблиц нет, бот продает мероприятие по умолчанию (DEFAULT_EVENT в Gedan_bot.py).
+-- Если таблицы есть, но активных мероприятий нет - продажи закрыты.
+
+create table if not exists public.events (
+    -- id попадает в callback_data кнопок, поэтому короткий латиницей: new-year-2025
+    id text primary key check (char_length(id) <= 40),
+    title text not null,
+    emoji text,
+    date_text text,                -- 27.12.2025
+    time_text text,                -- 20:00
+    place text,
+    description text,              -- HTML: когда, где, что ждет внутри
+    rules text,                    -- HTML; пусто - общие правила площадки
+    perks text,                    -- пункты «Включено» в описании тарифа
+    bonuses text,                  -- бонусы в подтверждении заказа
+    image_path text,               -- картинка рядом с ботом; пусто - без картинки
+    starts_at timestamptz,
+    sort_order integer not null default 0,
+    is_active boolean not null default true,
+    updated_at timestamptz not null default now()
+);
+
+create table if not exists public.tariffs (
+    id bigserial primary key,
+    event_id text not null references public.events (id) on delete cascade,
+    name text not null,
+    tariff_group text not null check (tariff_group in ('male', 'female', 'couple', 'vip')),
+    price integer not null,        -- с человека (у VIP - за комнату)
+    total integer,                 -- за всю группу; пусто - равно price
+    min_people integer not null default 1,
+    max_people integer not null default 1,
+    emoji text,
+    description text,
+    includes text,
+    note text,                     -- пояснение в общем списке тарифов
+    sort_order integer not null default 0,
+    is_active boolean not null default true,
+    updated_at timestamptz not null default now(),
+    unique (event_id, name)
+);
+
+create index if not exists tariffs_event_id_idx on public.tariffs (event_id);
+
+-- Заказ привязывается к мероприятию
+alter table public.orders add column if not exists event_id text references public.events (id);
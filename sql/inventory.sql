@@ -0,0 +1,97 @@
+-- Лимиты мест и брони на время оплаты (после sql/events_catalog.sql)
+-- Выполните в Supabase Dashboard → SQL Editor
+
+-- Сколько заказов можно продать по тарифу (VIP-комнаты и т.п.); пусто - без ограничения
+alter table public.tariffs add column if not exists capacity integer check (capacity >= 0);
+-- Максимум гостей на мероприятии; пусто - без ограничения
+alter table public.events add column if not exists capacity integer check (capacity >= 0);
+
+-- Место, которое держится за пользователем, пока он оплачивает и присылает чек
+create table if not exists public.seat_holds (
+    id text primary key,
+    event_id text not null references public.events (id) on delete cascade,
+    tariff_id bigint not null references public.tariffs (id) on delete cascade,
+    user_id bigint not null,
+    people integer not null,
+    expires_at timestamptz not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists seat_holds_tariff_idx on public.seat_holds (tariff_id, expires_at);
+create index if not exists orders_event_tariff_idx on public.orders (event_id, tariff) where status not in ('canceled', 'expired');
+
+-- Занятые места для сверки счетчиков бота: строка на тариф вместо чтения всех заказов.
+-- Заказы без event_id относятся к мероприятию по умолчанию и считаются всегда
+create or replace function public.active_order_counts()
+returns table (event_id text, tariff text, orders bigint)
+language sql
+stable
+as $$
+    select o.event_id, o.tariff, count(*)
+    from public.orders o
+    left join public.events e on e.id = o.event_id
+    where o.status not in ('canceled', 'expired')
+      and (o.event_id is null or e.is_active)
+    group by o.event_id, o.tariff;
+$$;
+
+-- Атомарная бронь: строки тарифа и мероприятия блокируются, поэтому две реплики бота
+-- не могут одновременно продать последнее место. Возвращает true, если бронь создана.
+create or replace function public.reserve_seat(
+    p_hold_id text,
+    p_tariff_id bigint,
+    p_user_id bigint,
+    p_people integer,
+    p_hold_seconds integer
+)
+returns boolean
+language plpgsql
+as $$
+declare
+    v_tariff public.tariffs%rowtype;
+    v_event public.events%rowtype;
+    v_units integer;
+    v_people integer;
+begin
+    select * into v_tariff from public.tariffs where id = p_tariff_id and is_active for update;
+    if not found then
+        return false;
+    end if;
+    select * into v_event from public.events where id = v_tariff.event_id and is_active for update;
+    if not found then
+        return false;
+    end if;
+
+    -- Истекшие брони больше не занимают места
+    delete from public.seat_holds where tariff_id = p_tariff_id and expires_at <= now();
+
+    if v_tariff.capacity is not null then
+        select
+            (select count(*) from public.orders o
+              where o.event_id = v_tariff.event_id and o.tariff = v_tariff.name and o.status not in ('canceled', 'expired'))
+          + (select count(*) from public.seat_holds h
+              where h.tariff_id = p_tariff_id and h.expires_at > now())
+        into v_units;
+        if v_units >= v_tariff.capacity then
+            return false;
+        end if;
+    end if;
+
+    if v_event.capacity is not null then
+        select
+            coalesce((select sum(jsonb_array_length(o.participants::jsonb)) from public.orders o
+                       where o.event_id = v_event.id and o.status not in ('canceled', 'expired')), 0)
+          + coalesce((select sum(h.people) from public.seat_holds h
+                       where h.event_id = v_event.id and h.expires_at > now()), 0)
+        into v_people;
+        if v_people + p_people > v_event.capacity then
+            return false;
+        end if;
+    end if;
+
+    insert into public.seat_holds (id, event_id, tariff_id, user_id, people, expires_at)
+    values (p_hold_id, v_event.id, p_tariff_id, p_user_id, p_people, now() + make_interval(secs => p_hold_seconds))
+    on conflict (id) do nothing;
+    return true;
+end;
+$$;
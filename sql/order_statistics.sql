@@ -0,0 +1,20 @@
+-- Агрегированная статистика заказов за один запрос (используется /stats)
+-- Выполните в Supabase Dashboard → SQL Editor
+create or replace function public.order_statistics(day_start timestamptz, day_end timestamptz)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'total_orders',   count(*),
+        'paid_orders',    count(*) filter (where status = 'paid'),
+        'pending_orders', count(*) filter (where status = 'pending'),
+        'total_revenue',  coalesce(sum(total_price) filter (where status = 'paid'), 0),
+        'unique_users',   count(distinct user_id),
+        'today_orders',   count(*) filter (where created_at >= day_start and created_at < day_end),
+        'today_revenue',  coalesce(sum(total_price) filter (
+                              where status = 'paid' and created_at >= day_start and created_at < day_end
+                          ), 0)
+    )
+    from public.orders;
+$$;
@@ -0,0 +1,6 @@
+-- Идемпотентное сохранение заказов из локального журнала бота
+-- Выполните в Supabase Dashboard → SQL Editor
+-- client_ref - id заказа, выданный ботом до отправки в Supabase: повторная
+-- отправка того же заказа (после таймаута или сбоя) не создает дубль
+alter table public.orders add column if not exists client_ref text;
+create unique index if not exists orders_client_ref_key on public.orders (client_ref);
@@ -0,0 +1,10 @@
+-- Постраничные списки заказов в админке (/orders, /paid)
+-- Выполните в Supabase Dashboard → SQL Editor
+
+-- Число участников без чтения JSON (списки не выбирают колонку participants)
+alter table public.orders add column if not exists participants_count integer
+    generated always as (jsonb_array_length(participants::jsonb)) stored;
+
+-- Keyset-пагинация по (created_at, id): страница читается по индексу, без offset
+create index if not exists orders_created_id_idx on public.orders (created_at desc, id desc);
+create index if not exists orders_status_created_id_idx on public.orders (status, created_at desc, id desc);
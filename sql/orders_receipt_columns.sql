@@ -0,0 +1,7 @@
+-- Колонки заказа для быстрой работы с чеками
+-- Выполните в Supabase Dashboard → SQL Editor
+alter table public.orders add column if not exists receipt_file_name text;
+alter table public.orders add column if not exists receipt_file_url text;
+-- Telegram file_id чека: админам чек пересылается по нему, без скачивания из Storage
+alter table public.orders add column if not exists receipt_file_id text;
+alter table public.orders add column if not exists receipt_file_type text;
@@ -0,0 +1,11 @@
+-- Фоновая загрузка чеков в Storage (после sql/orders_receipt_columns.sql)
+-- Выполните в Supabase Dashboard → SQL Editor
+-- Заказ сохраняется сразу с file_id чека, копия файла загружается в Storage в фоне
+alter table public.orders add column if not exists receipt_file_unique_id text;
+-- queued | retrying | archived | failed
+alter table public.orders add column if not exists processing_status text;
+alter table public.orders add column if not exists processing_attempts integer not null default 0;
+
+-- Поиск незагруженных чеков при старте бота
+create index if not exists orders_processing_status_idx on public.orders (processing_status)
+    where processing_status in ('queued', 'retrying');
@@ -0,0 +1,82 @@
+"""Рассылка: лимит скорости, курсор и продолжение после перезапуска
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from bench.harness import Harness
+
+TEXT = {"type": "text", "content": "Новость"}
+
+
+class BroadcastTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+        self.path = os.path.join(tempfile.mkdtemp(prefix="gedan-broadcast-"), "broadcast_job.json")
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def job(self, count=10):
+        return self.g.BroadcastJob.create(TEXT, range(1, count + 1), chat_id=1, message_id=1,
+                                          admin_id=1, admin_username="admin")
+
+    async def test_bucket_allows_burst_then_limits_rate(self):
+        bucket = self.g.TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.05)
+        for _ in range(5):
+            await bucket.acquire()
+        # Еще 5 токенов при 50 в секунду - не быстрее 0.1с
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    async def test_bucket_pause_stops_sending(self):
+        bucket = self.g.TokenBucket(rate=1000)
+        bucket.pause(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    async def test_cursor_moves_over_finished_prefix_only(self):
+        job = self.job()
+        job.mark_done(1, "ok")
+        job.mark_done(2, "blocked")
+        self.assertEqual(job.data['cursor'], 0)
+        self.assertEqual(job.done_ahead, {1, 2})
+
+        job.mark_done(0, "failed")
+        self.assertEqual(job.data['cursor'], 3)
+        self.assertEqual(job.done_ahead, set())
+        self.assertEqual((job.data['success'], job.data['blocked'], job.data['failed']), (1, 1, 1))
+
+    async def test_resumed_job_skips_processed_recipients(self):
+        job = self.job()
+        for index, result in ((0, "ok"), (1, "ok"), (2, "blocked"), (5, "ok")):
+            job.mark_done(index, result)
+        await job.persist(self.path)
+
+        resumed = self.g.BroadcastJob.load(self.path)
+        self.assertEqual(resumed.next_index, 3)
+        self.assertEqual(resumed.done_ahead, {5})
+
+        sent_before = self.h.telegram.calls["sendMessage"]
+        await self.g.run_broadcast(resumed)
+        # Из 10 получателей обработаны 0-2 и 5: отправить осталось шестерым
+        self.assertEqual(self.h.telegram.calls["sendMessage"] - sent_before, 6)
+        self.assertEqual(resumed.data['cursor'], 10)
+        self.assertEqual(resumed.data['success'], 3 + 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Разбор номеров заказов для /bulk
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import unittest
+
+from bench.harness import Harness
+
+
+class ParseOrderIdsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    async def test_numbers_and_ranges(self):
+        self.assertEqual(self.g.parse_order_ids("12 15-20, 31"), [12, 15, 16, 17, 18, 19, 20, 31])
+
+    async def test_duplicates_are_merged_and_sorted(self):
+        self.assertEqual(self.g.parse_order_ids("7,3 5-7 3"), [3, 5, 6, 7])
+
+    async def test_reversed_range(self):
+        self.assertEqual(self.g.parse_order_ids("20-18"), [18, 19, 20])
+
+    async def test_empty_input(self):
+        self.assertEqual(self.g.parse_order_ids(" , "), [])
+
+    async def test_invalid_tokens(self):
+        for args in ("12a", "-5", "5-", "1-2-3", "#12", "1.5"):
+            with self.subTest(args=args), self.assertRaises(ValueError):
+                self.g.parse_order_ids(args)
+
+    async def test_range_limit(self):
+        limit = self.g.BULK_MAX_ORDERS
+        self.assertEqual(len(self.g.parse_order_ids(f"1-{limit}")), limit)
+        with self.assertRaises(ValueError):
+            self.g.parse_order_ids(f"1-{limit + 1}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Предохранитель Supabase видит настоящие ошибки запросов
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import time
+import unittest
+
+from bench.harness import Harness
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Свежий импорт бота: клиент Supabase должен смотреть на заглушку этого теста
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.adb = self.h.g.adb
+        # Проверки при запуске идут в фоне; их успешные запросы не должны смешиваться с тестом
+        for task in list(self.h.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def open_breaker(self):
+        """Цепь разомкнута, и пауза уже прошла: следующий запрос - пробный"""
+        breaker = self.adb.breaker
+        breaker.failures = breaker.threshold
+        breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+        breaker.probing = False
+
+    async def test_failed_probe_keeps_breaker_open(self):
+        self.h.supabase.error_rate = 1.0
+        self.open_breaker()
+        self.assertIsNone(await self.adb.get_order_by_id(1))
+        self.assertEqual(self.adb.breaker.state, "open")
+        # Следующий запрос отклоняется сразу, не доходя до Supabase
+        calls = sum(self.h.supabase.calls.values())
+        self.assertEqual(await self.adb.get_orders_page(), None)
+        self.assertEqual(sum(self.h.supabase.calls.values()), calls)
+
+        # Supabase поднялся: пробный запрос замыкает цепь
+        self.h.supabase.error_rate = 0.0
+        self.open_breaker()
+        self.assertIsNone(await self.adb.get_order_by_id(1))
+        self.assertEqual(self.adb.breaker.state, "closed")
+
+    async def test_failures_are_counted(self):
+        self.h.supabase.error_rate = 1.0
+        for _ in range(self.adb.breaker.threshold):
+            self.assertIsNone(await self.adb.get_order_by_id(1))
+        self.assertEqual(self.adb.breaker.state, "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
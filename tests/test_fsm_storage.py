@@ -0,0 +1,106 @@
+"""FSM-хранилище в SQLite: сброс на диск, перезапуск и срок жизни сессий
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bench.harness import Harness
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+class SQLiteStorageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+        self.path = os.path.join(tempfile.mkdtemp(prefix="gedan-fsm-"), "local.db")
+        self.storage = self.g.SQLiteStorage(path=self.path, ttl=60)
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        await self.h.close()
+
+    def reopen(self, ttl=60):
+        """Новый экземпляр на том же файле - как после перезапуска бота"""
+        return self.g.SQLiteStorage(path=self.path, ttl=ttl)
+
+    async def test_session_survives_restart(self):
+        await self.storage.set_state(key(1), "Checkout:waiting_receipt")
+        await self.storage.set_data(key(1), {"tariff": "VIP", "participants": [{"full_name": "Тест"}]})
+        self.storage.flush()
+
+        restarted = self.reopen()
+        try:
+            self.assertEqual(await restarted.get_state(key(1)), "Checkout:waiting_receipt")
+            self.assertEqual(await restarted.get_data(key(1)), {"tariff": "VIP", "participants": [{"full_name": "Тест"}]})
+        finally:
+            await restarted.close()
+
+    async def test_cleared_session_is_deleted(self):
+        await self.storage.set_state(key(1), "Checkout:waiting_receipt")
+        self.storage.flush()
+        await self.storage.set_state(key(1), None)
+        self.storage.flush()
+        # Пустая сессия остается в кэше пустой, а в SQLite ее больше нет
+        self.assertIsNone(await self.storage.get_state(key(1)))
+        self.assertEqual(self.storage.writer.execute("SELECT COUNT(*) FROM fsm").fetchone()[0], 0)
+
+    async def test_expired_session_is_empty(self):
+        await self.storage.set_state(key(1), "Checkout:waiting_receipt")
+        await self.storage.set_data(key(1), {"tariff": "VIP"})
+        self.storage.flush()
+        with self.storage.writer:
+            self.storage.writer.execute("UPDATE fsm SET updated_at = updated_at - 120")
+
+        restarted = self.reopen()
+        try:
+            self.assertIsNone(await restarted.get_state(key(1)))
+            self.assertEqual(await restarted.get_data(key(1)), {})
+            restarted.flush()
+            self.assertEqual(restarted.writer.execute("SELECT COUNT(*) FROM fsm").fetchone()[0], 0)
+        finally:
+            await restarted.close()
+
+    async def test_changes_during_flush_are_kept(self):
+        stop = threading.Event()
+
+        def flush_loop():
+            while not stop.is_set():
+                self.storage.flush()
+
+        flusher = asyncio.create_task(asyncio.to_thread(flush_loop))
+        try:
+            for round_ in range(20):
+                for user_id in range(10):
+                    # Сессия то очищается, то снова заполняется, пока в потоке идет сброс
+                    await self.storage.set_state(key(user_id), None if round_ % 2 else f"round{round_}")
+                    await self.storage.set_data(key(user_id), {"round": round_})
+                await asyncio.sleep(0)
+        finally:
+            stop.set()
+            await flusher
+        self.storage.flush()
+
+        restarted = self.reopen()
+        try:
+            for user_id in range(10):
+                self.assertEqual(await restarted.get_data(key(user_id)), {"round": 19})
+        finally:
+            await restarted.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Учет мест: подсчет заказов в базе и бронь заказа, который пока только в журнале
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import unittest
+
+from bench.harness import Harness
+
+EVENTS = [
+    {"id": "main", "title": "Мероприятие", "is_active": True, "sort_order": 0, "starts_at": "2026-12-01"},
+    {"id": "past", "title": "Прошедшее", "is_active": False, "sort_order": 1, "starts_at": "2025-12-01"}
+]
+TARIFFS = [
+    {"id": 1, "event_id": "main", "name": "VIP", "price": 1000, "min_people": 1, "max_people": 1,
+     "tariff_group": "vip", "capacity": 2, "is_active": True, "sort_order": 0},
+    {"id": 2, "event_id": "past", "name": "VIP", "price": 1000, "min_people": 1, "max_people": 1,
+     "tariff_group": "vip", "is_active": True, "sort_order": 0}
+]
+
+
+def order(event_id, status="pending"):
+    return {"user_id": 1, "username": "test", "tariff": "VIP", "event_id": event_id, "status": status,
+            "participants": [{"full_name": "Тест Тестович", "telegram": "@test", "phone": "79990000000"}],
+            "total_price": 1000}
+
+
+class InventoryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = Harness()
+        self.h.supabase.seed("events", EVENTS)
+        self.h.supabase.seed("tariffs", TARIFFS)
+        self.h.supabase.seed("orders", [order("main"), order("main", "canceled"), order("past"), order("past")])
+        await self.h.start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    async def test_counts_come_from_one_rpc(self):
+        rpc_calls, reads = self.h.supabase.calls["POST rpc"], self.h.supabase.calls["GET orders"]
+        counts = await self.g.adb.count_active_orders()
+        self.assertEqual(counts, {("main", "VIP"): 1})
+        self.assertEqual(self.h.supabase.calls["POST rpc"] - rpc_calls, 1)
+        self.assertEqual(self.h.supabase.calls["GET orders"], reads)
+
+    async def test_legacy_count_without_rpc(self):
+        def missing_rpc(name, params):
+            raise self.g.PostgrestAPIError({"code": "PGRST202", "message": f"Could not find the function public.{name}"})
+        self.g.db.supabase.rpc = missing_rpc
+        counts = await self.g.adb.count_active_orders()
+        self.assertEqual(counts[("main", "VIP")], 1)
+        self.assertFalse(self.g.db.order_counts_rpc)
+
+    async def test_hold_of_journaled_order_is_kept_until_stored(self):
+        inventory = self.g.inventory
+        tariff = self.g.catalog_snapshot.tariffs["1"]
+        hold_id = await inventory.reserve(5, tariff)
+        self.assertIsNotNone(hold_id)
+        self.assertEqual(inventory.taken["1"], 2)
+
+        deletes = self.h.supabase.calls["DELETE seat_holds"]
+        await inventory.confirm(hold_id, "VIP", "main", stored=False)
+        self.assertEqual(self.h.supabase.calls["DELETE seat_holds"], deletes)
+        # Сверка не теряет место: заказа в базе еще нет, но бронь держится
+        await inventory.reconcile()
+        self.assertEqual(inventory.taken["1"], 2)
+        self.assertFalse(inventory.has_room(tariff))
+
+        await inventory.order_stored(hold_id)
+        self.assertEqual(self.h.supabase.calls["DELETE seat_holds"], deletes + 1)
+        self.assertNotIn(hold_id, inventory.holds)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Логи действий: ротация файлов и переполнение очереди
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from bench.harness import Harness
+
+
+class LogPipelineTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+        self.directory = tempfile.mkdtemp(prefix="gedan-logs-")
+        self.file_name = os.path.join(self.directory, "actions.txt")
+        self.pipeline = self.g.LogPipeline()
+        self.g.LOG_MAX_BYTES = 10
+        self.g.LOG_BACKUP_COUNT = 7
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def rotate(self, text):
+        with open(self.file_name, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.pipeline.rotate_if_needed(self.file_name)
+
+    def archives(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".gz"))
+
+    def archived_texts(self):
+        texts = set()
+        for name in self.archives():
+            with gzip.open(os.path.join(self.directory, name), "rt", encoding="utf-8") as f:
+                texts.add(f.read())
+        return texts
+
+    async def test_small_file_is_not_rotated(self):
+        self.rotate("short")
+        self.pipeline.rotate_if_needed(self.file_name)
+        self.assertTrue(os.path.exists(self.file_name))
+        self.assertEqual(self.archives(), [])
+
+    async def test_rotations_in_one_second_keep_every_archive(self):
+        for part in range(3):
+            self.rotate(f"часть {part} " * 5)
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertEqual(len(self.archives()), 3)
+        self.assertEqual(self.archived_texts(), {f"часть {part} " * 5 for part in range(3)})
+
+    async def test_only_newest_archives_are_kept(self):
+        self.g.LOG_BACKUP_COUNT = 2
+        for part in range(4):
+            self.rotate(f"часть {part} " * 5)
+        self.assertEqual(self.archived_texts(), {f"часть {part} " * 5 for part in (2, 3)})
+
+    async def test_zero_backups_keeps_no_archives(self):
+        self.g.LOG_BACKUP_COUNT = 0
+        self.rotate("часть 0 " * 5)
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertEqual(self.archives(), [])
+
+    async def test_full_queue_in_event_loop_does_not_write_there(self):
+        pipeline = self.g.LogPipeline(max_size=2, policy="block")
+        pipeline.loop_thread_id = threading.get_ident()
+        pipeline.wakeup = asyncio.Event()
+        for number in range(5):
+            pipeline.emit(self.file_name, f"строка {number}")
+        # Ничего не записано синхронно, но фоновая запись уже разбужена
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertTrue(pipeline.wakeup.is_set())
+
+        self.assertEqual(await asyncio.to_thread(pipeline.flush), 5)
+        with open(self.file_name, encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines(), [f"строка {number}" for number in range(5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Кэш file_id картинок: сброс только при недействительном file_id
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import unittest
+
+from aiogram.exceptions import TelegramBadRequest
+
+from bench.harness import Harness
+
+IMAGE = "event_image.jpg"
+
+
+class MediaCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+        self.cache = self.g.media_cache
+        self.file_hash = self.cache.file_hash(IMAGE)
+        self.cache.remember(self.file_hash, "cached-file-id")
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def reject_cached_file_id(self, message):
+        """Telegram отвечает BadRequest на отправку по сохраненному file_id"""
+        send_photo = self.g.bot.send_photo
+
+        async def rejecting_send_photo(chat_id, photo, **kwargs):
+            if photo == "cached-file-id":
+                raise TelegramBadRequest(method=None, message=message)
+            return await send_photo(chat_id, photo, **kwargs)
+        self.g.bot.send_photo = rejecting_send_photo
+
+    async def test_stale_file_id_is_uploaded_again(self):
+        self.reject_cached_file_id("Bad Request: wrong file identifier/HTTP URL specified")
+        sent = await self.cache.send_photo(1, IMAGE)
+        self.assertIsNotNone(sent)
+        self.assertNotEqual(self.cache.file_ids[self.file_hash], "cached-file-id")
+        stored = self.cache.connection.execute(
+            "SELECT file_id FROM media_cache WHERE file_hash = ?", (self.file_hash,)).fetchone()
+        self.assertEqual(stored[0], self.cache.file_ids[self.file_hash])
+
+    async def test_other_bad_request_keeps_file_id(self):
+        self.reject_cached_file_id("Bad Request: can't parse entities: unsupported start tag")
+        uploads = self.h.telegram.calls["sendPhoto"]
+        with self.assertRaises(TelegramBadRequest):
+            await self.cache.send_photo(1, IMAGE, caption="<b>", parse_mode="HTML")
+        self.assertEqual(self.cache.file_ids[self.file_hash], "cached-file-id")
+        self.assertEqual(self.h.telegram.calls["sendPhoto"], uploads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Бот работает с базой, где не применены необязательные миграции из sql/
+
+Заглушка Supabase отвечает на колонки из missing_columns так же, как PostgREST
+без миграции: PGRST204 на запись, 42703 на чтение.
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import unittest
+
+from bench.harness import Harness
+
+RECEIPT = {"file_id": "receipt-file", "file_unique_id": "receipt-unique", "file_type": "document"}
+PARTICIPANTS = [{"full_name": "Тест Тестович", "telegram": "@test", "phone": "79990000000"}]
+
+
+class MissingMigrationsTest(unittest.IsolatedAsyncioTestCase):
+    missing_columns = {"receipt_file_unique_id", "processing_status", "processing_attempts"}
+
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = Harness()
+        self.h.supabase.missing_columns = {"orders": set(self.missing_columns)}
+        await self.h.start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def stored(self, order_id):
+        return next(row for row in self.h.supabase.tables["orders"] if row["id"] == order_id)
+
+    async def add_order(self, receipt=RECEIPT, client_ref=None):
+        return await self.g.adb.add_order(1, "test", "Тариф", PARTICIPANTS, 1000, receipt=receipt, client_ref=client_ref)
+
+    async def test_order_with_receipt_is_saved(self):
+        order = await self.add_order(client_ref="ref-1")
+        self.assertIsNotNone(order)
+        self.assertEqual(self.stored(order["id"])["receipt_file_id"], "receipt-file")
+        self.assertLessEqual({"receipt_file_unique_id", "processing_status"}, self.g.db.missing_order_columns)
+        self.assertEqual(self.g.adb.breaker.failures, 0)
+
+    async def test_archived_receipt_link_is_saved(self):
+        order = await self.add_order()
+        result = await self.g.upload_receipt_to_supabase(self.g.bot, "receipt-file", "document", order["id"], {"user_id": 1})
+        self.assertIsNotNone(result)
+        row = self.stored(order["id"])
+        self.assertEqual(row["receipt_file_name"], result["file_name"])
+        self.assertEqual(row["receipt_file_url"], result["public_url"])
+
+    async def test_unsaved_link_is_a_failed_attempt(self):
+        # Заказа нет - ссылку сохранить некуда, загрузка должна уйти на повтор
+        result = await self.g.upload_receipt_to_supabase(self.g.bot, "receipt-file", "document", 999, {"user_id": 1})
+        self.assertIsNone(result)
+
+
+class MissingReceiptColumnsTest(MissingMigrationsTest):
+    """Не применена и sql/orders_receipt_columns.sql: file_id чека живет только в кэше и задаче архивации"""
+    missing_columns = MissingMigrationsTest.missing_columns | {"receipt_file_id", "receipt_file_type"}
+
+    async def test_order_with_receipt_is_saved(self):
+        order = await self.add_order(client_ref="ref-1")
+        self.assertIsNotNone(order)
+        self.assertNotIn("receipt_file_id", self.stored(order["id"]))
+        self.assertLessEqual({"receipt_file_id", "receipt_file_type"}, self.g.db.missing_order_columns)
+        self.assertEqual(self.g.adb.breaker.failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
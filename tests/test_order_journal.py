@@ -0,0 +1,95 @@
+"""Досылка заказов из локального журнала: сбой Supabase и отказ по одному заказу
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import sys
+import unittest
+
+from bench.harness import Harness
+
+RECEIPT = {"file_id": "receipt-file", "file_unique_id": "receipt-unique", "file_type": "document"}
+
+
+def payload(user_id):
+    return {"user_id": user_id, "username": f"user{user_id}", "tariff": "Тариф", "total_price": 1000,
+            "participants": [{"full_name": "Тест Тестович", "telegram": "@test", "phone": "79990000000"}],
+            "event_id": None, "receipt": RECEIPT}
+
+
+class OrderJournalTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        self.journal = self.g.order_journal
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+        # Заказ пользователя 13 нарушает внешний ключ (например, мероприятие удалено)
+        insert_order = self.g.db.insert_order
+
+        def rejecting_insert(user_id, *args, **kwargs):
+            if user_id == 13:
+                raise self.g.PostgrestAPIError({"code": "23503", "message": "violates foreign key constraint"})
+            return insert_order(user_id, *args, **kwargs)
+        rejecting_insert.__name__ = "insert_order"
+        self.g.db.insert_order = rejecting_insert
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def append(self, client_ref, user_id):
+        self.journal.append(client_ref, payload(user_id))
+        self.make_due()
+
+    def make_due(self):
+        with self.journal.connection:
+            self.journal.connection.execute("UPDATE order_journal SET next_attempt_at = 0")
+
+    def row(self, client_ref):
+        return self.journal.connection.execute(
+            "SELECT order_id, errors, dead_at FROM order_journal WHERE client_ref = ?", (client_ref,)).fetchone()
+
+    async def test_rejected_order_does_not_block_the_queue(self):
+        self.append("poison", 13)
+        self.append("good", 14)
+        await self.journal.replay_due()
+
+        order_id, errors, dead_at = self.row("poison")
+        self.assertIsNone(order_id)
+        self.assertEqual(errors, 1)
+        self.assertIsNotNone(self.row("good")[0])
+        self.assertEqual(self.g.adb.breaker.failures, 0)
+
+    async def test_rejected_order_is_set_aside_with_alert(self):
+        self.append("poison", 13)
+        sent_before = self.h.telegram.calls["sendMessage"]
+        for _ in range(self.g.JOURNAL_MAX_ERRORS):
+            self.make_due()
+            await self.journal.replay_due()
+
+        self.assertIsNotNone(self.row("poison")[2])
+        self.assertEqual(self.journal.unsynced(), [])
+        self.assertEqual([row[0] for row in self.journal.dead()], ["poison"])
+        self.assertEqual(self.h.telegram.calls["sendMessage"] - sent_before, len(self.g.ADMIN_IDS))
+
+    async def test_outage_keeps_orders_waiting(self):
+        self.append("first", 14)
+        self.append("second", 15)
+        self.h.supabase.error_rate = 1.0
+        for _ in range(self.g.JOURNAL_MAX_ERRORS + 1):
+            self.make_due()
+            await self.journal.replay_due()
+            self.g.adb.breaker.record_success()
+        self.h.supabase.error_rate = 0.0
+
+        self.assertEqual(self.journal.dead(), [])
+        self.assertEqual(self.row("first")[1], 0)
+        self.make_due()
+        await self.journal.replay_due()
+        self.assertEqual(self.journal.unsynced(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Таймеры сроков: порядок срабатывания, отмена и восстановление корзин после перезапуска
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bench.harness import Harness
+
+
+class DeadlineSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+        self.scheduler = self.g.DeadlineScheduler()
+        self.runner = asyncio.create_task(self.scheduler.run())
+        self.fired = []
+
+    async def asyncTearDown(self):
+        self.runner.cancel()
+        await self.h.close()
+
+    async def record(self, name):
+        self.fired.append(name)
+
+    def schedule(self, name, delay):
+        self.scheduler.schedule(("test", name), time.time() + delay, self.record, name)
+
+    async def test_timers_fire_in_deadline_order(self):
+        self.schedule("third", 0.06)
+        self.schedule("first", 0.02)
+        self.schedule("second", 0.04)
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.fired, ["first", "second", "third"])
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_cancel_and_reschedule(self):
+        self.schedule("canceled", 0.02)
+        self.schedule("moved", 0.02)
+        self.schedule("kept", 0.04)
+        self.scheduler.cancel(("test", "canceled"))
+        # Повторный schedule с тем же ключом переносит срок, а не добавляет второй таймер
+        self.schedule("moved", 0.06)
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.fired, ["kept", "moved"])
+
+    async def test_earlier_timer_wakes_sleeping_scheduler(self):
+        self.schedule("late", 5)
+        await asyncio.sleep(0.01)
+        self.schedule("early", 0.02)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.fired, ["early"])
+
+    async def test_checkout_timers_are_rebuilt_from_storage(self):
+        storage = self.g.SQLiteStorage(path=os.path.join(tempfile.mkdtemp(prefix="gedan-fsm-"), "local.db"))
+        self.g.storage = storage
+        try:
+            for user_id, state in ((1, self.g.OrderStates.waiting_for_receipt),
+                                   (2, self.g.OrderStates.waiting_for_payment),
+                                   (3, None)):
+                await storage.set_state(StorageKey(bot_id=self.g.bot.id, chat_id=user_id, user_id=user_id), state)
+            storage.flush()
+
+            self.assertEqual(self.g.arm_checkout_timers(), 2)
+            self.assertEqual({key for key in self.g.scheduler.entries if key[0] == "checkout"},
+                             {("checkout", 1), ("checkout", 2)})
+            deadline = self.g.scheduler.entries[("checkout", 1)][0]
+            self.assertAlmostEqual(deadline, time.time() + self.g.CHECKOUT_TTL, delta=5)
+        finally:
+            await storage.close()
+
+    async def test_checkout_ttl_must_be_shorter_than_session_ttl(self):
+        sys.modules.pop("Gedan_bot", None)
+        harness = Harness(env={"CHECKOUT_TTL": "3600", "FSM_TTL": "3600"})
+        try:
+            with self.assertRaises(ValueError):
+                await harness.start()
+        finally:
+            await harness.close()
+            for name in harness.env:
+                os.environ.pop(name, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
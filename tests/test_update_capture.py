@@ -0,0 +1,79 @@
+"""Обезличивание записанных апдейтов (python -m bench.replay)
+
+Запуск из корня репозитория:
+    python -m unittest discover tests"""
+import json
+import sys
+import unittest
+
+from bench.harness import Harness
+
+USER = {"id": 555000111, "is_bot": False, "first_name": "Иван", "last_name": "Петров", "username": "ivan_petrov"}
+PARTICIPANT = "Иван Петров, @ivan_petrov, 79991234567"
+PII = ("555000111", "Иван", "Петров", "ivan_petrov", "79991234567", "passport_scan", "secret-file-id", "secret-unique-id")
+
+
+def message(**fields):
+    return {"update_id": 1, "message": {"message_id": 10, "date": 1760000000, "from": USER,
+                                         "chat": {"id": USER["id"], "type": "private", "first_name": "Иван", "username": "ivan_petrov"},
+                                         **fields}}
+
+
+class CaptureAnonymizeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        sys.modules.pop("Gedan_bot", None)
+        self.h = await Harness().start()
+        self.g = self.h.g
+        for task in list(self.g.background_tasks):
+            if task.get_coro().__name__ == "run_startup_checks":
+                await task
+
+    async def asyncTearDown(self):
+        await self.h.close()
+
+    def anonymize(self, update):
+        return self.g.capture_anonymize(update)
+
+    async def test_no_personal_data_is_left(self):
+        update = message(text=PARTICIPANT,
+                         contact={"phone_number": "79991234567", "first_name": "Иван", "user_id": USER["id"]},
+                         document={"file_id": "secret-file-id", "file_unique_id": "secret-unique-id",
+                                   "file_name": "passport_scan.PDF", "mime_type": "application/pdf"})
+        dumped = json.dumps(self.anonymize(update), ensure_ascii=False)
+        for value in PII:
+            self.assertNotIn(value, dumped)
+
+    async def test_structure_stays_replayable(self):
+        result = self.anonymize(message(text=PARTICIPANT,
+                                        document={"file_id": "secret-file-id", "file_name": "passport_scan.PDF"}))["message"]
+        # Личный чат: id чата и пользователя совпадают и после замены
+        self.assertEqual(result["from"]["id"], result["chat"]["id"])
+        self.assertNotIn("last_name", result["from"])
+        self.assertEqual(result["document"]["file_name"], "file.pdf")
+        # Та же длина, запятые, @ и цифры телефона - обработчик данных участников примет строку
+        text = result["text"]
+        self.assertEqual(len(text), len(PARTICIPANT))
+        self.assertEqual(text.count(","), 2)
+        self.assertIn("@", text)
+        self.assertTrue(text.split(", ")[2].isdigit())
+
+    async def test_pseudonyms_are_stable(self):
+        first = self.anonymize(message(text="1"))
+        second = self.anonymize(message(text="2"))
+        self.assertEqual(first["message"]["from"], second["message"]["from"])
+        self.assertNotEqual(self.g.capture_pseudonym(1), self.g.capture_pseudonym(2))
+        self.assertLess(self.g.capture_pseudonym(-100123), 0)
+
+    async def test_commands_menu_buttons_and_admins_are_kept(self):
+        admin_id = self.g.ADMIN_IDS[0]
+        result = self.anonymize({"update_id": 2, "message": {"message_id": 1, "date": 1760000000, "text": "/start",
+                                                             "from": {"id": admin_id, "is_bot": False, "first_name": "Админ"},
+                                                             "chat": {"id": admin_id, "type": "private"}}})["message"]
+        self.assertEqual(result["text"], "/start")
+        self.assertEqual(result["from"]["id"], admin_id)
+        for text in self.g.MENU_BUTTON_TEXTS:
+            self.assertEqual(self.g.capture_scrub_text(text), text)
+
+
+if __name__ == "__main__":
+    unittest.main()